@@ -0,0 +1,299 @@
+#admission.py
+"""
+Admission control for common-pattern mining.
+
+Mining builds an index of every n-gram of each length from the longest
+shared length down to min_length. On two large, similar uploads that index
+(about (180 + 8 * length) bytes per n-gram in dicts) can grow to many GB.
+plan_analysis() estimates the memory and time of the exact analysis from
+the token counts and the longest shared n-gram length, then picks the first
+strategy that fits the budget:
+
+    exact   - in-memory index, results as requested
+    disk    - the same results from an n-gram index spilled to SQLite
+              (text_analyzer.SqliteNgramIndex); slower, bounded memory
+    capped  - max_length lowered (and top_k limited to CAPPED_TOP_K) until
+              the estimate fits; results are a truncated approximation
+
+The estimate also covers the miner's sub-pattern filter: exact window ids
+for text 1 (one int64 array per power-of-two length up to the longest, plus
+the temporaries of building them) and the set of sub-strings of reported
+words, bounded by the words both texts contain.
+
+The longest shared length is found up front with a rolling hash over NumPy
+arrays, which needs O(n) memory whatever the length, and is passed on to
+the miner so it does not have to run its own search.
+
+Budgets come from ANALYSIS_MEMORY_MB (default 1024) and
+ANALYSIS_TIME_SECONDS (default 300); ANALYSIS_SPILL_DIR sets where the disk
+index is written (default: the system temp directory).
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# 見積もりの係数 (text_analyzer の索引を、ほぼ同一の2テキストと
+# 無関係な2テキストに共通部分を1つ埋め込んだものとで実測した値)
+MEMORY_ENTRY_BYTES = 180 # n-gram 1件あたりの dict / tuple / bytes の固定分
+MEMORY_TOKEN_BYTES = 8 # n-gram の長さ1トークンあたり (テキスト + 品詞の bytes キー)
+MEMORY_ENTRY_SECONDS = 1.6e-6
+MEMORY_TOKEN_SECONDS = 5e-9
+SQLITE_ENTRY_BYTES = 48 # ディスク上の行の固定分
+SQLITE_ENTRY_SECONDS = 6e-6
+SQLITE_TOKEN_SECONDS = 4e-8
+# 一致した n-gram 1件あたりのパターン生成 (部分パターンの除外と文字列の結合) の時間
+MATCH_SECONDS = 2.5e-7
+# 部分パターンの除外 (text_analyzer._SubPatternFilter) の分
+WINDOW_ID_BYTES = 8 # テキスト1のトークン1つ・長さの段1つあたりの int64 の順位
+WINDOW_ID_BUILD_ARRAYS = 7 # 順位を作るときの一時配列 (np.unique のソートと逆引き) の数
+SUBSTRING_BYTES = 96 # 単語の部分文字列1つあたりの str と set の分 (重複なしとした上限)
+LONG_WORD = 64 # _SubPatternFilter.LONG_WORD: これより長い単語の部分文字列は作られない
+SQLITE_CACHE_MB = 64 # 上限。予算が小さいときは予算の半分まで下げる
+
+CAPPED_TOP_K = 1000
+
+_HASH_BASE = np.uint64(0x9E3779B97F4A7C15) # 奇数なので 2**64 を法とする逆元がある
+_HASH_BASE_INVERSE = np.uint64(pow(0x9E3779B97F4A7C15, -1, 2 ** 64))
+
+
+def memory_budget_mb():
+    return float(os.environ.get('ANALYSIS_MEMORY_MB', 1024))
+
+
+def time_budget_seconds():
+    return float(os.environ.get('ANALYSIS_TIME_SECONDS', 300))
+
+
+def _token_ids(tokens1, tokens2):
+    """Interns the token texts of both lists into uint64 arrays (ids start at 1)."""
+    vocab = {}
+    ids1 = np.fromiter((vocab.setdefault(t['text'], len(vocab) + 1) for t in tokens1),
+                       dtype=np.uint64, count=len(tokens1))
+    ids2 = np.fromiter((vocab.setdefault(t['text'], len(vocab) + 1) for t in tokens2),
+                       dtype=np.uint64, count=len(tokens2))
+    return ids1, ids2
+
+
+class _RollingHash:
+    """Polynomial hashes (mod 2**64) of every window of an id array."""
+
+    def __init__(self, ids):
+        n = len(ids)
+        with np.errstate(over='ignore'):
+            powers = np.ones(n + 1, dtype=np.uint64)
+            inverse_powers = np.ones(n + 1, dtype=np.uint64)
+            if n:
+                powers[1:] = np.cumprod(np.full(n, _HASH_BASE, dtype=np.uint64), dtype=np.uint64)
+                inverse_powers[1:] = np.cumprod(np.full(n, _HASH_BASE_INVERSE, dtype=np.uint64), dtype=np.uint64)
+            # prefix[i] = sum(ids[k] * B**-k for k < i)
+            self._prefix = np.zeros(n + 1, dtype=np.uint64)
+            self._prefix[1:] = np.cumsum(ids * inverse_powers[:n], dtype=np.uint64)
+        self._powers = powers
+        self.n = n
+
+    def windows(self, length):
+        """Hashes of all windows of the given length: sum(ids[i + j] * B**(length - 1 - j))."""
+        if length > self.n:
+            return np.empty(0, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            sums = self._prefix[length:] - self._prefix[:self.n - length + 1]
+            return sums * self._powers[length - 1:self.n]
+
+
+def probe_longest_common_length(tokens1, tokens2, upper):
+    """
+    Upper bound on the length of the longest n-gram (text only) shared by
+    the two token lists, at most upper. Hash collisions can only make it
+    too long, never too short, so it is safe to mine from there down.
+    """
+    ids1, ids2 = _token_ids(tokens1, tokens2)
+    return probe_longest_common_length_ids(ids1, ids2, upper)
+
+
+def probe_longest_common_length_ids(ids1, ids2, upper):
+    """probe_longest_common_length over two id columns of the same vocabulary."""
+    return longest_common_length_bound(window_hashes(ids1), window_hashes(ids2), upper)
+
+
+def window_hashes(ids):
+    """
+    Rolling hashes of an id column (ids >= -1) for longest_common_length_bound,
+    so a column probed against many others is hashed once.
+    """
+    return _RollingHash(np.asarray(ids, dtype=np.int64).astype(np.uint64) + np.uint64(1)) # id 0 を避ける
+
+
+def longest_common_length_bound(hashes1, hashes2, upper):
+    """The probe of probe_longest_common_length_ids over two window_hashes results."""
+    lo, hi = 0, min(upper, hashes1.n, hashes2.n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        windows1, windows2 = hashes1.windows(mid), hashes2.windows(mid)
+        if len(windows1) > len(windows2):
+            windows1, windows2 = windows2, windows1
+        if np.isin(windows1, windows2).any():
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def sqlite_cache_mb(memory_mb):
+    """Page cache of the disk index for a memory budget."""
+    return max(1.0, min(SQLITE_CACHE_MB, memory_mb / 2))
+
+
+def estimate_substring_mb(tokens1, tokens2):
+    """
+    Upper bound on the sub-string set of the sub-pattern filter: every
+    sub-string of every word (up to LONG_WORD characters) found in both
+    texts, counted without de-duplication.
+    """
+    shared = {t['text'] for t in tokens1} & {t['text'] for t in tokens2}
+    count = sum(length * (length + 1) // 2 for length in map(len, shared) if length <= LONG_WORD)
+    return count * SUBSTRING_BYTES / (1024 * 1024)
+
+
+def estimate_window_ids_mb(n1, longest):
+    """Window ids of text 1 kept by the sub-pattern filter, plus the temporaries of building them."""
+    levels = max(int(longest), 1).bit_length()
+    return n1 * WINDOW_ID_BYTES * (levels + WINDOW_ID_BUILD_ARRAYS) / (1024 * 1024)
+
+
+def estimate_cost(n1, n2, longest, min_length=1, index='memory', memory_mb=None, substring_mb=0.0):
+    """
+    Returns (peak memory MB, disk MB, seconds) for mining lengths
+    longest..min_length of two texts with n1 / n2 tokens. For the sqlite
+    index the memory is its page cache, sized for memory_mb. The memory
+    includes the sub-pattern filter: its window ids and substring_mb
+    (estimate_substring_mb).
+
+    The time covers building the index of each length and producing the
+    patterns from its matches. The matches of a length are taken at their
+    upper bound, the n-gram count of the shorter text, which near-duplicate
+    texts reach.
+    """
+    if longest < min_length:
+        return 0.0, 0.0, 0.0
+    lengths = np.arange(max(min_length, 1), longest + 1, dtype=np.float64)
+    entries1, entries2 = np.maximum(n1 - lengths + 1, 0), np.maximum(n2 - lengths + 1, 0)
+    entries = entries1 + entries2
+    match_seconds = float(np.minimum(entries1, entries2).sum()) * MATCH_SECONDS
+    # 除外フィルタの順位と部分文字列は解析の間ずっと残る。
+    # 長さごとの一時配列 (報告済み範囲の窓) は高々 n1 件の int64 なので索引に比べて無視できる
+    filter_mb = estimate_window_ids_mb(n1, longest) + substring_mb
+    if index == 'sqlite':
+        disk_bytes = float((entries * (SQLITE_ENTRY_BYTES + MEMORY_TOKEN_BYTES * lengths)).max())
+        seconds = float((entries * (SQLITE_ENTRY_SECONDS + SQLITE_TOKEN_SECONDS * lengths)).sum())
+        cache_mb = SQLITE_CACHE_MB if memory_mb is None else sqlite_cache_mb(memory_mb)
+        return float(cache_mb) + filter_mb, disk_bytes / (1024 * 1024), seconds + match_seconds
+    peak_bytes = float((entries * (MEMORY_ENTRY_BYTES + MEMORY_TOKEN_BYTES * lengths)).max())
+    seconds = float((entries * (MEMORY_ENTRY_SECONDS + MEMORY_TOKEN_SECONDS * lengths)).sum())
+    return peak_bytes / (1024 * 1024) + filter_mb, 0.0, seconds + match_seconds
+
+
+def _free_disk_mb(directory):
+    try:
+        return shutil.disk_usage(directory or tempfile.gettempdir()).free / (1024 * 1024)
+    except OSError:
+        return 0.0
+
+
+def _largest_fitting_cap(n1, n2, longest, min_length, index, memory_mb, seconds, disk_mb, substring_mb):
+    """Largest max_length in [min_length, longest] whose estimate fits, or None."""
+    def fits(cap):
+        mb, disk, secs = estimate_cost(n1, n2, cap, min_length, index, memory_mb, substring_mb)
+        return mb <= memory_mb and secs <= seconds and disk <= disk_mb
+
+    if not fits(min_length):
+        return None
+    # 見積もりは上限の長さについて単調増加なので二分探索できる
+    lo, hi = min_length, longest
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def plan_analysis(tokens1, tokens2, min_length=1, max_length=None, top_k=None,
+                  memory_mb=None, seconds=None, spill_dir=None):
+    """
+    Chooses how to mine the common patterns of two token lists within the
+    memory / time budget. Returns a plan dict for
+    text_analyzer.iter_common_patterns_planned; 'strategy' and 'reason'
+    say what was chosen and why.
+    """
+    memory_mb = memory_budget_mb() if memory_mb is None else memory_mb
+    seconds = time_budget_seconds() if seconds is None else seconds
+    spill_dir = spill_dir or os.environ.get('ANALYSIS_SPILL_DIR') or None
+    min_length = max(min_length, 1)
+    n1, n2 = len(tokens1), len(tokens2)
+
+    upper = min(n1, n2)
+    if max_length is not None:
+        upper = min(upper, max_length)
+    longest = probe_longest_common_length(tokens1, tokens2, upper)
+    substring_mb = estimate_substring_mb(tokens1, tokens2)
+
+    plan = {
+        'strategy': 'exact',
+        'index': 'memory',
+        'min_length': min_length,
+        'max_length': max_length,
+        'top_k': top_k,
+        'longest': longest,
+        'spill_dir': spill_dir,
+        'sqlite_cache_mb': sqlite_cache_mb(memory_mb),
+        'tokens': [n1, n2],
+        'memory_budget_mb': memory_mb,
+        'time_budget_seconds': seconds,
+    }
+
+    def set_estimate(index, cap):
+        plan['estimated_mb'], plan['estimated_disk_mb'], plan['estimated_seconds'] = (
+            round(value, 1) for value in estimate_cost(n1, n2, cap, min_length, index, memory_mb, substring_mb))
+
+    exact_mb, _, exact_seconds = estimate_cost(n1, n2, longest, min_length, 'memory', substring_mb=substring_mb)
+    set_estimate('memory', longest)
+    if exact_mb <= memory_mb and exact_seconds <= seconds:
+        plan['reason'] = "fits in memory"
+        return plan
+
+    over = f"exact analysis needs ~{exact_mb:.0f} MB / {exact_seconds:.0f} s (budget {memory_mb:.0f} MB / {seconds:.0f} s)"
+    free_disk_mb = _free_disk_mb(spill_dir)
+    disk_peak_mb, disk_mb, disk_seconds = estimate_cost(n1, n2, longest, min_length, 'sqlite', memory_mb, substring_mb)
+    if disk_peak_mb <= memory_mb and disk_seconds <= seconds and disk_mb <= free_disk_mb * 0.9:
+        plan.update(strategy='disk', index='sqlite', reason=f"{over}; n-gram index spilled to disk")
+        set_estimate('sqlite', longest)
+        return plan
+
+    # 正確な解析は予算に収まらない: 最大長を下げ、上位 CAPPED_TOP_K 件までにする
+    plan['strategy'] = 'capped'
+    plan['top_k'] = CAPPED_TOP_K if top_k is None else min(top_k, CAPPED_TOP_K)
+    for index, disk_budget in (('memory', float('inf')), ('sqlite', free_disk_mb * 0.9)):
+        cap = _largest_fitting_cap(n1, n2, longest, min_length, index, memory_mb, seconds, disk_budget, substring_mb)
+        if cap is not None:
+            plan.update(index=index, max_length=cap, longest=cap,
+                        reason=f"{over}; max_length capped at {cap}")
+            set_estimate(index, cap)
+            return plan
+
+    # 最短の長さだけでも予算を超える。ディスク索引で最短の長さのみ解析する
+    plan.update(index='sqlite', max_length=min_length, longest=min(longest, min_length),
+                reason=f"{over}; even length {min_length} exceeds the budget, mining only that length")
+    set_estimate('sqlite', plan['longest'])
+    return plan
+
+
+def describe_plan(plan):
+    """One-line summary of a plan for reports and logs."""
+    text = (f"{plan['strategy']} ({plan['index']} index, "
+            f"est. {plan['estimated_mb']} MB, {plan['estimated_seconds']} s")
+    if plan['strategy'] == 'capped':
+        text += f", max_length={plan['max_length']}, top_k={plan['top_k']}"
+    return f"{text}) - {plan['reason']}"
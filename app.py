@@ -1,277 +1,91 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, abort, jsonify, render_template, request, redirect, send_file, url_for
 import os
-import sys
-import spacy # spaCyをインポート
-from collections import defaultdict # defaultdictをインポート
+import re
+import time
+import uuid
 
 # ==========================================================
-# --- ここから、既存の解析関数の定義を全て貼り付けます ---
-
-# spaCyモデルのロード (初回のみダウンロードが必要)
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    # spaCyモデルがなければダウンロード指示を出すが、Webアプリなのでユーザーに直接は見せない
-    # 実際には、デプロイ前にモデルを確実にインストールしておくべき
-    print("SpaCy model 'en_core_web_sm' not found. Please run:")
-    print("python -m spacy download en_core_web_sm")
-    sys.exit("SpaCy model not loaded. Please install it.") # アプリが終了するように修正
-
-
-def read_text_file(filepath):
-    """Reads text from the specified file path."""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return None # エラーメッセージはFlask側で処理
-    except Exception as e:
-        return None # エラーメッセージはFlask側で処理
-
-def normalize_and_pos_tag(text):
-    """Normalizes text and returns a list of tokens with POS tags."""
-    doc = nlp(text.lower()) # Process text in lowercase
-    tokens_with_pos = []
-    for token in doc:
-        # Include only alphabetic or numeric tokens
-        if token.is_alpha or token.is_digit:
-            tokens_with_pos.append({
-                'text': token.text,
-                'pos': token.pos_ # Part-of-Speech tag
-            })
-    return tokens_with_pos
-
-
-def find_common_patterns_improved(tokens1, tokens2, min_length=1):
-    """
-    Finds common patterns (sequences of words with matching POS tags)
-    between two token lists.
-    """
-    patterns_with_pos = {} # Stores {pattern_text: pos_pattern_string} for each text
-
-    def collect_patterns(tokens_list):
-        sub_patterns = {}
-        for i in range(len(tokens_list)):
-            for j in range(i + min_length, len(tokens_list) + 1):
-                sub_tokens = tokens_list[i:j]
-                pattern_text = " ".join([t['text'] for t in sub_tokens])
-                pos_pattern = "-".join([t['pos'] for t in sub_tokens])
-                sub_patterns[pattern_text] = pos_pattern
-        return sub_patterns
-
-    sub_patterns1 = collect_patterns(tokens1)
-    sub_patterns2 = collect_patterns(tokens2)
-
-    common_patterns_data = {} # {pattern_text: {'pattern': ..., 'pos_pattern': ..., 'length': ...}}
-
-    for pattern_text, pos_pattern1 in sub_patterns1.items():
-        if pattern_text in sub_patterns2:
-            pos_pattern2 = sub_patterns2[pattern_text]
-            # Only include if both text and POS sequence match
-            if pos_pattern1 == pos_pattern2:
-                common_patterns_data[pattern_text] = {
-                    'pattern': pattern_text,
-                    'pos_pattern': pos_pattern1,
-                    'length': len(pattern_text.split()),
-                    # 'count' could be added here if counting occurrences in each text is desired
-                }
-
-    # Sort by length and filter out sub-patterns
-    sorted_unique_patterns = sorted(common_patterns_data.values(), key=lambda x: x['length'], reverse=True)
-    
-    final_results = []
-    for current_pattern_data in sorted_unique_patterns:
-        is_sub_pattern_of_existing = False
-        for existing_pattern_data in final_results:
-            # Check if current pattern is a sub-string of an already added longer pattern
-            if current_pattern_data['pattern'] in existing_pattern_data['pattern'] and \
-               current_pattern_data['length'] < existing_pattern_data['length']:
-                is_sub_pattern_of_existing = True
-                break
-        if not is_sub_pattern_of_existing:
-            final_results.append(current_pattern_data)
-    
-    final_results.sort(key=lambda x: x['length'], reverse=True)
-    
-    return final_results
-
-
-def find_pos_discrepancies_improved(tokens1, tokens2):
-    """
-    Finds words that exist in both token lists but have different POS tags.
-    """
-    word_to_pos_map1 = defaultdict(set)
-    for token in tokens1:
-        word_to_pos_map1[token['text']].add(token['pos'])
-
-    word_to_pos_map2 = defaultdict(set)
-    for token in tokens2:
-        word_to_pos_map2[token['text']].add(token['pos'])
-
-    discrepancies = set()
-
-    for word in word_to_pos_map1.keys():
-        if word in word_to_pos_map2:
-            pos_set1 = word_to_pos_map1[word]
-            pos_set2 = word_to_pos_map2[word]
-
-            # Compare all combinations of POS tags that cause the discrepancy
-            for p1 in pos_set1:
-                if p1 not in pos_set2:
-                    for p2 in pos_set2:
-                        if p1 != p2:
-                             discrepancies.add((word, p1, p2))
-            
-            for p2 in pos_set2:
-                if p2 not in pos_set1:
-                    for p1 in pos_set1:
-                        if p1 != p2:
-                            discrepancies.add((word, p1, p2))
-
-    sorted_discrepancies = sorted(list(discrepancies), key=lambda x: (x[0], x[1], x[2]))
-    formatted_discrepancies = [
-        {'word': d[0], 'pos_text1': d[1], 'pos_text2': d[2]}
-        for d in sorted_discrepancies
-    ]
-    return formatted_discrepancies
-
-def analyze_phrase_patterns(text):
-    """
-    Given a text, analyze its phrase patterns using spaCy's dependency parser
-    and noun chunks.
-    Returns a list of identified phrase patterns and their types.
-    """
-    doc = nlp(text)
-    phrases_info = []
-
-    # 1. 名詞句 (Noun Chunks) の抽出
-    for chunk in doc.noun_chunks:
-        phrases_info.append({
-            'pattern': chunk.text,
-            'type': 'Noun Phrase (NP)',
-            'description': f"A noun phrase headed by '{chunk.root.text}' ('{chunk.root.pos_}') including its modifiers."
-        })
-
-    # 2. その他の句構造の推測（依存関係解析に基づく）
-    # 動詞句 (Verb Phrase - VP) の簡易的な識別
-    for token in doc:
-        if token.pos_ == "VERB" and token.dep_ == "ROOT":
-            verb_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"]:
-                    verb_phrase_tokens.append(child.text)
-                    if child.dep_ == "prep":
-                        for grand_child in child.children:
-                            verb_phrase_tokens.append(grand_child.text)
-            
-            sorted_vp_tokens = sorted(verb_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            verb_phrase_text = " ".join(sorted_vp_tokens)
-            
-            if len(sorted_vp_tokens) > 1 or any(child.dep_ in ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"] for child in token.children):
-                 phrases_info.append({
-                    'pattern': verb_phrase_text,
-                    'type': 'Verb Phrase (VP) - inferred',
-                    'description': f"A verb phrase centered around '{token.text}' ('{token.pos_}') possibly including its objects/complements/adjuncts."
-                })
-
-        # 形容詞句 (Adjective Phrase - ADJP) の簡易的な識別
-        if token.pos_ == "ADJ":
-            adj_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "prep", "amod"]:
-                    adj_phrase_tokens.append(child.text)
-            
-            sorted_adj_tokens = sorted(adj_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            adj_phrase_text = " ".join(sorted_adj_tokens)
-            if len(sorted_adj_tokens) > 1 or any(child.dep_ in ["advmod", "prep", "amod"] for child in token.children):
-                phrases_info.append({
-                    'pattern': adj_phrase_text,
-                    'type': 'Adjective Phrase (ADJP) - inferred',
-                    'description': f"An adjective phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-
-        # 副詞句 (Adverb Phrase - ADVP) の簡易的な識別
-        if token.pos_ == "ADV":
-            adv_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "prep"]:
-                    adv_phrase_tokens.append(child.text)
-            
-            sorted_adv_tokens = sorted(adv_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            adv_phrase_text = " ".join(sorted_adv_tokens)
-            if len(sorted_adv_tokens) > 1 or any(child.dep_ in ["advmod", "prep"] for child in token.children):
-                phrases_info.append({
-                    'pattern': adv_phrase_text,
-                    'type': 'Adverb Phrase (ADVP) - inferred',
-                    'description': f"An adverb phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-                
-    return phrases_info
-
-
-def write_results_to_file(filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis):
-    """Writes the analysis results to a file."""
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write("---\n")
-            f.write("## Shared Token Patterns (Text and POS Match)\n")
-            f.write("---\n")
-            if not common_patterns:
-                f.write("No shared token patterns found.\n")
-            else:
-                for i, r in enumerate(common_patterns):
-                    f.write(f"{i + 1}. \"{r['pattern']}\" (Length: {r['length']} tokens, POS: {r['pos_pattern']})\n")
-
-            f.write("\n---\n")
-            f.write("## POS Discrepancies (Same Word, Different POS)\n")
-            f.write("---\n")
-            if not pos_discrepancies:
-                f.write("No POS discrepancies found.\n")
-            else:
-                f.write("Words with POS Discrepancies:\n")
-                for d in pos_discrepancies:
-                    f.write(f"  Word: \"{d['word']}\"\n")
-                    f.write(f"    Text1 POS: {d['pos_text1']}\n")
-                    f.write(f"    Text2 POS: {d['pos_text2']}\n")
-                    f.write("\n")
-            
-            f.write("\n---\n")
-            f.write("## Phrase Pattern Analysis of the Longest Common Pattern\n")
-            f.write("---\n")
-            if not phrase_patterns_analysis:
-                f.write("No phrase patterns identified in the longest common pattern.\n")
-            else:
-                for pp in phrase_patterns_analysis:
-                    f.write(f"  Pattern: \"{pp['pattern']}\"\n")
-                    f.write(f"  Type: {pp['type']}\n")
-                    f.write(f"  Description: {pp['description']}\n")
-                    f.write("\n")
-
-    except Exception as e:
-        print(f"Error writing to file {filepath}: {e}")
-
-# --- ここまで、既存の解析関数を全て貼り付けます ---
+# --- 解析関数は text_analyzer / taggers から読み込みます ---
+# (spaCyモデルは taggers.SpacyTagger が初回使用時にロードする)
+from admission import describe_plan, plan_analysis
+from model_pool import AVAILABLE_MODELS, get_model_pool, is_model_choice
+from phrase_cache import get_phrase_cache
+from profiling import RequestProfile, admin_token_ok, slow_threshold
+from request_log import get_request_log
+from taggers import perceptron_trained, tagger_available
+from text_analyzer import (read_text_file, normalize_and_pos_tag, find_common_patterns_planned,
+                           find_pos_discrepancies_improved, analyze_pattern_phrases, PHRASE_SCOPES,
+                           write_results_to_file)
+# --- ここまで、解析関数 ---
 # ==========================================================
 
 
 app = Flask(__name__)
 
+
+@app.context_processor
+def tagger_choices():
+    # 学習済みモデルがなければ画面のパーセプトロンの選択肢を無効にする
+    return {'perceptron_trained': perceptron_trained()}
+
+
 # アップロードされたファイルを一時的に保存するディレクトリ
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# プロファイル (collapsed stacks) の保存先
+PROFILE_FOLDER = os.path.join(UPLOAD_FOLDER, 'profiles')
+PROFILE_NAME_PATTERN = re.compile(r'^[0-9a-f]{32}\.collapsed$')
+# 保存したプロファイルの保持期間 (秒) と最大数 (古いものから削除する)
+PROFILE_TTL_SECONDS = 24 * 60 * 60
+PROFILE_MAX_FILES = 100
+
+
+def remove_expired_profiles():
+    """
+    Deletes profiles older than PROFILE_TTL_SECONDS, then the oldest ones
+    beyond PROFILE_MAX_FILES - 1, making room for the one about to be saved.
+    """
+    now = time.time()
+    profiles = []
+    for name in os.listdir(PROFILE_FOLDER):
+        path = os.path.join(PROFILE_FOLDER, name)
+        if not PROFILE_NAME_PATTERN.match(name):
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime > PROFILE_TTL_SECONDS:
+                os.remove(path)
+            else:
+                profiles.append((mtime, path))
+        except OSError:
+            pass # 別のリクエストが先に削除した
+    profiles.sort()
+    for _mtime, path in profiles[:max(0, len(profiles) - PROFILE_MAX_FILES + 1)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# このアプリは解析を終えてから結果をまとめて返す (一括表示版)。
+# 大きな入力には結果を SSE で順次表示する app2.py を使う
 @app.route('/', methods=['GET', 'POST'])
 def index():
     output_content = ""
     error_message = ""
+    profile_url = ""
+    strategy = ""
 
     if request.method == 'POST':
+        arrived = time.time() # リクエストログの ts (解析の終了時刻ではなく到着時刻)
+
         # ファイルがアップロードされたか確認
         if 'file1' not in request.files or 'file2' not in request.files:
             error_message = "両方のテキストファイルをアップロードしてください。"
-            return render_template('index.html', output_content=output_content, error_message=error_message)
+            return render_template('index.html', output_content=output_content, error_message=error_message,
+                                   models=AVAILABLE_MODELS)
 
         file1 = request.files['file1']
         file2 = request.files['file2']
@@ -279,9 +93,41 @@ def index():
         # ファイル名が空でないか確認
         if file1.filename == '' or file2.filename == '':
             error_message = "ファイルが選択されていません。"
-            return render_template('index.html', output_content=output_content, error_message=error_message)
+            return render_template('index.html', output_content=output_content, error_message=error_message,
+                                   models=AVAILABLE_MODELS)
+
+        # 品詞タグ付けのバックエンド (精度優先: spacy / 速度優先: perceptron / 規則のみ: lexicon)
+        tagger = request.form.get('tagger', 'spacy')
+        if not tagger_available(tagger):
+            error_message = "不明なタガー、または使用できないタガー (未学習のパーセプトロン) が指定されました。"
+            return render_template('index.html', output_content=output_content, error_message=error_message,
+                                   models=AVAILABLE_MODELS)
+
+        # spaCyモデル (空なら既定のモデル、auto なら言語を判定して選ぶ)
+        model = request.form.get('model') or None
+        if not is_model_choice(model):
+            error_message = "不明なモデルが指定されました。"
+            return render_template('index.html', output_content=output_content, error_message=error_message,
+                                   models=AVAILABLE_MODELS)
+
+        # 句形分析の対象 (longest: 最長の共通パターンのみ / all: すべての共通パターン)
+        phrase_scope = request.form.get('phrase_scope', 'longest')
+        if phrase_scope not in PHRASE_SCOPES:
+            error_message = "不明な句形分析の対象が指定されました。"
+            return render_template('index.html', output_content=output_content, error_message=error_message,
+                                   models=AVAILABLE_MODELS)
+
+        # 管理者トークン付きのリクエストはプロファイルを取る (遅いリクエストは自動で取る)
+        profile = RequestProfile(admin_token_ok(request.headers.get('X-Profile-Token') or
+                                                request.form.get('profile_token')),
+                                 slow_threshold())
 
         if file1 and file2:
+            profile.start()
+            started = time.perf_counter()
+            status = "error"
+            common_patterns = None
+            plan = None
             try:
                 # ファイルを一時的に保存
                 filepath1 = os.path.join(UPLOAD_FOLDER, file1.filename)
@@ -298,22 +144,27 @@ def index():
                 if text1_content is None or text2_content is None:
                     error_message = "ファイルの読み込み中にエラーが発生しました。ファイルが破損しているか、エンコードの問題がある可能性があります。"
                 else:
-                    tokens1 = normalize_and_pos_tag(text1_content)
-                    tokens2 = normalize_and_pos_tag(text2_content)
+                    tokens1 = normalize_and_pos_tag(text1_content, tagger=tagger, model=model)
+                    tokens2 = normalize_and_pos_tag(text2_content, tagger=tagger, model=model)
 
-                    common_patterns = find_common_patterns_improved(tokens1, tokens2)
+                    # メモリ・時間の予算に収まる解析方法を選ぶ (exact / disk / capped)
+                    plan = plan_analysis(tokens1, tokens2)
+                    strategy = describe_plan(plan)
+                    common_patterns = find_common_patterns_planned(tokens1, tokens2, plan)
                     pos_discrepancies = find_pos_discrepancies_improved(tokens1, tokens2)
 
-                    phrase_patterns_analysis_results = []
-                    if common_patterns:
-                        longest_common_pattern_text = common_patterns[0]['pattern']
-                        phrase_patterns_analysis_results = analyze_phrase_patterns(longest_common_pattern_text)
+                    # 句形分析の結果はキャッシュされるので、すべての共通パターンも対象にできる
+                    # (all は先頭の PHRASE_PATTERN_LIMIT 件まで。キャッシュにないものはまとめて解析する)
+                    phrase_patterns_analysis_results = analyze_pattern_phrases(
+                        [p['pattern'] for p in common_patterns], model=model, scope=phrase_scope)
 
-                    write_results_to_file(output_filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis_results)
+                    write_results_to_file(output_filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis_results,
+                                          phrase_scope=phrase_scope)
 
                     # out.txt の内容を読み込んで表示
                     with open(output_filepath, 'r', encoding='utf-8') as f:
                         output_content = f.read()
+                    status = "ok"
 
             except Exception as e:
                 error_message = f"解析中に予期せぬエラーが発生しました: {e}"
@@ -321,6 +172,25 @@ def index():
                 import traceback
                 traceback.print_exc()
             finally:
+                if profile.stop().kept:
+                    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+                    remove_expired_profiles()
+                    profile_name = f"{uuid.uuid4().hex}.collapsed"
+                    profile.save(os.path.join(PROFILE_FOLDER, profile_name))
+                    profile_url = url_for('profile_file', name=profile_name)
+                    print(f"Profile saved ({profile.reason}, {profile.elapsed:.2f}s): {profile_url}")
+
+                # REQUEST_LOG が設定されていればリクエストを記録する (loadgen.py で再生できる)
+                request_log = get_request_log()
+                if request_log is not None:
+                    request_log.record(arrived, app='app', endpoint='/',
+                                       inputs=request_log.describe_files(filepath1, filepath2),
+                                       params={'tagger': tagger, 'model': model, 'phrase_scope': phrase_scope},
+                                       status=status,
+                                       strategy=plan['strategy'] if plan is not None else None,
+                                       seconds=round(time.perf_counter() - started, 4),
+                                       patterns=len(common_patterns) if common_patterns is not None else None)
+
                 # 一時ファイルを削除 (オプションだが推奨)
                 if os.path.exists(filepath1):
                     os.remove(filepath1)
@@ -331,7 +201,30 @@ def index():
                 #     os.remove(output_filepath)
 
 
-    return render_template('index.html', output_content=output_content, error_message=error_message)
+    return render_template('index.html', output_content=output_content, error_message=error_message,
+                           models=AVAILABLE_MODELS, profile_url=profile_url, strategy=strategy)
+
+
+@app.route('/profiles/<name>')
+def profile_file(name):
+    """Serves a saved profile (collapsed stacks, opens in speedscope or flamegraph.pl)."""
+    path = os.path.join(PROFILE_FOLDER, name)
+    if not PROFILE_NAME_PATTERN.match(name) or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/plain; charset=utf-8',
+                     as_attachment=True, download_name=name)
+
+
+@app.route('/stats/models')
+def model_stats():
+    """Model pool statistics (hits, misses, evictions, resident models)."""
+    return jsonify(get_model_pool().stats())
+
+
+@app.route('/stats/phrases')
+def phrase_stats():
+    """Phrase analysis cache statistics (hits per tier, misses, hit rate)."""
+    return jsonify(get_phrase_cache().stats())
 
 if __name__ == '__main__':
     # 開発サーバー起動。本番環境ではGunicornなどを使う
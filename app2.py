@@ -1,273 +1,302 @@
 # app.py fixed
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, abort, jsonify, render_template, request, send_file, url_for
+import json
 import os
-import sys
-import spacy # spaCyをインポート
-from collections import defaultdict # defaultdictをインポート
+import re
+import shutil
+import time
+import uuid
 
 # ==========================================================
-# --- ここから、既存の解析関数の定義を全て貼り付けます ---
+# --- 解析関数は text_analyzer から読み込みます (spaCyモデルのロードも共通) ---
+from admission import describe_plan, plan_analysis
+from model_pool import AVAILABLE_MODELS, get_model_pool, is_model_choice
+from phrase_cache import get_phrase_cache
+from profiling import RequestProfile, admin_token_ok, slow_threshold
+from request_log import get_request_log
+from taggers import perceptron_trained, tagger_available
+from text_analyzer import (read_text_file, normalize_and_pos_tag, iter_common_patterns_planned,
+                           find_pos_discrepancies_improved, analyze_pattern_phrases, phrase_pattern_limit,
+                           PHRASE_SCOPES)
+from result_writers import TextReportSink
+# --- ここまで、解析関数 ---
+# ==========================================================
 
-# spaCyモデルのロード (初回のみダウンロードが必要)
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    # spaCyモデルがなければダウンロード指示を出すが、Webアプリなのでユーザーに直接は見せない
-    # 実際には、デプロイ前にモデルを確実にインストールしておくべき
-    print("SpaCy model 'en_core_web_sm' not found. Please run:")
-    print("python -m spacy download en_core_web_sm")
-    sys.exit("SpaCy model not loaded. Please install it.") # アプリが終了するように修正
 
+app = Flask(__name__)
 
-def read_text_file(filepath):
-    """Reads text from the specified file path."""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return None # エラーメッセージはFlask側で処理
-    except Exception as e:
-        return None # エラーメッセージはFlask側で処理
-
-def normalize_and_pos_tag(text):
-    """Normalizes text and returns a list of tokens with POS tags."""
-    doc = nlp(text.lower()) # Process text in lowercase
-    tokens_with_pos = []
-    for token in doc:
-        # Include only alphabetic or numeric tokens
-        if token.is_alpha or token.is_digit:
-            tokens_with_pos.append({
-                'text': token.text,
-                'pos': token.pos_ # Part-of-Speech tag
-            })
-    return tokens_with_pos
-
-
-def find_common_patterns_improved(tokens1, tokens2, min_length=1):
-    """
-    Finds common patterns (sequences of words with matching POS tags)
-    between two token lists.
-    """
-    patterns_with_pos = {} # Stores {pattern_text: pos_pattern_string} for each text
-
-    def collect_patterns(tokens_list):
-        sub_patterns = {}
-        for i in range(len(tokens_list)):
-            for j in range(i + min_length, len(tokens_list) + 1):
-                sub_tokens = tokens_list[i:j]
-                pattern_text = " ".join([t['text'] for t in sub_tokens])
-                pos_pattern = "-".join([t['pos'] for t in sub_tokens])
-                sub_patterns[pattern_text] = pos_pattern
-        return sub_patterns
-
-    sub_patterns1 = collect_patterns(tokens1)
-    sub_patterns2 = collect_patterns(tokens2)
-
-    common_patterns_data = {} # {pattern_text: {'pattern': ..., 'pos_pattern': ..., 'length': ...}}
-
-    for pattern_text, pos_pattern1 in sub_patterns1.items():
-        if pattern_text in sub_patterns2:
-            pos_pattern2 = sub_patterns2[pattern_text]
-            # Only include if both text and POS sequence match
-            if pos_pattern1 == pos_pattern2:
-                common_patterns_data[pattern_text] = {
-                    'pattern': pattern_text,
-                    'pos_pattern': pos_pattern1,
-                    'length': len(pattern_text.split()),
-                    # 'count' could be added here if counting occurrences in each text is desired
-                }
-
-    # Sort by length and filter out sub-patterns
-    sorted_unique_patterns = sorted(common_patterns_data.values(), key=lambda x: x['length'], reverse=True)
-    
-    final_results = []
-    for current_pattern_data in sorted_unique_patterns:
-        is_sub_pattern_of_existing = False
-        for existing_pattern_data in final_results:
-            # Check if current pattern is a sub-string of an already added longer pattern
-            if current_pattern_data['pattern'] in existing_pattern_data['pattern'] and \
-               current_pattern_data['length'] < existing_pattern_data['length']:
-                is_sub_pattern_of_existing = True
-                break
-        if not is_sub_pattern_of_existing:
-            final_results.append(current_pattern_data)
-    
-    final_results.sort(key=lambda x: x['length'], reverse=True)
-    
-    return final_results
-
-
-def find_pos_discrepancies_improved(tokens1, tokens2):
-    """
-    Finds words that exist in both token lists but have different POS tags.
-    """
-    word_to_pos_map1 = defaultdict(set)
-    for token in tokens1:
-        word_to_pos_map1[token['text']].add(token['pos'])
-
-    word_to_pos_map2 = defaultdict(set)
-    for token in tokens2:
-        word_to_pos_map2[token['text']].add(token['pos'])
-
-    discrepancies = set()
-
-    for word in word_to_pos_map1.keys():
-        if word in word_to_pos_map2:
-            pos_set1 = word_to_pos_map1[word]
-            pos_set2 = word_to_pos_map2[word]
-
-            # Compare all combinations of POS tags that cause the discrepancy
-            for p1 in pos_set1:
-                if p1 not in pos_set2:
-                    for p2 in pos_set2:
-                        if p1 != p2:
-                             discrepancies.add((word, p1, p2))
-            
-            for p2 in pos_set2:
-                if p2 not in pos_set1:
-                    for p1 in pos_set1:
-                        if p1 != p2:
-                            discrepancies.add((word, p1, p2))
-
-    sorted_discrepancies = sorted(list(discrepancies), key=lambda x: (x[0], x[1], x[2]))
-    formatted_discrepancies = [
-        {'word': d[0], 'pos_text1': d[1], 'pos_text2': d[2]}
-        for d in sorted_discrepancies
-    ]
-    return formatted_discrepancies
-
-def analyze_phrase_patterns(text):
+
+@app.context_processor
+def tagger_choices():
+    # 学習済みモデルがなければ画面のパーセプトロンの選択肢を無効にする
+    return {'perceptron_trained': perceptron_trained()}
+
+
+# アップロードされたファイルを一時的に保存するディレクトリ
+# ジョブごとに uploads/<job_id>/ を作り、text1.txt / text2.txt / out.txt を置く
+UPLOAD_FOLDER = 'uploads'
+if not os.path.exists(UPLOAD_FOLDER):
+    os.makedirs(UPLOAD_FOLDER)
+
+# 古いジョブのディレクトリを消すまでの秒数
+JOB_TTL_SECONDS = 60 * 60
+# SSE でまとめて送る間隔 (秒) とバッファサイズ (文字数)
+STREAM_FLUSH_INTERVAL = 0.1
+STREAM_FLUSH_CHARS = 16 * 1024
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# プロファイルの要求を示す印と、プロファイル (collapsed stacks) のファイル名
+PROFILE_REQUEST_FILE = 'profile.requested'
+PROFILE_FILE = 'profile.collapsed'
+# 解析を始めた接続が作る印と、終わった解析の結果 (再接続や別のタブには out.txt を再送する)
+JOB_STARTED_FILE = 'job.started'
+JOB_RESULT_FILE = 'job.json'
+# 別の接続で実行中の解析を待つときの確認間隔 (秒)
+JOB_POLL_SECONDS = 0.5
+
+
+def job_dir(job_id):
+    """Returns the upload directory of a job, or aborts with 404."""
+    if not JOB_ID_PATTERN.match(job_id):
+        abort(404)
+    path = os.path.join(UPLOAD_FOLDER, job_id)
+    if not os.path.isdir(path):
+        abort(404)
+    return path
+
+
+def remove_expired_jobs():
+    """Deletes job directories older than JOB_TTL_SECONDS."""
+    now = time.time()
+    for name in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        if JOB_ID_PATTERN.match(name) and os.path.isdir(path) and now - os.path.getmtime(path) > JOB_TTL_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def sse_event(event, data):
+    """Formats one server-sent event. data is sent JSON-encoded on one line."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _ReportStream:
     """
-    Given a text, analyze its phrase patterns using spaCy's dependency parser
-    and noun chunks.
-    Returns a list of identified phrase patterns and their types.
+    File-like object for TextReportSink: writes the report to out.txt and
+    keeps the text written since the last drain() for the event stream.
     """
-    doc = nlp(text)
-    phrases_info = []
-
-    # 1. 名詞句 (Noun Chunks) の抽出
-    for chunk in doc.noun_chunks:
-        phrases_info.append({
-            'pattern': chunk.text,
-            'type': 'Noun Phrase (NP)',
-            'description': f"A noun phrase headed by '{chunk.root.text}' ('{chunk.root.pos_}') including its modifiers."
-        })
-
-    # 2. その他の句構造の推測（依存関係解析に基づく）
-    # 動詞句 (Verb Phrase - VP) の簡易的な識別
-    for token in doc:
-        if token.pos_ == "VERB" and token.dep_ == "ROOT":
-            verb_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"]:
-                    verb_phrase_tokens.append(child.text)
-                    if child.dep_ == "prep":
-                        for grand_child in child.children:
-                            verb_phrase_tokens.append(grand_child.text)
-            
-            sorted_vp_tokens = sorted(verb_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            verb_phrase_text = " ".join(sorted_vp_tokens)
-            
-            if len(sorted_vp_tokens) > 1 or any(child.dep_ in ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"] for child in token.children):
-                 phrases_info.append({
-                    'pattern': verb_phrase_text,
-                    'type': 'Verb Phrase (VP) - inferred',
-                    'description': f"A verb phrase centered around '{token.text}' ('{token.pos_}') possibly including its objects/complements/adjuncts."
-                })
-
-        # 形容詞句 (Adjective Phrase - ADJP) の簡易的な識別
-        if token.pos_ == "ADJ":
-            adj_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "prep", "amod"]:
-                    adj_phrase_tokens.append(child.text)
-            
-            sorted_adj_tokens = sorted(adj_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            adj_phrase_text = " ".join(sorted_adj_tokens)
-            if len(sorted_adj_tokens) > 1 or any(child.dep_ in ["advmod", "prep", "amod"] for child in token.children):
-                phrases_info.append({
-                    'pattern': adj_phrase_text,
-                    'type': 'Adjective Phrase (ADJP) - inferred',
-                    'description': f"An adjective phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-
-        # 副詞句 (Adverb Phrase - ADVP) の簡易的な識別
-        if token.pos_ == "ADV":
-            adv_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "prep"]:
-                    adv_phrase_tokens.append(child.text)
-            
-            sorted_adv_tokens = sorted(adv_phrase_tokens, key=lambda x: text.lower().find(x.lower()))
-            adv_phrase_text = " ".join(sorted_adv_tokens)
-            if len(sorted_adv_tokens) > 1 or any(child.dep_ in ["advmod", "prep"] for child in token.children):
-                phrases_info.append({
-                    'pattern': adv_phrase_text,
-                    'type': 'Adverb Phrase (ADVP) - inferred',
-                    'description': f"An adverb phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-                
-    return phrases_info
-
-
-def write_results_to_file(filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis):
-    """Writes the analysis results to a file."""
+
+    def __init__(self, filepath):
+        self._f = open(filepath, 'w', encoding='utf-8')
+        self._pending = []
+        self._pending_chars = 0
+        self._last_drain = time.monotonic()
+
+    def write(self, text):
+        self._f.write(text)
+        self._pending.append(text)
+        self._pending_chars += len(text)
+
+    def should_drain(self):
+        return (self._pending_chars >= STREAM_FLUSH_CHARS or
+                time.monotonic() - self._last_drain >= STREAM_FLUSH_INTERVAL)
+
+    def drain(self):
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        self._last_drain = time.monotonic()
+        return text
+
+    def close(self):
+        self._f.close()
+
+
+def _claim_job(path):
+    """True if this connection is the one that runs the job's analysis."""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write("---\n")
-            f.write("## Shared Token Patterns (Text and POS Match)\n")
-            f.write("---\n")
-            if not common_patterns:
-                f.write("No shared token patterns found.\n")
-            else:
-                for i, r in enumerate(common_patterns):
-                    f.write(f"{i + 1}. \"{r['pattern']}\" (Length: {r['length']} tokens, POS: {r['pos_pattern']})\n")
-
-            f.write("\n---\n")
-            f.write("## POS Discrepancies (Same Word, Different POS)\n")
-            f.write("---\n")
-            if not pos_discrepancies:
-                f.write("No POS discrepancies found.\n")
-            else:
-                f.write("Words with POS Discrepancies:\n")
-                for d in pos_discrepancies:
-                    f.write(f"  Word: \"{d['word']}\"\n")
-                    f.write(f"    Text1 POS: {d['pos_text1']}\n")
-                    f.write(f"    Text2 POS: {d['pos_text2']}\n")
-                    f.write("\n")
-            
-            f.write("\n---\n")
-            f.write("## Phrase Pattern Analysis of the Longest Common Pattern\n")
-            f.write("---\n")
-            if not phrase_patterns_analysis:
-                f.write("No phrase patterns identified in the longest common pattern.\n")
-            else:
-                for pp in phrase_patterns_analysis:
-                    f.write(f"  Pattern: \"{pp['pattern']}\"\n")
-                    f.write(f"  Type: {pp['type']}\n")
-                    f.write(f"  Description: {pp['description']}\n")
-                    f.write("\n")
+        os.close(os.open(os.path.join(path, JOB_STARTED_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
 
-    except Exception as e:
-        print(f"Error writing to file {filepath}: {e}")
 
-# --- ここまで、既存の解析関数を全て貼り付けます ---
-# ==========================================================
+def _read_job_result(path):
+    try:
+        with open(os.path.join(path, JOB_RESULT_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
 
-app = Flask(__name__)
+def _write_job_result(path, result):
+    tmp_path = os.path.join(path, JOB_RESULT_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(path, JOB_RESULT_FILE))
+
+
+def replay_job(path, result, profile_url=None):
+    """The events of a finished job: its strategy, the saved out.txt, then 'done' / 'failed'."""
+    if result.get('description'):
+        yield sse_event('strategy', result['description'])
+    try:
+        with open(os.path.join(path, 'out.txt'), encoding='utf-8') as f:
+            while True:
+                text = f.read(STREAM_FLUSH_CHARS)
+                if not text:
+                    break
+                yield sse_event('report', text)
+    except OSError:
+        pass
+    if result.get('profiled'):
+        yield sse_event('profile', profile_url)
+    if result['status'] == "ok":
+        yield sse_event('done', "")
+    else:
+        yield sse_event('failed', result['error'])
+
+
+def stream_analysis(path, tagger='spacy', model=None, profile_url=None, phrase_scope='longest', arrived=None):
+    """
+    Generator for the event stream of one job. The first connection runs
+    the analysis: report text is sent as 'report' events while it runs,
+    and the first pattern is flushed as soon as it is found. When the job
+    is profiled, a 'profile' event with the profile's URL comes before
+    'done' / 'failed'. Later connections (reload, a second tab) wait for
+    that run and replay its saved report instead of analysing again.
+    arrived is the time.time() the request came in, for the request log
+    (the generator itself only starts once the response is being sent).
+    """
+    if arrived is None:
+        arrived = time.time()
+    waiting_since = None
+    while not _claim_job(path):
+        result = _read_job_result(path)
+        if result is not None:
+            yield from replay_job(path, result, profile_url)
+            return
+        if waiting_since is None:
+            waiting_since = time.monotonic()
+            yield sse_event('status', "別の接続で解析中です。終わるまでお待ちください...")
+        elif time.monotonic() - waiting_since > JOB_TTL_SECONDS:
+            yield sse_event('failed', "解析が終わりませんでした。もう一度アップロードしてください。")
+            return
+        time.sleep(JOB_POLL_SECONDS)
+
+    started = time.perf_counter()
+    outcome = {'status': "error", 'patterns': None, 'error': None, 'strategy': None, 'description': None}
+    profile = RequestProfile(os.path.exists(os.path.join(path, PROFILE_REQUEST_FILE)), slow_threshold())
+    finished = False
+    try:
+        with profile:
+            yield from _stream_analysis(path, tagger, model, phrase_scope, outcome)
+        profiled = profile.save(os.path.join(path, PROFILE_FILE))
+        _write_job_result(path, {'status': outcome['status'], 'error': outcome['error'],
+                                 'description': outcome['description'], 'profiled': bool(profiled)})
+        finished = True
+        if profiled:
+            print(f"Profile saved for job {os.path.basename(path)} ({profile.reason}, {profile.elapsed:.2f}s)")
+            yield sse_event('profile', profile_url)
+        if outcome['status'] == "ok":
+            yield sse_event('done', "")
+        else:
+            yield sse_event('failed', outcome['error'])
+    finally:
+        if not finished:
+            # 途中で接続が切れた: 次の接続が解析をやり直せるように印を消す
+            try:
+                os.remove(os.path.join(path, JOB_STARTED_FILE))
+            except OSError:
+                pass
+        # REQUEST_LOG が設定されていればリクエストを記録する (loadgen.py で再生できる)
+        # 途中で接続が切れた場合は status が "error" のまま記録される
+        request_log = get_request_log()
+        if request_log is not None:
+            request_log.record(arrived, app='app2', endpoint='/jobs/events',
+                               inputs=request_log.describe_files(os.path.join(path, 'text1.txt'),
+                                                                 os.path.join(path, 'text2.txt')),
+                               params={'tagger': tagger, 'model': model, 'phrase_scope': phrase_scope},
+                               status=outcome['status'],
+                               strategy=outcome['strategy'],
+                               seconds=round(time.perf_counter() - started, 4),
+                               patterns=outcome['patterns'])
+
+
+def _report_events(stream):
+    """The 'report' event for the text written since the last drain, if there is any."""
+    text = stream.drain()
+    if text:
+        yield sse_event('report', text)
+
+
+def _stream_analysis(path, tagger, model, phrase_scope, outcome):
+    """Runs the analysis, yielding status/report events; the result goes into outcome."""
+    text1_content = read_text_file(os.path.join(path, 'text1.txt'))
+    text2_content = read_text_file(os.path.join(path, 'text2.txt'))
+    if text1_content is None or text2_content is None:
+        outcome['error'] = "ファイルの読み込み中にエラーが発生しました。ファイルが破損しているか、エンコードの問題がある可能性があります。"
+        return
+
+    sink = None
+    try:
+        yield sse_event('status', "POSタグ付け中...")
+        tokens1 = normalize_and_pos_tag(text1_content, tagger=tagger, model=model)
+        tokens2 = normalize_and_pos_tag(text2_content, tagger=tagger, model=model)
+        del text1_content, text2_content
+        # メモリ・時間の予算に収まる解析方法を選ぶ (exact / disk / capped)
+        plan = plan_analysis(tokens1, tokens2)
+        outcome['strategy'] = plan['strategy']
+        outcome['description'] = describe_plan(plan)
+        yield sse_event('strategy', outcome['description'])
+        yield sse_event('status', "共通パターンを検索中...")
+
+        stream = _ReportStream(os.path.join(path, 'out.txt'))
+        sink = TextReportSink(None, stream=stream, phrase_scope=phrase_scope)
+        pattern_texts = [] # 句形分析の対象 (phrase_scope='longest' なら最初の1件だけ)
+        phrase_limit = 1 if phrase_scope == 'longest' else phrase_pattern_limit()
+        sink.begin_section('common_patterns')
+        count = 0
+        for pattern in iter_common_patterns_planned(tokens1, tokens2, plan):
+            sink.write_record('common_patterns', pattern)
+            count += 1
+            if len(pattern_texts) < phrase_limit:
+                pattern_texts.append(pattern['pattern'])
+            if count == 1 or stream.should_drain(): # 最初のパターンはすぐに表示する
+                yield from _report_events(stream)
+        sink.end_section('common_patterns', count)
+        outcome['patterns'] = count
+        yield from _report_events(stream)
+
+        yield sse_event('status', "品詞の不一致を検索中...")
+        sections = [('pos_discrepancies', find_pos_discrepancies_improved(tokens1, tokens2))]
+        phrase_patterns_analysis_results = analyze_pattern_phrases(pattern_texts, model=model, scope=phrase_scope)
+        sections.append(('phrase_patterns_analysis', phrase_patterns_analysis_results))
+
+        for section, records in sections:
+            sink.begin_section(section)
+            for record in records:
+                sink.write_record(section, record)
+            sink.end_section(section, len(records))
+            yield from _report_events(stream)
+
+        outcome['status'] = "ok"
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        outcome['error'] = f"解析中に予期せぬエラーが発生しました: {e}"
+    finally:
+        if sink is not None:
+            sink.close()
 
-# アップロードされたファイルを一時的に保存するディレクトリ
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    output_content = ""
     error_message = ""
-    text1_content = "" # 追加：ファイル1の内容を保持する変数
-    text2_content = "" # 追加：ファイル2の内容を保持する変数
+    job_id = ""
+    tagger = "spacy"
+    model = ""
+    phrase_scope = "longest"
     filename1 = "" # 変更: ファイル名用の変数を追加
     filename2 = "" # 変更: ファイル名用の変数を追加
 
@@ -275,7 +304,7 @@ def index():
         # ファイルがアップロードされたか確認
         if 'file1' not in request.files or 'file2' not in request.files:
             error_message = "両方のテキストファイルをアップロードしてください。"
-            return render_template('index.html', output_content=output_content, error_message=error_message)
+            return render_template('index.html', error_message=error_message, models=AVAILABLE_MODELS)
 
         file1 = request.files['file1']
         file2 = request.files['file2']
@@ -283,70 +312,117 @@ def index():
         # ファイル名が空でないか確認
         if file1.filename == '' or file2.filename == '':
             error_message = "ファイルが選択されていません。"
-            return render_template('index.html', output_content=output_content, error_message=error_message)
-
-        if file1 and file2:
-            try:
-                # ファイル名を格納
-                filename1 = file1.filename # 変更: ファイル名を変数に格納
-                filename2 = file2.filename # 変更: ファイル名を変数に格納
-
-                # ファイルを一時的に保存
-                filepath1 = os.path.join(UPLOAD_FOLDER, file1.filename)
-                filepath2 = os.path.join(UPLOAD_FOLDER, file2.filename)
-                output_filepath = os.path.join(UPLOAD_FOLDER, "out.txt")
-
-                file1.save(filepath1)
-                file2.save(filepath2)
-
-                # 解析ロジックを実行
-                text1_content = read_text_file(filepath1)
-                text2_content = read_text_file(filepath2)
-
-                if text1_content is None or text2_content is None:
-                    error_message = "ファイルの読み込み中にエラーが発生しました。ファイルが破損しているか、エンコードの問題がある可能性があります。"
-                else:
-                    tokens1 = normalize_and_pos_tag(text1_content)
-                    tokens2 = normalize_and_pos_tag(text2_content)
-
-                    common_patterns = find_common_patterns_improved(tokens1, tokens2)
-                    pos_discrepancies = find_pos_discrepancies_improved(tokens1, tokens2)
-
-                    phrase_patterns_analysis_results = []
-                    if common_patterns:
-                        longest_common_pattern_text = common_patterns[0]['pattern']
-                        phrase_patterns_analysis_results = analyze_phrase_patterns(longest_common_pattern_text)
-
-                    write_results_to_file(output_filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis_results)
-
-                    # out.txt の内容を読み込んで表示
-                    with open(output_filepath, 'r', encoding='utf-8') as f:
-                        output_content = f.read()
-
-            except Exception as e:
-                error_message = f"解析中に予期せぬエラーが発生しました: {e}"
-                # デバッグのためにエラーの詳細をコンソールにも出力
-                import traceback
-                traceback.print_exc()
-            finally:
-                # 一時ファイルを削除 (オプションだが推奨)
-                if os.path.exists(filepath1):
-                    os.remove(filepath1)
-                if os.path.exists(filepath2):
-                    os.remove(filepath2)
-                # output_filepath は表示のために残しておくが、不要なら削除
-                # if os.path.exists(output_filepath):
-                #     os.remove(output_filepath)
-
-
-    # テンプレートに、元のファイル内容、解析結果、エラーメッセージを渡す
+            return render_template('index.html', error_message=error_message, models=AVAILABLE_MODELS)
+
+        # 品詞タグ付けのバックエンド (精度優先: spacy / 速度優先: perceptron / 規則のみ: lexicon)
+        tagger = request.form.get('tagger', 'spacy')
+        if not tagger_available(tagger):
+            error_message = "不明なタガー、または使用できないタガー (未学習のパーセプトロン) が指定されました。"
+            return render_template('index.html', error_message=error_message, models=AVAILABLE_MODELS)
+
+        # spaCyモデル (空なら既定のモデル、auto なら言語を判定して選ぶ)
+        model = request.form.get('model', '')
+        if not is_model_choice(model):
+            error_message = "不明なモデルが指定されました。"
+            return render_template('index.html', error_message=error_message, models=AVAILABLE_MODELS)
+
+        # 句形分析の対象 (longest: 最長の共通パターンのみ / all: すべての共通パターン)
+        phrase_scope = request.form.get('phrase_scope', 'longest')
+        if phrase_scope not in PHRASE_SCOPES:
+            error_message = "不明な句形分析の対象が指定されました。"
+            return render_template('index.html', error_message=error_message, models=AVAILABLE_MODELS)
+
+        try:
+            remove_expired_jobs()
+
+            # ファイル名を格納 (表示用のみ。保存先のパスには使わない)
+            filename1 = file1.filename
+            filename2 = file2.filename
+
+            # ファイルをジョブのディレクトリに保存する。解析は /jobs/<job_id>/events で行う
+            job_id = uuid.uuid4().hex
+            path = os.path.join(UPLOAD_FOLDER, job_id)
+            os.makedirs(path)
+            file1.save(os.path.join(path, 'text1.txt'))
+            file2.save(os.path.join(path, 'text2.txt'))
+
+            # 管理者トークン付きのリクエストはプロファイルを取る (EventSource はヘッダーを送れないので印を残す)
+            if admin_token_ok(request.headers.get('X-Profile-Token') or request.form.get('profile_token')):
+                open(os.path.join(path, PROFILE_REQUEST_FILE), 'w').close()
+        except Exception as e:
+            error_message = f"ファイルの保存中にエラーが発生しました: {e}"
+            job_id = ""
+
+    # 結果はページ上で EventSource により順次表示し、ファイル内容は Range リクエストで読み込む
     return render_template('index.html',
-                            output_content=output_content,
                             error_message=error_message,
-                            text1_content=text1_content, # 追加
-                            text2_content=text2_content, # 追加
-                            filename1=filename1, # 変更: ファイル名をテンプレートに渡す
-                            filename2=filename2) # 変更: ファイル名をテンプレートに渡す
+                            job_id=job_id,
+                            tagger=tagger,
+                            model=model,
+                            models=AVAILABLE_MODELS,
+                            phrase_scope=phrase_scope,
+                            filename1=filename1,
+                            filename2=filename2)
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Streams the analysis of a job as server-sent events."""
+    path = job_dir(job_id)
+    tagger = request.args.get('tagger', 'spacy')
+    model = request.args.get('model') or None
+    phrase_scope = request.args.get('phrase_scope', 'longest')
+    if not tagger_available(tagger):
+        abort(400)
+    if not is_model_choice(model):
+        abort(400)
+    if phrase_scope not in PHRASE_SCOPES:
+        abort(400)
+    profile_url = url_for('job_profile', job_id=job_id)
+    return Response(stream_analysis(path, tagger, model, profile_url, phrase_scope, arrived=time.time()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs/<job_id>/text/<int:number>')
+def job_text(job_id, number):
+    """Serves an uploaded text. Supports Range requests for lazy loading."""
+    if number not in (1, 2):
+        abort(404)
+    path = os.path.join(job_dir(job_id), f'text{number}.txt')
+    return send_file(os.path.abspath(path), mimetype='text/plain; charset=utf-8', conditional=True)
+
+
+@app.route('/jobs/<job_id>/report')
+def job_report(job_id):
+    """Serves the out.txt written by the event stream."""
+    path = os.path.join(job_dir(job_id), 'out.txt')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/plain; charset=utf-8',
+                     as_attachment=True, download_name='out.txt')
+
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Serves the job's profile (collapsed stacks, opens in speedscope or flamegraph.pl)."""
+    path = os.path.join(job_dir(job_id), PROFILE_FILE)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/plain; charset=utf-8',
+                     as_attachment=True, download_name=f'profile-{job_id}.collapsed')
+
+
+@app.route('/stats/models')
+def model_stats():
+    """Model pool statistics (hits, misses, evictions, resident models)."""
+    return jsonify(get_model_pool().stats())
+
+
+@app.route('/stats/phrases')
+def phrase_stats():
+    """Phrase analysis cache statistics (hits per tier, misses, hit rate)."""
+    return jsonify(get_phrase_cache().stats())
 
 if __name__ == '__main__':
     # 開発サーバー起動。本番環境ではGunicornなどを使う
@@ -0,0 +1,289 @@
+#async_analyzer.py
+"""
+asyncio facade over text_analyzer for use inside async services (aiohttp, ASGI).
+
+CPU-bound work (spaCy tagging, pattern mining) runs in worker processes so
+the event loop is never blocked. Every call accepts a per-call timeout, can
+be cancelled like any other coroutine, and concurrent identical calls share
+a single computation.
+
+Each worker process runs one job at a time and keeps its loaded models
+between jobs. When the last caller waiting on a running job is cancelled
+or times out, the worker running it is killed (and replaced on demand), so
+abandoned jobs never hold on to a worker slot.
+
+Usage:
+    async with AsyncTextAnalyzer(max_workers=2) as analyzer:
+        result = await analyzer.analyze(text1, text2, timeout=30)
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import shared_tokens
+import text_analyzer
+
+
+class WorkerDied(RuntimeError):
+    """The worker process exited while running a job."""
+
+
+def _worker_main(conn):
+    """Worker process: runs pickled (func, args) jobs from conn until it receives None."""
+    while True:
+        try:
+            job = pickle.loads(conn.recv_bytes())
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args = job
+        try:
+            reply = ('ok', func(*args))
+        except BaseException as e:
+            reply = ('error', e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # 結果 (または例外) が pickle できない
+            conn.send(('error', RuntimeError(f"could not send the result of {func.__name__}: {e!r}")))
+
+
+class _Worker:
+    """One worker process and the pipe to it."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, name, payload):
+        """Blocking: runs a pickled (func, args) job in the worker (called from a thread)."""
+        try:
+            self.conn.send_bytes(payload)
+            status, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            # 取り消しで kill された (またはワーカーが落ちた)
+            self.process.join()
+            self.conn.close()
+            raise WorkerDied(f"analysis worker exited while running {name}") from e
+        if status == 'error':
+            raise value
+        return value
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        self.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def _worker_context():
+    """
+    Start method for the worker processes. The facade runs inside threaded
+    servers, where fork can copy locks held by other threads, so workers
+    come from a forkserver (spawn where there is none). The forkserver
+    imports text_analyzer once, so replacing a killed worker stays cheap.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['text_analyzer'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class _InFlight:
+    """A running computation and the number of callers waiting on it."""
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class AsyncTextAnalyzer:
+    """Runs text_analyzer functions in worker processes from asyncio code."""
+
+    def __init__(self, max_workers=None, default_timeout=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.default_timeout = default_timeout
+        self._context = _worker_context()
+        self._threads = None # ワーカーの応答を待つスレッド (ワーカー1つにつき1本)
+        self._slots = None
+        self._idle = []
+        self._busy = set()
+        self._inflight = {} # {request_key: _InFlight}
+
+    async def __aenter__(self):
+        self._start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _start(self):
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_workers,
+                                               thread_name_prefix='analysis-worker')
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+    async def _run_job(self, name, payload):
+        """Runs a pickled job in an idle worker; a cancelled job's worker is killed."""
+        self._start()
+        async with self._slots:
+            worker = self._idle.pop() if self._idle else _Worker(self._context)
+            self._busy.add(worker)
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._threads, worker.run, name, payload)
+            except WorkerDied:
+                self._busy.discard(worker)
+                worker.stop()
+                raise
+            except asyncio.CancelledError:
+                # 実行中のジョブは止められないのでプロセスごと終了する。
+                # 待っていたスレッドは EOF で抜け、新しいワーカーは次のジョブで起動する
+                self._busy.discard(worker)
+                worker.kill()
+                raise
+            except BaseException:
+                # func 自体の例外: ワーカーはそのまま使える
+                self._busy.discard(worker)
+                self._idle.append(worker)
+                raise
+            self._busy.discard(worker)
+            self._idle.append(worker)
+            return result
+
+    async def close(self):
+        """Cancels pending and running work and stops the worker processes."""
+        for entry in list(self._inflight.values()):
+            entry.future.cancel()
+        for entry in list(self._inflight.values()):
+            try:
+                await entry.future
+            except BaseException:
+                pass
+        self._inflight.clear()
+        workers, self._idle = self._idle + list(self._busy), []
+        self._busy.clear()
+        threads, self._threads = self._threads, None
+        self._slots = None
+
+        def stop_all():
+            for worker in workers:
+                worker.stop()
+            if threads is not None:
+                threads.shutdown(wait=True)
+
+        # stop / shutdown はブロックするのでスレッドに逃がす
+        await asyncio.get_running_loop().run_in_executor(None, stop_all)
+
+    @staticmethod
+    def _encode(func, args):
+        """
+        Pickles a job once: returns (request key, payload). The payload is
+        what the worker receives, so the arguments are not pickled again.
+        """
+        payload = pickle.dumps((func, args), protocol=pickle.HIGHEST_PROTOCOL)
+        return hashlib.sha256(payload).hexdigest(), payload
+
+    async def _submit(self, func, *args, timeout=None, on_done=None):
+        """
+        Runs func(*args) in a worker, joining an identical in-flight call if
+        there is one. The shared computation is only cancelled once every
+        caller waiting on it has been cancelled or has timed out; if it is
+        already running, its worker process is killed.
+        on_done is called once the worker is finished with the arguments
+        (right away when an identical call was already running).
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+
+        try:
+            # 大きな引数の pickle / ハッシュはイベントループを止めるのでスレッドで行う
+            key, payload = await asyncio.get_running_loop().run_in_executor(None, self._encode, func, args)
+        except BaseException:
+            if on_done is not None:
+                on_done()
+            raise
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = _InFlight(asyncio.ensure_future(self._run_job(func.__name__, payload)))
+            self._inflight[key] = entry
+            entry.future.add_done_callback(lambda _f, key=key, entry=entry: self._forget(key, entry))
+            if on_done is not None:
+                entry.future.add_done_callback(lambda _f: on_done())
+        elif on_done is not None:
+            on_done()
+
+        entry.waiters += 1
+        try:
+            # shield: one caller's timeout/cancel must not kill the shared job
+            return await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.future.done():
+                # 誰も待っていない: 未開始なら取り消し、実行中ならワーカーを終了する
+                entry.future.cancel()
+                self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def normalize_and_pos_tag(self, text, preserve_case=False, tagger='spacy', model=None,
+                                    timeout=None):
+        return await self._submit(text_analyzer.normalize_and_pos_tag, text, preserve_case, tagger, model,
+                                  timeout=timeout)
+
+    async def find_common_patterns(self, tokens1, tokens2, min_length=1, max_length=None,
+                                   top_k=None, timeout=None):
+        return await self._submit(text_analyzer.find_common_patterns_improved,
+                                  tokens1, tokens2, min_length, max_length, top_k, timeout=timeout)
+
+    async def find_common_patterns_shared(self, columns1, columns2, min_length=1, max_length=None,
+                                          top_k=None, timeout=None):
+        """
+        find_common_patterns for shared_tokens.SharedTokenColumns: only the
+        block handles are sent to the worker. The blocks stay referenced until
+        the worker is done with them, even if this call times out.
+        """
+        handle1 = columns1.acquire()
+        handle2 = columns2.acquire()
+
+        def release():
+            columns1.release()
+            columns2.release()
+
+        return await self._submit(shared_tokens.find_common_patterns_shared,
+                                  handle1, handle2, min_length, max_length, top_k,
+                                  timeout=timeout, on_done=release)
+
+    async def find_pos_discrepancies(self, tokens1, tokens2, timeout=None):
+        return await self._submit(text_analyzer.find_pos_discrepancies_improved,
+                                  tokens1, tokens2, timeout=timeout)
+
+    async def analyze_phrase_patterns(self, text, model=None, timeout=None):
+        return await self._submit(text_analyzer.analyze_phrase_patterns, text, model, timeout=timeout)
+
+    async def analyze(self, text1, text2, min_length=1, max_length=None, top_k=None,
+                      overlap_first=False, tagger='spacy', model=None, phrase_scope='longest', timeout=None):
+        """
+        Runs the whole analysis as one job in a single worker, so the token
+        lists never have to travel back to the event loop process.
+        """
+        return await self._submit(text_analyzer.analyze_texts,
+                                  text1, text2, min_length, max_length, top_k, overlap_first, tagger, model,
+                                  phrase_scope, timeout=timeout)
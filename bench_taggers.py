@@ -0,0 +1,79 @@
+#bench_taggers.py
+"""
+Compares the tagger backends on some text files: tagging speed of each
+backend and the rate at which their UPOS tags agree with spaCy's.
+
+    python bench_taggers.py text1.txt text2.txt --repeat 3
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+
+from taggers import TAGGERS, ModelNotInstalled, get_tagger, perceptron_trained
+from text_analyzer import read_text_file
+
+
+def time_backend(backend, texts, repeat, preserve_case):
+    """Returns (tagged token lists, best seconds over repeat runs)."""
+    best = None
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = list(backend.pipe(texts, preserve_case=preserve_case))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, best
+
+
+def agreement(reference, candidate):
+    """Returns (matching tokens, compared tokens, Counter of (ref, cand) confusions)."""
+    matches = total = 0
+    confusions = Counter()
+    for ref_tokens, cand_tokens in zip(reference, candidate):
+        if len(ref_tokens) != len(cand_tokens):
+            raise ValueError("backends produced different tokenizations")
+        for ref, cand in zip(ref_tokens, cand_tokens):
+            total += 1
+            if ref['pos'] == cand['pos']:
+                matches += 1
+            else:
+                confusions[(ref['pos'], cand['pos'])] += 1
+    return matches, total, confusions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the POS tagger backends.")
+    parser.add_argument('files', nargs='*', default=['text1.txt', 'text2.txt'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--preserve-case', action='store_true')
+    args = parser.parse_args()
+
+    texts = [read_text_file(path) for path in args.files]
+    texts = [text for text in texts if text is not None]
+
+    results = {}
+    print(f"{'backend':<22} {'tokens':>8} {'seconds':>9} {'tokens/s':>10}")
+    for name in TAGGERS:
+        if name == 'perceptron' and not perceptron_trained():
+            # 学習済みモデルがない。規則だけのタガーは 'lexicon' として別に計測される
+            print("Note: no trained perceptron model, skipping it (train one with: python taggers.py train ...).")
+            continue
+        backend = get_tagger(name)
+        try:
+            list(backend.pipe(["warm up"])) # モデルのロード時間を計測に含めない
+        except ModelNotInstalled as e:
+            sys.exit(str(e))
+        tagged, seconds = time_backend(backend, texts, args.repeat, args.preserve_case)
+        n_tokens = sum(len(tokens) for tokens in tagged)
+        results[name] = tagged
+        print(f"{name:<22} {n_tokens:>8} {seconds:>9.4f} {n_tokens / max(seconds, 1e-9):>10.0f}")
+
+    print()
+    reference = results.pop('spacy')
+    for name, tagged in results.items():
+        matches, total, confusions = agreement(reference, tagged)
+        rate = matches / total if total else 1.0
+        print(f"Agreement spacy vs {name}: {rate:.2%} ({matches}/{total} tokens)")
+        for (ref, cand), count in confusions.most_common(5):
+            print(f"  spacy {ref:<6} -> {name} {cand:<6} x{count}")
@@ -0,0 +1,342 @@
+#corpus_index.py
+"""
+Sharded corpus index: finds the longest patterns a query document shares
+with any document of a large corpus.
+
+Documents are assigned to shards by a hash of their id, and every shard
+is a separate process holding its documents as interned id arrays plus an
+inverted index of seed n-gram signatures (CRC32 of the token/POS sequence
+of every seed_length-gram, so signatures are stable across processes and
+runs). A query is scatter-gathered by the coordinator (CorpusIndex):
+
+    1. the query's signatures and tokens are sent to every shard,
+    2. each shard ranks its documents by shared signatures and mines the
+       best candidates against the query with iter_common_patterns_ids
+       (same text + POS matching as find_common_patterns_improved). The
+       query is hashed once; each candidate's longest shared length is
+       probed against it, and candidates that cannot reach min_length or
+       beat the current top-k are skipped without mining,
+    3. the coordinator merges the per-shard top-k, longest first.
+
+Shards that do not answer within the timeout (slow, stopped or dead) are
+left out and the result is marked partial.
+
+    python corpus_index.py corpus_dir/ query.txt --shards 4 --top-k 10 --tagger fast
+"""
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter
+from itertools import islice
+from multiprocessing.connection import wait
+
+import text_analyzer
+from admission import longest_common_length_bound, window_hashes
+
+DEFAULT_SEED_LENGTH = 3
+# シャードごとに照合する候補文書の上限
+MAX_CANDIDATES = 200
+ADD_BATCH_SIZE = 500
+
+
+def shard_for(doc_id, n_shards):
+    """Shard number of a document: a stable hash of its id."""
+    digest = hashlib.blake2b(str(doc_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % n_shards
+
+
+def ngram_signatures(words, tags, length):
+    """Set of CRC32 signatures of every token/POS n-gram of the given length."""
+    items = [f"{w}\x1e{t}".encode('utf-8') for w, t in zip(words, tags)]
+    return {zlib.crc32(b"\x1f".join(items[i:i + length])) for i in range(len(items) - length + 1)}
+
+
+def _columns(tokens):
+    """(words, tags) lists of a normalize_and_pos_tag result."""
+    return [t['text'] for t in tokens], [t['pos'] for t in tokens]
+
+
+class _Shard:
+    """State of one shard process."""
+
+    def __init__(self, shard_id, seed_length):
+        self.shard_id = shard_id
+        self.seed_length = seed_length
+        self.doc_ids = []
+        self.doc_text = [] # array('i') per document
+        self.doc_pos = []
+        self.word_vocab = {}
+        self.tag_vocab = {}
+        self.postings = {} # signature -> array('i') of document numbers
+
+    def add(self, docs):
+        for doc_id, words, tags in docs:
+            number = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_text.append(array('i', [self.word_vocab.setdefault(w, len(self.word_vocab)) for w in words]))
+            self.doc_pos.append(array('i', [self.tag_vocab.setdefault(t, len(self.tag_vocab)) for t in tags]))
+            for signature in ngram_signatures(words, tags, self.seed_length):
+                self.postings.setdefault(signature, array('i')).append(number)
+
+    def query(self, words, tags, signatures, min_length, top_k):
+        hits = Counter()
+        for signature in signatures:
+            postings = self.postings.get(signature)
+            if postings is not None:
+                hits.update(postings)
+        if not hits:
+            return [], 0
+
+        # 知らない単語・品詞はこのシャードのどの文書にも一致しないので -1 にする
+        query_text = array('i', [self.word_vocab.get(w, -1) for w in words])
+        query_pos = array('i', [self.tag_vocab.get(t, -1) for t in tags])
+        words_list = list(self.word_vocab)
+        tags_list = list(self.tag_vocab)
+        query_hashes = window_hashes(query_text)
+
+        best = [] # min-heap of (length, -number, -sequence, pattern dict), at most top_k
+        sequence = itertools.count()
+        candidates = [number for number, _ in hits.most_common(MAX_CANDIDATES)]
+        for number in candidates:
+            # 最長の共通部分の上限 (単語のみ)。上位 top_k に入りえない文書は照合しない
+            longest = longest_common_length_bound(window_hashes(self.doc_text[number]), query_hashes, len(words))
+            if longest < min_length or (len(best) == top_k and longest < best[0][0]):
+                continue
+            # 文書側を text1 にする (パターンの文字列は文書の id から作るため)
+            patterns = text_analyzer.iter_common_patterns_ids(
+                self.doc_text[number], self.doc_pos[number], query_text, query_pos,
+                words_list, tags_list, min_length=min_length, longest=longest)
+            for pattern in islice(patterns, top_k):
+                entry = (pattern['length'], -number, -next(sequence), dict(pattern, doc_id=self.doc_ids[number]))
+                if len(best) < top_k:
+                    heapq.heappush(best, entry)
+                elif entry[:3] > best[0][:3]:
+                    heapq.heapreplace(best, entry)
+                else:
+                    break # 長い順に出てくるので、この文書の残りはもう入らない
+        best.sort(key=lambda entry: entry[:3], reverse=True)
+        return [entry[3] for entry in best], len(candidates)
+
+    def stats(self):
+        return {'shard': self.shard_id, 'documents': len(self.doc_ids),
+                'signatures': len(self.postings), 'vocabulary': len(self.word_vocab)}
+
+
+def _shard_main(conn, shard_id, seed_length):
+    """Shard process: serves add / query / stats messages until 'stop'."""
+    shard = _Shard(shard_id, seed_length)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        kind = message[0]
+        if kind == 'add':
+            shard.add(message[1])
+        elif kind == 'query':
+            _, query_id, words, tags, signatures, min_length, top_k = message
+            started = time.perf_counter()
+            patterns, candidates = shard.query(words, tags, signatures, min_length, top_k)
+            conn.send(('result', query_id, shard_id, {
+                'patterns': patterns,
+                'candidates': candidates,
+                'seconds': round(time.perf_counter() - started, 4),
+            }))
+        elif kind == 'stats':
+            conn.send(('stats', message[1], shard_id, shard.stats()))
+        elif kind == 'stop':
+            return
+
+
+class CorpusIndex:
+    """Coordinator: owns the shard processes and scatter-gathers queries."""
+
+    def __init__(self, n_shards=4, seed_length=DEFAULT_SEED_LENGTH):
+        self.n_shards = n_shards
+        self.seed_length = seed_length
+        self._conns = []
+        self._processes = []
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._pending = [[] for _ in range(n_shards)]
+        self._outstanding = set() # タイムアウトした問い合わせをまだ処理中のシャード
+        for shard_id in range(n_shards):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_main, args=(child_conn, shard_id, seed_length),
+                                              name=f'corpus-shard-{shard_id}', daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _send(self, shard_id, message):
+        """Sends to a shard; returns False if the shard is gone."""
+        try:
+            self._conns[shard_id].send(message)
+            return True
+        except (BrokenPipeError, EOFError, OSError):
+            return False
+
+    def add_document(self, doc_id, tokens):
+        """Adds a normalize_and_pos_tag result under doc_id (sent to its shard in batches)."""
+        words, tags = _columns(tokens)
+        shard_id = shard_for(doc_id, self.n_shards)
+        with self._lock:
+            self._pending[shard_id].append((doc_id, words, tags))
+            if len(self._pending[shard_id]) >= ADD_BATCH_SIZE:
+                self._flush_shard(shard_id)
+
+    def add_documents(self, documents):
+        """Adds (doc_id, tokens) pairs."""
+        for doc_id, tokens in documents:
+            self.add_document(doc_id, tokens)
+        self.flush()
+
+    def _flush_shard(self, shard_id):
+        if self._pending[shard_id]:
+            self._send(shard_id, ('add', self._pending[shard_id]))
+            self._pending[shard_id] = []
+
+    def flush(self):
+        """Sends the documents still waiting in the batches."""
+        with self._lock:
+            for shard_id in range(self.n_shards):
+                self._flush_shard(shard_id)
+
+    def _gather(self, message, timeout):
+        """
+        Sends message (with a fresh request id) to every shard and collects
+        the replies until all have answered or the timeout expires. Returns
+        ({shard_id: reply}, [shard ids without a reply]).
+        """
+        self.flush()
+        with self._lock:
+            request_id = next(self._request_ids)
+            waiting = {}
+            for shard_id, conn in enumerate(self._conns):
+                if shard_id in self._outstanding and not self._drain_late_reply(shard_id):
+                    # 前の問い合わせをまだ処理中。送るとパイプが詰まって待たされるので今回は外す
+                    continue
+                if self._send(shard_id, (message[0], request_id) + message[1:]):
+                    waiting[conn] = shard_id
+            replies = {}
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while waiting:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                ready = wait(list(waiting), remaining)
+                if not ready:
+                    break # タイムアウト: 残りのシャードは結果に含めない
+                for conn in ready:
+                    try:
+                        _, reply_id, shard_id, payload = conn.recv()
+                    except (EOFError, OSError):
+                        del waiting[conn] # シャードのプロセスが終了した
+                        continue
+                    if reply_id != request_id:
+                        continue # 前回タイムアウトした問い合わせへの遅れた返事
+                    replies[shard_id] = payload
+                    del waiting[conn]
+            self._outstanding.update(shard_id for conn, shard_id in waiting.items()
+                                     if self._processes[shard_id].is_alive())
+            missing = sorted(set(range(self.n_shards)) - set(replies))
+            return replies, missing
+
+    def _drain_late_reply(self, shard_id):
+        """Discards the late reply of a shard that timed out; True once it has arrived."""
+        conn = self._conns[shard_id]
+        try:
+            if not conn.poll():
+                return False
+            conn.recv()
+        except (EOFError, OSError):
+            return False
+        self._outstanding.discard(shard_id)
+        return True
+
+    def query(self, tokens, top_k=10, min_length=None, timeout=5.0):
+        """
+        Returns the top_k longest patterns the query tokens share with the
+        corpus, each with the doc_id it was found in:
+
+            {'patterns': [...], 'partial': bool, 'missing_shards': [...],
+             'shards': {shard_id: {'candidates': n, 'seconds': s}}}
+
+        min_length defaults to (and cannot be below) the seed length.
+        """
+        min_length = max(min_length or self.seed_length, self.seed_length)
+        words, tags = _columns(tokens)
+        signatures = ngram_signatures(words, tags, self.seed_length)
+        replies, missing = self._gather(('query', words, tags, signatures, min_length, top_k), timeout)
+
+        # シャードごとの上位 top_k を長い順に併合する
+        merged = heapq.merge(*(replies[shard_id]['patterns'] for shard_id in sorted(replies)),
+                             key=lambda pattern: -pattern['length'])
+        return {
+            'patterns': list(islice(merged, top_k)),
+            'partial': bool(missing),
+            'missing_shards': missing,
+            'shards': {shard_id: {'candidates': reply['candidates'], 'seconds': reply['seconds']}
+                       for shard_id, reply in sorted(replies.items())},
+        }
+
+    def stats(self, timeout=5.0):
+        """Document / signature counts of the shards that answer."""
+        replies, missing = self._gather(('stats',), timeout)
+        return {'shards': [replies[shard_id] for shard_id in sorted(replies)], 'missing_shards': missing}
+
+    def close(self):
+        """Stops the shard processes."""
+        for shard_id, (conn, process) in enumerate(zip(self._conns, self._processes)):
+            self._send(shard_id, ('stop',))
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self._conns = []
+        self._processes = []
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query a sharded corpus index for shared patterns.")
+    parser.add_argument('corpus', help="directory of .txt documents (document id = file name)")
+    parser.add_argument('query', help="text file to compare against the corpus")
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--seed-length', type=int, default=DEFAULT_SEED_LENGTH)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds to wait for the shards")
+    parser.add_argument('--tagger', default='spacy', help="POS tagger backend (spacy or perceptron)")
+    args = parser.parse_args()
+
+    with CorpusIndex(args.shards, args.seed_length) as index:
+        names = sorted(name for name in os.listdir(args.corpus) if name.endswith('.txt'))
+        print(f"Indexing {len(names)} documents into {args.shards} shards...")
+        for name in names:
+            text = text_analyzer.read_text_file(os.path.join(args.corpus, name))
+            if text is not None:
+                index.add_document(name, text_analyzer.normalize_and_pos_tag(text, tagger=args.tagger))
+        index.flush()
+
+        query_text = text_analyzer.read_text_file(args.query)
+        if query_text is None:
+            raise SystemExit(1)
+        result = index.query(text_analyzer.normalize_and_pos_tag(query_text, tagger=args.tagger),
+                             top_k=args.top_k, timeout=args.timeout)
+        if result['partial']:
+            print(f"Partial result: no answer from shards {result['missing_shards']}")
+        for pattern in result['patterns']:
+            print(f"{pattern['length']:>4}  {pattern['doc_id']}  {pattern['pattern']}  ({pattern['pos_pattern']})")
@@ -0,0 +1,223 @@
+#loadgen.py
+"""
+Replays a request log (see request_log.py) against a running app.py or
+app2.py and reports throughput and latency percentiles.
+
+    REQUEST_LOG=requests.log.jsonl REQUEST_LOG_BLOBS=request_blobs python app2.py
+    python loadgen.py requests.log.jsonl --url http://127.0.0.1:5000/ --concurrency 8
+
+Inputs are taken from the blob directory when their sha256 is there;
+otherwise a synthetic text of the recorded size is generated, so a log
+without blobs still reproduces the shape of the traffic. With app2 the
+returned page links the job's event stream, which is read to the end, so
+the measured latency covers the whole analysis. --speed 1 keeps the
+recorded gaps between requests (2 replays twice as fast); the default 0
+sends requests back to back.
+"""
+import argparse
+import bisect
+import hashlib
+import html
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from request_log import read_request_log
+
+EVENTS_LINK_PATTERN = re.compile(r'''["'](/jobs/[0-9a-f]{32}/events[^"']*)["']''')
+ERROR_PATTERN = re.compile(r'<p class="error">(.*?)</p>', re.S)
+
+# 合成テキストに使う単語 (頻度の偏りを少しつける)
+SYNTHETIC_WORDS = ("the of and to in a is that it was for on are as with his they at be this from "
+                   "have or by one had not but what all were when we there can an your which their "
+                   "analysis pattern common text model speech part noun verb phrase token sentence").split()
+
+# ヒストグラムの区切り (秒)
+HISTOGRAM_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60]
+
+
+def synthetic_text(size, seed):
+    """Returns roughly size bytes of sentence-like ASCII text, deterministic for a seed."""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        words = rng.choices(SYNTHETIC_WORDS, k=rng.randint(5, 15))
+        sentence = " ".join(words).capitalize() + ". "
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:size].encode('ascii')
+
+
+def load_input(spec, blob_dir):
+    """Returns the bytes of one recorded input."""
+    if blob_dir:
+        try:
+            with open(f"{blob_dir}/{spec['sha256']}", 'rb') as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() == spec['sha256']:
+                return data
+        except OSError:
+            pass
+    return synthetic_text(spec.get('bytes', 0), spec.get('sha256', ''))
+
+
+def encode_multipart(fields, files):
+    """Returns (body, content type) for a multipart/form-data POST."""
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, value in fields.items():
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, (filename, data) in files.items():
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                      f'Content-Type: text/plain\r\n\r\n'.encode('utf-8'))
+        chunks.append(data)
+        chunks.append(b'\r\n')
+    chunks.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b"".join(chunks), f'multipart/form-data; boundary={boundary}'
+
+
+def read_event_stream(response):
+    """Reads server-sent events until 'done' or 'failed'. Returns the last event name."""
+    event = None
+    for raw in response:
+        line = raw.decode('utf-8').rstrip("\r\n")
+        if line.startswith('event:'):
+            event = line[len('event:'):].strip()
+            if event in ('done', 'failed'):
+                return event
+    return event
+
+
+def replay_one(url, record, blob_dir, timeout):
+    """Sends one recorded request. Returns (ok, seconds, error message)."""
+    params = record.get('params') or {}
+    fields = {key: value for key, value in params.items() if value is not None}
+    inputs = record.get('inputs') or []
+    files = {f'file{i}': (f'text{i}.txt', load_input(spec, blob_dir)) for i, spec in enumerate(inputs[:2], 1)}
+    body, content_type = encode_multipart(fields, files)
+
+    started = time.perf_counter()
+    try:
+        post = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+        with urllib.request.urlopen(post, timeout=timeout) as response:
+            page = response.read().decode('utf-8', errors='replace')
+        error = ERROR_PATTERN.search(page)
+        if error:
+            return False, time.perf_counter() - started, html.unescape(error.group(1).strip())
+        link = EVENTS_LINK_PATTERN.search(page)
+        if link:
+            # app2: 解析はイベントストリームの中で行われる
+            events_url = urllib.parse.urljoin(url, html.unescape(link.group(1)))
+            with urllib.request.urlopen(events_url, timeout=timeout) as response:
+                last_event = read_event_stream(response)
+            if last_event != 'done':
+                return False, time.perf_counter() - started, f"stream ended with {last_event!r}"
+        return True, time.perf_counter() - started, None
+    except (urllib.error.URLError, OSError) as e:
+        return False, time.perf_counter() - started, str(e)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def histogram(sorted_values, buckets=HISTOGRAM_BUCKETS, width=40):
+    """Returns the lines of a text histogram of latencies."""
+    counts = [0] * (len(buckets) + 1)
+    for value in sorted_values:
+        counts[bisect.bisect_left(buckets, value)] += 1
+    used = [i for i, count in enumerate(counts) if count]
+    if not used:
+        return []
+    peak = max(counts)
+    lines = []
+    # 最初と最後の空でない区間の間だけ表示する
+    for i in range(used[0], used[-1] + 1):
+        label = f"<= {buckets[i]:g}s" if i < len(buckets) else f" > {buckets[-1]:g}s"
+        lines.append(f"  {label:>9} {counts[i]:>6} {'#' * round(counts[i] * width / peak)}")
+    return lines
+
+
+def run(records, url, concurrency, blob_dir, timeout, speed):
+    """Replays the records. Returns (results, wall seconds)."""
+    results = []
+    lock = threading.Lock()
+
+    def task(record):
+        result = replay_one(url, record, blob_dir, timeout)
+        with lock:
+            results.append(result)
+
+    first_ts = records[0].get('ts', 0) if records else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                # 記録されたリクエスト間隔を再現する
+                delay = (record.get('ts', first_ts) - first_ts) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(task, record)
+    return results, time.perf_counter() - started
+
+
+def report(results, wall_seconds):
+    """Prints throughput, percentiles, a histogram and the most common errors."""
+    latencies = sorted(seconds for ok, seconds, _ in results if ok)
+    errors = [error for ok, _, error in results if not ok]
+    print(f"requests: {len(results)}  ok: {len(latencies)}  errors: {len(errors)}")
+    print(f"wall time: {wall_seconds:.2f}s  throughput: {len(results) / max(wall_seconds, 1e-9):.2f} req/s")
+    if latencies:
+        p50, p95, p99 = (percentile(latencies, q) for q in (50, 95, 99))
+        print(f"latency p50: {p50:.3f}s  p95: {p95:.3f}s  p99: {p99:.3f}s  max: {latencies[-1]:.3f}s")
+        print("latency histogram (ok requests):")
+        for line in histogram(latencies):
+            print(line)
+    if errors:
+        print("errors:")
+        counts = {}
+        for error in errors:
+            counts[error] = counts.get(error, 0) + 1
+        for error, count in sorted(counts.items(), key=lambda item: -item[1])[:5]:
+            print(f"  x{count} {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded request log against the web app.")
+    parser.add_argument('log', help="JSONL written by the app when REQUEST_LOG is set")
+    parser.add_argument('--url', default="http://127.0.0.1:5000/", help="Upload form URL of the running app")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--blobs', default=None, help="Directory of recorded inputs (REQUEST_LOG_BLOBS)")
+    parser.add_argument('--repeat', type=int, default=1, help="Replay the log this many times")
+    parser.add_argument('--limit', type=int, default=None, help="Replay only the first N records")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="Keep recorded request gaps, scaled by this factor (0: back to back)")
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    records = [record for record in read_request_log(args.log) if record.get('inputs')]
+    if args.limit is not None:
+        records = records[:args.limit]
+    if args.speed > 0:
+        records.sort(key=lambda record: record.get('ts', 0))
+    if args.repeat > 1:
+        # 繰り返し分は記録時間の後ろにずらして並べる
+        span = (records[-1].get('ts', 0) - records[0].get('ts', 0)) if records else 0
+        records = [dict(record, ts=record.get('ts', 0) + n * span)
+                   for n in range(args.repeat) for record in records]
+    if not records:
+        parser.exit(1, "No replayable records in the log.\n")
+
+    results, wall_seconds = run(records, args.url, args.concurrency, args.blobs, args.timeout, args.speed)
+    report(results, wall_seconds)
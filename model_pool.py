@@ -0,0 +1,271 @@
+#model_pool.py
+"""
+Pool of loaded spaCy pipelines with per-language routing and LRU eviction.
+
+Models are loaded on demand. The most recently used ones stay resident while
+their estimated size fits in the RAM budget (MODEL_POOL_RAM_MB, default
+2048); beyond that the least recently used model is dropped. A request either
+names a model (one of the configured ones, e.g. en_core_web_md) or asks for
+'auto', which detects the language of the input and picks that language's
+model. stats() reports hits, misses, evictions and the resident models; the
+web apps serve it at /stats/models.
+
+Loading happens outside the pool's lock, so a cold load of a large model
+does not hold up requests for resident models; concurrent requests for the
+model being loaded wait for that one load.
+
+A model that fails to load is remembered as missing and not retried (until
+clear_missing() or a restart). A request naming a model that is not
+installed gets ModelNotInstalled; only 'auto' routing falls back to the
+default model when the language's model is missing.
+"""
+import gc
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import spacy
+
+DEFAULT_MODEL = "en_core_web_sm"
+AUTO = 'auto'
+
+# 言語ごとに使うモデル
+LANGUAGE_MODELS = {
+    'en': "en_core_web_sm",
+    'de': "de_core_news_sm",
+    'fr': "fr_core_news_sm",
+    'es': "es_core_news_sm",
+    'it': "it_core_news_sm",
+    'nl': "nl_core_news_sm",
+    'pt': "pt_core_news_sm",
+    'ja': "ja_core_news_sm",
+}
+# リクエストで直接指定できるモデル (任意のパスを spacy.load させないための許可リスト)
+AVAILABLE_MODELS = sorted(set(LANGUAGE_MODELS.values()) | {"en_core_web_md", "en_core_web_lg", "en_core_web_trf"})
+
+# 言語判定に使う頻出語
+_STOPWORDS = {
+    'en': "the and of to in is that it was for with as on be at by this have from not are".split(),
+    'de': "der die und das ist nicht ein eine zu den von mit sich des auf für im dem auch".split(),
+    'fr': "le la les et est des un une du que pas pour dans qui sur au avec ce il elle".split(),
+    'es': "el la los las y es que de en un una por con para del se su al lo como".split(),
+    'it': "il la le e di che un una per non sono con del della è gli si come anche".split(),
+    'nl': "de het een en van is dat niet op te zijn voor met aan er ook als bij".split(),
+    'pt': "o a os as e de que em um uma para com não do da por se mais como".split(),
+}
+_WORD_PATTERN = re.compile(r"[^\W\d_]+")
+_KANA_PATTERN = re.compile(r"[぀-ヿ]")
+
+
+class ModelNotInstalled(OSError):
+    """A spaCy model is not installed; the message says how to install it."""
+
+    def __init__(self, name):
+        super().__init__(f"SpaCy model '{name}' not found. Please run: python -m spacy download {name}")
+        self.model = name
+
+
+def is_model_choice(model):
+    """True for the model values a request may send: None/'' (default), 'auto' or an allowed name."""
+    return not model or model == AUTO or model in AVAILABLE_MODELS
+
+
+def detect_language(text, sample_chars=10000):
+    """
+    Cheap language guess from the first sample_chars characters: kana means
+    Japanese, otherwise the language whose stopwords cover the most words.
+    Falls back to English.
+    """
+    sample = text[:sample_chars]
+    if _KANA_PATTERN.search(sample):
+        return 'ja'
+    words = _WORD_PATTERN.findall(sample.lower())
+    if not words:
+        return 'en'
+    scores = {lang: 0 for lang in _STOPWORDS}
+    stopword_sets = {lang: set(stopwords) for lang, stopwords in _STOPWORDS.items()}
+    for word in words:
+        for lang, stopwords in stopword_sets.items():
+            if word in stopwords:
+                scores[lang] += 1
+    best = max(scores, key=lambda lang: (scores[lang], lang == 'en'))
+    return best if scores[best] else 'en'
+
+
+def estimate_model_mb(name):
+    """Rough resident size of a model: the size of its installed package."""
+    try:
+        path = spacy.util.get_package_path(name)
+    except Exception:
+        return 0.0
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total / (1024 * 1024)
+
+
+class ModelPool:
+    """LRU cache of spaCy pipelines bounded by an estimated RAM budget."""
+
+    def __init__(self, ram_budget_mb=None, default_model=DEFAULT_MODEL,
+                 language_models=LANGUAGE_MODELS, available_models=AVAILABLE_MODELS,
+                 model_sizes_mb=None, loader=spacy.load):
+        if ram_budget_mb is None:
+            ram_budget_mb = float(os.environ.get('MODEL_POOL_RAM_MB', 2048))
+        self.ram_budget_mb = ram_budget_mb
+        self.default_model = default_model
+        self.language_models = dict(language_models)
+        self.available_models = set(available_models) | {default_model}
+        self.model_sizes_mb = dict(model_sizes_mb or {})
+        self._loader = loader
+        self._models = OrderedDict() # {model name: (nlp, estimated MB)} 古い順
+        self._lock = threading.Lock()
+        self._loading = {} # {model name: threading.Event} ロード中のモデル
+        self._missing = set() # ロードに失敗したモデル (再試行しない)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fallbacks = 0
+        self.routed = {} # {language: requests}
+
+    def resolve(self, model=None, text=None):
+        """
+        Returns the model name to use for a request. 'auto' routes to the
+        language's model, or to the default one if that model is known to be
+        missing.
+        """
+        if model is None:
+            return self.default_model
+        if model == AUTO:
+            language = detect_language(text or "")
+            name = self.language_models.get(language, self.default_model)
+            with self._lock:
+                self.routed[language] = self.routed.get(language, 0) + 1
+                if name in self._missing and name != self.default_model:
+                    self.fallbacks += 1
+                    name = self.default_model
+            return name
+        if model not in self.available_models:
+            raise ValueError(f"Unknown model '{model}'. Choose from: {', '.join(sorted(self.available_models))}")
+        return model
+
+    def get(self, model=None, text=None):
+        """Returns a loaded pipeline, loading (and evicting) as needed."""
+        return self.load(model, text)[1]
+
+    def load(self, model=None, text=None):
+        """
+        Returns (name, pipeline) for a request, where name is the model that
+        was actually loaded. Raises ModelNotInstalled for a missing model,
+        except that 'auto' falls back to the default model.
+        """
+        name = self.resolve(model, text)
+        try:
+            return name, self._get_named(name)
+        except ModelNotInstalled:
+            if model != AUTO or name == self.default_model:
+                raise
+        with self._lock:
+            self.fallbacks += 1
+        print(f"SpaCy model '{name}' not found, using '{self.default_model}' for 'auto' instead.")
+        return self.default_model, self._get_named(self.default_model)
+
+    def cache_name(self, model=None, text=None):
+        """
+        The model whose output a request gets, for keying cached results.
+        For 'auto' the routed model is loaded first, so a missing one is
+        keyed as the default model it falls back to.
+        """
+        if model == AUTO:
+            return self.load(model, text)[0]
+        return self.resolve(model, text)
+
+    def clear_missing(self):
+        """Forgets failed loads, e.g. after installing models."""
+        with self._lock:
+            self._missing.clear()
+
+    def _get_named(self, name):
+        # ロード中はロックを持たない (大きなモデルのロードで他のリクエストや stats を止めない)。
+        # 同じモデルを同時に要求したスレッドは、ロードしているスレッドの完了を待つ
+        while True:
+            with self._lock:
+                if name in self._missing:
+                    raise ModelNotInstalled(name)
+                if name in self._models:
+                    self.hits += 1
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+                loading = self._loading.get(name)
+                if loading is None:
+                    self.misses += 1
+                    loading = self._loading[name] = threading.Event()
+                    break
+            loading.wait() # 失敗していれば _missing に入っている
+
+        try:
+            try:
+                nlp = self._loader(name)
+            except OSError as e:
+                with self._lock:
+                    self._missing.add(name)
+                raise ModelNotInstalled(name) from e
+            size = self.model_sizes_mb.get(name)
+            if size is None:
+                size = estimate_model_mb(name)
+            with self._lock:
+                self._models[name] = (nlp, size)
+                self._evict(keep=name)
+            return nlp
+        finally:
+            with self._lock:
+                del self._loading[name]
+            loading.set()
+
+    def _evict(self, keep):
+        evicted = False
+        while self._resident_mb() > self.ram_budget_mb and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            del self._models[oldest]
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def _resident_mb(self):
+        return sum(size for _nlp, size in self._models.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'ram_budget_mb': self.ram_budget_mb,
+                'resident_mb': round(self._resident_mb(), 1),
+                'resident_models': [{'model': name, 'estimated_mb': round(size, 1)}
+                                    for name, (_nlp, size) in reversed(self._models.items())],
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'fallbacks': self.fallbacks,
+                'loading_models': sorted(self._loading),
+                'missing_models': sorted(self._missing),
+                'routed_languages': dict(self.routed),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_model_pool():
+    """Returns the process-wide model pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ModelPool()
+        return _pool
@@ -0,0 +1,260 @@
+#parallel_mining.py
+"""
+Parallel common-pattern mining over a process pool.
+
+The n-grams of each length are partitioned by a hash of their first two
+token ids (the first token for length 1). All occurrences of an n-gram
+start with the same tokens, so they fall into the same partition, and each
+partition can build its own text/POS tables and find its matches without
+seeing the others. The token id columns of both texts are put into one
+shared memory block once, and the parent hashes the anchors once into a
+second block: the starts of each text ordered by partition, with the
+bounds of every partition. Tasks only carry the block names, a partition
+and a block of lengths, and a worker slices its starts out of the block.
+
+PartitionedNgramIndex plugs into text_analyzer.iter_common_patterns_ids
+as its per-length index: the matches of all partitions are merged back
+into first-occurrence order, and the sub-pattern filter then runs exactly
+as in the serial miner, so the output is identical to serial mode.
+
+    python text_analyzer.py text1.txt text2.txt --workers 8
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import text_analyzer
+from admission import probe_longest_common_length
+from shared_tokens import ID_DTYPE, _attach_block
+
+# ワーカー数に対するパーティション数 (偏りのある語の分布でも負荷を均すため多めに切る)
+PARTITIONS_PER_WORKER = 4
+# 1 タスクで処理する長さの数
+LEVEL_BLOCK = 16
+
+_MIX1 = np.uint64(0x9E3779B97F4A7C15)
+_MIX2 = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+def _anchor_partitions(text_ids, n_partitions):
+    """
+    Returns (partition of each 1-gram start, partition of each start of a
+    longer n-gram); the second array is one shorter.
+    """
+    ids = np.asarray(text_ids).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        first = ids * _MIX1
+        first ^= first >> np.uint64(29)
+        pair = first[:-1] ^ (ids[1:] * _MIX2)
+        pair ^= pair >> np.uint64(31)
+        pair *= _MIX1
+        pair ^= pair >> np.uint64(29)
+    return first % np.uint64(n_partitions), pair % np.uint64(n_partitions)
+
+
+def _partition_order(partitions, n_partitions):
+    """Starts ordered by partition (ascending within one) and the bounds of each partition."""
+    partitions = partitions.astype(np.int64)
+    order = np.argsort(partitions, kind='stable')
+    bounds = np.searchsorted(partitions[order], np.arange(n_partitions + 1))
+    return order, bounds
+
+
+def _anchor_layout(n1, n2, n_partitions):
+    """Offsets (in int64 items) of the anchor arrays in the partition block."""
+    layout, offset = {}, 0
+    for key, size in (('singles1', n1), ('pairs1', max(n1 - 1, 0)),
+                      ('singles2', n2), ('pairs2', max(n2 - 1, 0))):
+        layout[key] = (offset, size)
+        offset += size
+        layout[key + '_bounds'] = (offset, n_partitions + 1)
+        offset += n_partitions + 1
+    return layout, offset
+
+
+def _partition_starts(anchors, layout, key, partition):
+    offset, size = layout[key]
+    bounds_offset = layout[key + '_bounds'][0]
+    lo, hi = anchors[bounds_offset + partition], anchors[bounds_offset + partition + 1]
+    return anchors[offset + lo:offset + hi]
+
+
+def _mine_partition(name, anchors_name, n1, n2, partition, n_partitions, lengths):
+    """
+    Worker: the matches of one partition for each length, as
+    {length: int64 array of (first start, last start) rows} in
+    first-occurrence order. Same table semantics as
+    text_analyzer._memory_level_matches.
+    """
+    shm = _attach_block(name)
+    anchors_shm = _attach_block(anchors_name)
+    try:
+        columns = np.ndarray((2 * (n1 + n2),), dtype=ID_DTYPE, buffer=shm.buf)
+        text1, pos1 = columns[:n1], columns[n1:2 * n1]
+        text2, pos2 = columns[2 * n1:2 * n1 + n2], columns[2 * n1 + n2:]
+        layout, size = _anchor_layout(n1, n2, n_partitions)
+        anchors = np.ndarray((size,), dtype=np.int64, buffer=anchors_shm.buf)
+        # コピーして共有ブロックへの参照を残さない
+        singles1 = _partition_starts(anchors, layout, 'singles1', partition).copy()
+        pairs1 = _partition_starts(anchors, layout, 'pairs1', partition).copy()
+        singles2 = _partition_starts(anchors, layout, 'singles2', partition).copy()
+        pairs2 = _partition_starts(anchors, layout, 'pairs2', partition).copy()
+        del anchors
+        itemsize = columns.itemsize
+        raw_text1, raw_pos1 = memoryview(text1).cast('B'), memoryview(pos1).cast('B')
+        raw_text2, raw_pos2 = memoryview(text2).cast('B'), memoryview(pos2).cast('B')
+
+        results = {}
+        for length in lengths:
+            starts1 = singles1 if length == 1 else pairs1[:np.searchsorted(pairs1, n1 - length, side='right')]
+            starts2 = singles2 if length == 1 else pairs2[:np.searchsorted(pairs2, n2 - length, side='right')]
+            span = length * itemsize
+
+            # text 2: n-gram -> POS n-gram of its last occurrence
+            table2 = {}
+            for i in starts2.tolist():
+                offset = i * itemsize
+                table2[raw_text2[offset:offset + span].tobytes()] = raw_pos2[offset:offset + span].tobytes()
+
+            # text 1: n-gram -> (POS n-gram of the last occurrence, first start, last start)
+            table1 = {}
+            for i in starts1.tolist():
+                offset = i * itemsize
+                gram = raw_text1[offset:offset + span].tobytes()
+                entry = table1.get(gram)
+                table1[gram] = (raw_pos1[offset:offset + span].tobytes(), i if entry is None else entry[1], i)
+
+            matches = [(first, last) for gram, (pos_gram, first, last) in table1.items()
+                       if table2.get(gram) == pos_gram]
+            results[length] = np.array(matches, dtype=np.int64).reshape(-1, 2)
+        del columns, text1, pos1, text2, pos2, raw_text1, raw_pos1, raw_text2, raw_pos2
+        return results
+    finally:
+        for block in (shm, anchors_shm):
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+
+class PartitionedNgramIndex:
+    """
+    Per-length index for iter_common_patterns_ids that mines the
+    partitions in a process pool, LEVEL_BLOCK lengths per task. Use as a
+    context manager (or call close()) to free the shared block and, if it
+    created it, the pool.
+    """
+
+    def __init__(self, workers=None, executor=None, partitions=None, min_length=1, level_block=LEVEL_BLOCK):
+        self.workers = workers or os.cpu_count() or 1
+        self.partitions = partitions or self.workers * PARTITIONS_PER_WORKER
+        self.min_length = max(min_length, 1)
+        self.level_block = level_block
+        self._own_executor = executor is None
+        self._executor = executor or ProcessPoolExecutor(max_workers=self.workers)
+        self._shm = None
+        self._anchors_shm = None
+        self._columns_id = None
+        self._levels = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _share(self, text_ids1, pos_ids1, text_ids2, pos_ids2):
+        n1, n2 = len(text_ids1), len(text_ids2)
+        size = max(2 * (n1 + n2) * np.dtype(ID_DTYPE).itemsize, 1)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        columns = np.ndarray((2 * (n1 + n2),), dtype=ID_DTYPE, buffer=self._shm.buf)
+        offset = 0
+        for column in (text_ids1, pos_ids1, text_ids2, pos_ids2):
+            columns[offset:offset + len(column)] = np.asarray(column, dtype=ID_DTYPE)
+            offset += len(column)
+        del columns
+        self._shape = (n1, n2)
+
+        # アンカーのパーティション分けは親で一度だけ行い、ワーカーは切り出すだけにする
+        layout, size = _anchor_layout(n1, n2, self.partitions)
+        self._anchors_shm = shared_memory.SharedMemory(create=True, size=max(size * 8, 1))
+        anchors = np.ndarray((size,), dtype=np.int64, buffer=self._anchors_shm.buf)
+        for suffix, text_ids in (('1', text_ids1), ('2', text_ids2)):
+            for key, partitions in zip(('singles', 'pairs'), _anchor_partitions(text_ids, self.partitions)):
+                order, bounds = _partition_order(partitions, self.partitions)
+                offset, count = layout[key + suffix]
+                anchors[offset:offset + count] = order
+                bounds_offset = layout[key + suffix + '_bounds'][0]
+                anchors[bounds_offset:bounds_offset + self.partitions + 1] = bounds
+        del anchors
+
+    def _mine_block(self, length):
+        """Mines lengths length .. length - level_block + 1 (not below min_length) in parallel."""
+        lengths = list(range(length, max(length - self.level_block, self.min_length - 1), -1))
+        n1, n2 = self._shape
+        futures = [self._executor.submit(_mine_partition, self._shm.name, self._anchors_shm.name,
+                                         n1, n2, partition,
+                                         self.partitions, lengths)
+                   for partition in range(self.partitions)]
+        results = [future.result() for future in futures]
+        for level in lengths:
+            rows = np.concatenate([result[level] for result in results])
+            # パーティションごとの結果を最初の出現位置の順に戻す
+            rows = rows[np.argsort(rows[:, 0], kind='stable')]
+            self._levels[level] = rows[:, 1].tolist()
+
+    def __call__(self, text_ids1, pos_ids1, text_ids2, pos_ids2, length):
+        if self._shm is None:
+            self._share(text_ids1, pos_ids1, text_ids2, pos_ids2)
+            self._columns_id = id(text_ids1)
+        elif id(text_ids1) != self._columns_id:
+            raise ValueError("PartitionedNgramIndex is bound to the columns of its first call")
+        if length not in self._levels:
+            self._mine_block(length)
+        yield from self._levels.pop(length)
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._anchors_shm is not None:
+            self._anchors_shm.close()
+            self._anchors_shm.unlink()
+            self._anchors_shm = None
+        self._levels = {}
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def iter_common_patterns_parallel(tokens1, tokens2, min_length=1, max_length=None, workers=None,
+                                  executor=None, longest=None):
+    """
+    iter_common_patterns mined in parallel; yields exactly the same
+    patterns in the same order. longest, if known (e.g. from an admission
+    plan), skips the rolling-hash probe.
+    """
+    min_length = max(min_length, 1)
+    if longest is None:
+        upper = min(len(tokens1), len(tokens2))
+        if max_length is not None:
+            upper = min(upper, max_length)
+        longest = probe_longest_common_length(tokens1, tokens2, upper)
+    with PartitionedNgramIndex(workers, executor, min_length=min_length) as index:
+        yield from text_analyzer.iter_common_patterns(tokens1, tokens2, min_length=min_length,
+                                                      max_length=max_length, index=index, longest=longest)
+
+
+def find_common_patterns_parallel(tokens1, tokens2, min_length=1, max_length=None, top_k=None,
+                                  workers=None, executor=None, longest=None):
+    """find_common_patterns_improved using a process pool of workers."""
+    patterns = iter_common_patterns_parallel(tokens1, tokens2, min_length=min_length, max_length=max_length,
+                                             workers=workers, executor=executor, longest=longest)
+    try:
+        return list(islice(patterns, top_k))
+    finally:
+        patterns.close()
@@ -0,0 +1,160 @@
+#phrase_cache.py
+"""
+Cache of phrase-pattern analyses.
+
+The same common patterns come back in many comparisons, and every
+analysis runs the spaCy parser. Results are cached under
+(normalized pattern text, resolved model name, phrase_rules.RULES_VERSION):
+
+    * an in-process LRU of PHRASE_CACHE_SIZE entries (default 4096, 0
+      turns caching off), and
+    * optionally a persistent SQLite tier at PHRASE_CACHE_DB, shared by
+      worker processes and restarts. Entries of other rule versions are
+      simply never looked up again.
+
+stats() reports hits per tier, misses and the hit rate; the web apps serve
+it at /stats/phrases.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from phrase_rules import RULES_VERSION
+
+DEFAULT_SIZE = 4096
+
+
+def normalize_pattern(text):
+    """Cache key form of a pattern: whitespace collapsed."""
+    return " ".join(text.split())
+
+
+class PhraseCache:
+    """LRU cache of phrase analyses with an optional SQLite tier."""
+
+    def __init__(self, max_entries=DEFAULT_SIZE, db_path=None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS phrase_cache (key TEXT PRIMARY KEY, analysis TEXT)')
+            self._db.commit()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text, model_name):
+        return (normalize_pattern(text), model_name, RULES_VERSION)
+
+    def _db_get(self, key):
+        row = self._db.execute('SELECT analysis FROM phrase_cache WHERE key = ?',
+                               (json.dumps(key, ensure_ascii=False),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _db_put(self, key, analysis, commit=True):
+        self._db.execute('INSERT OR REPLACE INTO phrase_cache VALUES (?, ?)',
+                         (json.dumps(key, ensure_ascii=False), json.dumps(analysis, ensure_ascii=False)))
+        if commit:
+            self._db.commit()
+
+    def _remember(self, key, analysis):
+        self._entries[key] = analysis
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, text, model_name, compute):
+        """
+        Returns the analysis of text with the given model, calling
+        compute() only on a miss. The caller gets its own copy of the records.
+        """
+        return self.get_or_compute_many([text], model_name, lambda _texts: [compute()])[0]
+
+    def get_or_compute_many(self, texts, model_name, compute_many):
+        """
+        Batch form of get_or_compute: returns one analysis per text, calling
+        compute_many(missed texts) once for all misses (e.g. through
+        nlp.pipe). Texts with the same key are computed once.
+        """
+        if self.max_entries <= 0:
+            return compute_many(list(texts))
+        results = [None] * len(texts)
+        missed = {} # {key: (text, [indices])}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self.make_key(text, model_name)
+                if key in missed:
+                    missed[key][1].append(i)
+                    continue
+                analysis = self._entries.get(key)
+                if analysis is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[i] = [dict(record) for record in analysis]
+                    continue
+                if self._db is not None:
+                    analysis = self._db_get(key)
+                    if analysis is not None:
+                        self.persistent_hits += 1
+                        self._remember(key, analysis)
+                        results[i] = [dict(record) for record in analysis]
+                        continue
+                self.misses += 1
+                missed[key] = (text, [i])
+        if not missed:
+            return results
+
+        # 解析はロックの外で行う (同じパターンが同時に来たら二重に解析するだけ)
+        analyses = compute_many([text for text, _ in missed.values()])
+        with self._lock:
+            for (key, (_text, indices)), analysis in zip(missed.items(), analyses):
+                self._remember(key, [dict(record) for record in analysis])
+                if self._db is not None:
+                    self._db_put(key, analysis, commit=False)
+                for i in indices:
+                    results[i] = [dict(record) for record in analysis]
+            if self._db is not None:
+                self._db.commit()
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'persistent': self.db_path,
+                'rules_version': RULES_VERSION,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.persistent_hits) / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_phrase_cache():
+    """Returns the process-wide phrase cache configured from the environment."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PhraseCache(int(os.environ.get('PHRASE_CACHE_SIZE', DEFAULT_SIZE)),
+                                 os.environ.get('PHRASE_CACHE_DB') or None)
+        return _cache
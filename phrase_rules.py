@@ -0,0 +1,158 @@
+#phrase_rules.py
+"""
+Declarative phrase rules for analyze_phrase_patterns.
+
+Each rule describes a phrase type by its head token and the dependency
+labels of the children that belong to it. compile_rules() turns the rules
+into integer ids for a vocabulary once; extract_phrases() then applies all
+rules to a parsed Doc with array operations over Doc.to_array columns
+(POS, DEP, HEAD) instead of walking tokens in Python, so it can be run over
+every sentence of a large document.
+
+Rule fields:
+    type         - label shown in the report
+    head_pos     - UPOS tag of the head token
+    head_dep     - (optional) dependency label the head must have
+    child_deps   - dependency labels of children that join the phrase
+    expand_deps  - children with these labels also bring all of their own children
+    description  - format string; {head} and {pos} are the head's text and UPOS tag
+"""
+from collections import namedtuple
+
+import numpy as np
+from spacy.attrs import DEP, HEAD, POS
+
+# ルールを変更したら上げる (フレーズ解析のキャッシュのキーにも使う)
+RULES_VERSION = 1
+
+PHRASE_RULES = [
+    {
+        'type': 'Verb Phrase (VP) - inferred',
+        'head_pos': 'VERB',
+        'head_dep': 'ROOT', # 文の主要動詞
+        'child_deps': ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"],
+        'expand_deps': ["prep"], # 前置詞句はさらにその子要素も含む
+        'description': "A verb phrase centered around '{head}' ('{pos}') possibly including its objects/complements/adjuncts.",
+    },
+    {
+        'type': 'Adjective Phrase (ADJP) - inferred',
+        'head_pos': 'ADJ',
+        'child_deps': ["advmod", "prep", "amod"],
+        'description': "An adjective phrase centered around '{head}' ('{pos}').",
+    },
+    {
+        'type': 'Adverb Phrase (ADVP) - inferred',
+        'head_pos': 'ADV',
+        'child_deps': ["advmod", "prep"],
+        'description': "An adverb phrase centered around '{head}' ('{pos}').",
+    },
+]
+
+CompiledRule = namedtuple('CompiledRule', ['type', 'pos_id', 'dep_id', 'child_dep_ids',
+                                           'expand_dep_ids', 'description'])
+
+_compiled_cache = {}
+
+
+def compile_rules(vocab, rules=PHRASE_RULES):
+    """Resolves the rule labels to the integer ids used by Doc.to_array."""
+    key = (id(vocab), id(rules))
+    if key in _compiled_cache:
+        return _compiled_cache[key]
+
+    def dep_ids(labels):
+        return np.array([vocab.strings.add(label) for label in labels], dtype=np.uint64)
+
+    compiled = []
+    for rule in rules:
+        compiled.append(CompiledRule(
+            type=rule['type'],
+            pos_id=vocab.strings.add(rule['head_pos']), # UPOS の値はシンボル ID と一致する
+            dep_id=vocab.strings.add(rule['head_dep']) if rule.get('head_dep') else None,
+            child_dep_ids=dep_ids(rule['child_deps']),
+            expand_dep_ids=dep_ids(rule.get('expand_deps', [])),
+            description=rule['description'],
+        ))
+    _compiled_cache[key] = compiled
+    return compiled
+
+
+def _rule_members(rule, pos, dep, heads, index):
+    """
+    Returns (phrase head, member) index pairs for one rule: the children of
+    matching heads with an allowed label, plus the children of 'expand'
+    children.
+    """
+    is_head = pos == rule.pos_id
+    if rule.dep_id is not None:
+        is_head &= dep == rule.dep_id
+    has_parent = heads != index
+
+    children = np.nonzero(has_parent & is_head[heads] & np.isin(dep, rule.child_dep_ids))[0]
+    pairs = [np.stack([heads[children], children], axis=1)]
+
+    if len(rule.expand_dep_ids):
+        is_expanded = np.zeros(len(pos), dtype=bool)
+        is_expanded[children[np.isin(dep[children], rule.expand_dep_ids)]] = True
+        grandchildren = np.nonzero(has_parent & is_expanded[heads])[0]
+        pairs.append(np.stack([heads[heads[grandchildren]], grandchildren], axis=1))
+
+    return np.concatenate(pairs)
+
+
+def extract_phrases(doc, rules=PHRASE_RULES):
+    """
+    Applies the phrase rules to a parsed Doc. Returns
+    [(head index, rule index, member indexes)] ordered by head token and
+    rule, where the member indexes are sorted and include the head.
+    """
+    n = len(doc)
+    if n == 0:
+        return []
+    columns = doc.to_array([POS, DEP, HEAD])
+    pos = columns[:, 0]
+    dep = columns[:, 1]
+    index = np.arange(n)
+    # HEAD は相対位置 (uint64 で負数が折り返されている) なので絶対位置に直す
+    heads = columns[:, 2].astype(np.int64) + index
+
+    phrases = []
+    for rule_index, rule in enumerate(compile_rules(doc.vocab, rules)):
+        pairs = _rule_members(rule, pos, dep, heads, index)
+        if not len(pairs):
+            continue
+        # 見出し語ごとにまとめ、トークンの位置順に並べる (str.find による並べ替えは不要)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        group_starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]])
+        for start, members in zip(group_starts, np.split(pairs[:, 1], group_starts[1:])):
+            head = int(pairs[start, 0])
+            phrases.append((head, rule_index, np.union1d(members, [head])))
+    phrases.sort(key=lambda phrase: (phrase[0], phrase[1]))
+    return phrases
+
+
+def analyze_doc_phrases(doc, rules=PHRASE_RULES):
+    """
+    Returns the phrase patterns of a parsed Doc in the report format:
+    noun chunks first, then the rule-based phrases in token order.
+    """
+    phrases_info = []
+
+    # 1. 名詞句 (Noun Chunks) の抽出
+    for chunk in doc.noun_chunks:
+        phrases_info.append({
+            'pattern': chunk.text,
+            'type': 'Noun Phrase (NP)',
+            'description': f"A noun phrase headed by '{chunk.root.text}' ('{chunk.root.pos_}') including its modifiers."
+        })
+
+    # 2. その他の句構造 (依存関係のルールに基づく)
+    for head, rule_index, members in extract_phrases(doc, rules):
+        rule = rules[rule_index]
+        head_token = doc[head]
+        phrases_info.append({
+            'pattern': " ".join(doc[int(i)].text for i in members),
+            'type': rule['type'],
+            'description': rule['description'].format(head=head_token.text, pos=head_token.pos_),
+        })
+    return phrases_info
@@ -0,0 +1,150 @@
+#profiling.py
+"""
+Opt-in sampling profiler for single analyses.
+
+A background thread samples the stack of the analysing thread through
+sys._current_frames() every PROFILE_INTERVAL_MS milliseconds (default 5)
+and counts identical stacks. The result is written in the collapsed-stack
+format ("outer;inner;leaf count" per line), which flamegraph.pl and
+speedscope.app open directly. Being a sampler, it also sees time spent in
+spaCy and NumPy calls without slowing every Python function call down.
+
+Profiles are taken when
+  * the CLI is run with --profile PATH, or
+  * a web request carries the admin token (X-Profile-Token header or the
+    profile_token form field) and ADMIN_TOKEN is set on the server, or
+  * PROFILE_SLOW_SECONDS is set and an analysis takes at least that long.
+    The sampler then runs for every analysis and the profile is kept only
+    for the slow ones.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+
+
+def admin_token_ok(token):
+    """True when ADMIN_TOKEN is configured and token matches it."""
+    expected = os.environ.get('ADMIN_TOKEN')
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def slow_threshold():
+    """PROFILE_SLOW_SECONDS as a float, or None when automatic capture is off."""
+    value = os.environ.get('PROFILE_SLOW_SECONDS')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # collapsed 形式では ';' が区切りなので名前からは除く
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def collapse_stack(frame):
+    """Returns the collapsed-stack key of a frame, outermost call first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval."""
+
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break # 対象のスレッドが終了した
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+            del frame
+
+    def write_collapsed(self, filepath):
+        """Writes the samples in collapsed-stack format, most frequent stacks first."""
+        with open(filepath, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """
+    Profiles one analysis: always when requested, otherwise only when it
+    turns out slower than slow_seconds. Call start()/stop() around the
+    analysis (or use it as a context manager), then save() if kept.
+    """
+
+    def __init__(self, requested=False, slow_seconds=None, interval=DEFAULT_INTERVAL):
+        self.requested = requested
+        self.slow_seconds = slow_seconds
+        self.active = requested or slow_seconds is not None
+        self.elapsed = None
+        self.kept = False
+        self._profiler = SamplingProfiler(interval=interval) if self.active else None
+        self._started = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self._profiler is not None:
+            self._profiler.start()
+        return self
+
+    def stop(self):
+        if self._started is None or self.elapsed is not None:
+            return self
+        self.elapsed = time.perf_counter() - self._started
+        if self._profiler is not None:
+            self._profiler.stop()
+            self.kept = self.requested or self.elapsed >= self.slow_seconds
+        return self
+
+    @property
+    def reason(self):
+        return "requested" if self.requested else f"slower than {self.slow_seconds:g}s"
+
+    def save(self, filepath):
+        """Writes the profile if it was kept. Returns filepath, or None."""
+        if not self.kept:
+            return None
+        self._profiler.write_collapsed(filepath)
+        return filepath
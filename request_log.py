@@ -0,0 +1,95 @@
+#request_log.py
+"""
+Optional JSONL log of the analysis requests handled by the web apps, for
+replaying with loadgen.py.
+
+Recording is off unless REQUEST_LOG names the log file. Each analysis
+appends one line, stamped with the time the request arrived (loadgen.py
+--speed replays the recorded gaps between arrivals):
+
+    {"ts": 1760000000.123, "app": "app2", "endpoint": "/jobs/events",
+     "inputs": [{"sha256": "...", "bytes": 1234}, {...}],
+     "params": {"tagger": "spacy", "model": null},
+     "status": "ok", "seconds": 0.842, "patterns": 57}
+
+Only hashes and sizes of the uploaded texts are logged. When
+REQUEST_LOG_BLOBS names a directory, the texts themselves are also stored
+there under their sha256 so that the exact inputs can be replayed.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+class RequestLog:
+    """Appends request records to a JSONL file (thread-safe)."""
+
+    def __init__(self, path, blob_dir=None):
+        self.path = path
+        self.blob_dir = blob_dir
+        self._lock = threading.Lock()
+        if blob_dir:
+            os.makedirs(blob_dir, exist_ok=True)
+
+    def describe_input(self, data):
+        """Returns {'sha256', 'bytes'} for one uploaded text, storing the blob if enabled."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.blob_dir:
+            blob_path = os.path.join(self.blob_dir, digest)
+            if not os.path.exists(blob_path):
+                tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, blob_path)
+        return {'sha256': digest, 'bytes': len(data)}
+
+    def describe_files(self, *paths):
+        """describe_input for files on disk. Unreadable files are skipped."""
+        inputs = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    inputs.append(self.describe_input(f.read()))
+            except OSError:
+                pass
+        return inputs
+
+    def record(self, ts, **fields):
+        """Appends one record. ts is the arrival time of the request (time.time())."""
+        fields['ts'] = round(ts, 3)
+        line = json.dumps(fields, ensure_ascii=False, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+_log = None
+_log_key = None
+_log_lock = threading.Lock()
+
+
+def get_request_log():
+    """Returns the RequestLog configured by REQUEST_LOG / REQUEST_LOG_BLOBS, or None."""
+    global _log, _log_key
+    key = (os.environ.get('REQUEST_LOG'), os.environ.get('REQUEST_LOG_BLOBS'))
+    if not key[0]:
+        return None
+    with _log_lock:
+        if key != _log_key:
+            _log = RequestLog(*key)
+            _log_key = key
+        return _log
+
+
+def read_request_log(path):
+    """Yields the records of a request log, skipping blank or broken lines."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
@@ -0,0 +1,315 @@
+#result_writers.py
+"""
+Result sinks for the analysis output.
+
+A sink receives the results one record at a time, so patterns can be written
+while they are still being mined (e.g. straight from iter_common_patterns)
+and a report with millions of patterns never has to be held in memory.
+
+Formats:
+    text     - the human-readable out.txt report
+    jsonl    - one JSON object per line: {"section": ..., <record fields>}
+    msgpack  - a stream of MessagePack maps with the same fields as jsonl
+    parquet  - one columnar Parquet file per section (requires pyarrow)
+"""
+import json
+import os
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None # 組み込みの簡易エンコーダ (_pack) を使う
+
+# 出力バッファのサイズ。小さな write を大量に呼ばないようにする
+BUFFER_SIZE = 1 << 20
+
+SECTIONS = ('common_patterns', 'pos_discrepancies', 'phrase_patterns_analysis')
+
+
+class ResultSink:
+    """Base class: records are pushed section by section."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def begin_section(self, section):
+        pass
+
+    def write_record(self, section, record):
+        raise NotImplementedError
+
+    def end_section(self, section, count):
+        pass
+
+    def close(self):
+        pass
+
+
+class TextReportSink(ResultSink):
+    """
+    Writes the same report as the original write_results_to_file.
+    An already-open text stream can be passed instead of opening filepath.
+    phrase_scope ('longest' or 'all') selects the wording of the phrase
+    analysis section.
+    """
+
+    HEADERS = {
+        'common_patterns': "## Shared Token Patterns (Text and POS Match)",
+        'pos_discrepancies': "## POS Discrepancies (Same Word, Different POS)",
+        'phrase_patterns_analysis': "## Phrase Pattern Analysis of the Longest Common Pattern",
+    }
+    EMPTY_MESSAGES = {
+        'common_patterns': "No shared token patterns found.\n",
+        'pos_discrepancies': "No POS discrepancies found.\n",
+        'phrase_patterns_analysis': "No phrase patterns identified in the longest common pattern.\n",
+    }
+    # phrase_scope='all' のときの句形分析の見出し
+    ALL_SCOPE_HEADER = "## Phrase Pattern Analysis of the Common Patterns"
+    ALL_SCOPE_EMPTY_MESSAGE = "No phrase patterns identified in the common patterns.\n"
+
+    def __init__(self, filepath, stream=None, phrase_scope='longest'):
+        super().__init__(filepath)
+        if stream is None:
+            stream = open(filepath, 'w', encoding='utf-8', buffering=BUFFER_SIZE)
+        self._f = stream
+        self.headers = dict(self.HEADERS)
+        self.empty_messages = dict(self.EMPTY_MESSAGES)
+        if phrase_scope == 'all':
+            self.headers['phrase_patterns_analysis'] = self.ALL_SCOPE_HEADER
+            self.empty_messages['phrase_patterns_analysis'] = self.ALL_SCOPE_EMPTY_MESSAGE
+        self._first_section = True
+        self._index = 0
+        self._source_pattern = None
+
+    def begin_section(self, section):
+        prefix = "" if self._first_section else "\n"
+        self._first_section = False
+        self._index = 0
+        self._source_pattern = None
+        self._f.write(f"{prefix}---\n{self.headers[section]}\n---\n")
+
+    def write_record(self, section, record):
+        self._index += 1
+        if section == 'common_patterns':
+            r = record
+            line = f"{self._index}. \"{r['pattern']}\" (Length: {r['length']} tokens, POS: {r['pos_pattern']})\n"
+        elif section == 'pos_discrepancies':
+            d = record
+            line = (f"  Word: \"{d['word']}\"\n"
+                    f"    Text1 POS: {d['pos_text1']}\n"
+                    f"    Text2 POS: {d['pos_text2']}\n"
+                    "\n")
+            if self._index == 1:
+                line = "Words with POS Discrepancies:\n" + line
+        else:
+            pp = record
+            line = (f"  Pattern: \"{pp['pattern']}\"\n"
+                    f"  Type: {pp['type']}\n"
+                    f"  Description: {pp['description']}\n"
+                    "\n")
+            # phrase_scope='all' の場合は共通パターンごとに見出しをつける
+            source = pp.get('source_pattern')
+            if source is not None and source != self._source_pattern:
+                self._source_pattern = source
+                line = f"Common Pattern: \"{source}\"\n" + line
+        self._f.write(line)
+
+    def end_section(self, section, count):
+        if count == 0:
+            self._f.write(self.empty_messages[section])
+
+    def close(self):
+        self._f.close()
+
+
+class JsonlSink(ResultSink):
+    """One JSON object per record, tagged with its section."""
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self._f = open(filepath, 'w', encoding='utf-8', buffering=BUFFER_SIZE)
+
+    def write_record(self, section, record):
+        self._f.write(json.dumps({'section': section, **record}, ensure_ascii=False))
+        self._f.write("\n")
+
+    def close(self):
+        self._f.close()
+
+
+def _pack(obj, out):
+    """Minimal MessagePack encoder for the types that appear in results."""
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True:
+        out.append(b'\xc3')
+    elif obj is False:
+        out.append(b'\xc2')
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(struct.pack('B', obj))
+        elif -32 <= obj < 0:
+            out.append(struct.pack('b', obj))
+        elif 0 <= obj <= 0xffffffff:
+            out.append(struct.pack('>BI', 0xce, obj))
+        else:
+            out.append(struct.pack('>Bq', 0xd3, obj))
+    elif isinstance(obj, float):
+        out.append(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        n = len(data)
+        if n < 32:
+            out.append(struct.pack('B', 0xa0 | n))
+        elif n <= 0xff:
+            out.append(struct.pack('>BB', 0xd9, n))
+        elif n <= 0xffff:
+            out.append(struct.pack('>BH', 0xda, n))
+        else:
+            out.append(struct.pack('>BI', 0xdb, n))
+        out.append(data)
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('B', 0x90 | n))
+        elif n <= 0xffff:
+            out.append(struct.pack('>BH', 0xdc, n))
+        else:
+            out.append(struct.pack('>BI', 0xdd, n))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('B', 0x80 | n))
+        elif n <= 0xffff:
+            out.append(struct.pack('>BH', 0xde, n))
+        else:
+            out.append(struct.pack('>BI', 0xdf, n))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Cannot serialize {type(obj).__name__} to MessagePack")
+
+
+class MsgpackSink(ResultSink):
+    """A stream of MessagePack maps (readable with msgpack.Unpacker)."""
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self._f = open(filepath, 'wb', buffering=BUFFER_SIZE)
+
+    def write_record(self, section, record):
+        obj = {'section': section, **record}
+        if msgpack is not None:
+            self._f.write(msgpack.packb(obj, use_bin_type=True))
+        else:
+            out = []
+            _pack(obj, out)
+            self._f.write(b"".join(out))
+
+    def close(self):
+        self._f.close()
+
+
+class ParquetSink(ResultSink):
+    """
+    Writes each section to its own Parquet file next to filepath
+    (out.parquet -> out.common_patterns.parquet, ...), one row group per
+    ROW_GROUP_SIZE records so memory stays bounded.
+    """
+
+    ROW_GROUP_SIZE = 65536
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow. Please run:\n"
+                              "pip install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._writer = None
+        self._rows = []
+
+    def _section_path(self, section):
+        root, ext = os.path.splitext(self.filepath)
+        return f"{root}.{section}{ext or '.parquet'}"
+
+    def begin_section(self, section):
+        self._writer = None
+        self._rows = []
+
+    def write_record(self, section, record):
+        self._rows.append(record)
+        if len(self._rows) >= self.ROW_GROUP_SIZE:
+            self._flush(section)
+
+    def _flush(self, section):
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._section_path(section), table.schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def end_section(self, section, count):
+        self._flush(section)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+SINKS = {
+    'text': TextReportSink,
+    'jsonl': JsonlSink,
+    'msgpack': MsgpackSink,
+    'parquet': ParquetSink,
+}
+
+
+def format_available(fmt):
+    """True if the output format can be written here (parquet needs pyarrow installed)."""
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet # noqa: F401
+        except ImportError:
+            return False
+    return fmt in SINKS
+
+
+def open_sink(filepath, fmt='text', phrase_scope='longest'):
+    """Returns a sink for the given format name (phrase_scope only affects the text report)."""
+    try:
+        sink_class = SINKS[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown output format '{fmt}'. Choose from: {', '.join(SINKS)}")
+    if sink_class is TextReportSink:
+        return sink_class(filepath, phrase_scope=phrase_scope)
+    return sink_class(filepath)
+
+
+def stream_results(sink, common_patterns, pos_discrepancies, phrase_patterns_analysis):
+    """
+    Feeds the three result sections into a sink. Each argument may be any
+    iterable, including a generator, and is consumed exactly once.
+    """
+    sections = zip(SECTIONS, (common_patterns, pos_discrepancies, phrase_patterns_analysis))
+    for section, records in sections:
+        sink.begin_section(section)
+        count = 0
+        for record in records:
+            sink.write_record(section, record)
+            count += 1
+        sink.end_section(section, count)
@@ -0,0 +1,161 @@
+#shared_tokens.py
+"""
+Hands tagged token columns to worker processes through shared memory.
+
+normalize_and_pos_tag output is interned into two int32 columns (text ids and
+POS ids) plus the text vocabulary, all stored in one
+multiprocessing.shared_memory block:
+
+    [text ids: int32 * n][POS ids: int32 * n][vocabulary: UTF-8, '\n'-joined]
+
+Only a small SharedTokensHandle (block name and sizes) is pickled per job.
+Workers attach to the block and read the columns as zero-copy NumPy views.
+The owning process reference-counts the handles given to jobs and unlinks
+the block once it has been closed and the last job has released it.
+"""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import text_analyzer
+
+# Pickled to workers instead of the token list itself
+SharedTokensHandle = namedtuple('SharedTokensHandle', ['name', 'length', 'vocab_bytes', 'tags'])
+
+ID_DTYPE = np.int32
+
+
+class SharedTokenColumns:
+    """Owner side of a shared token block."""
+
+    def __init__(self, shm, handle):
+        self._shm = shm
+        self.handle = handle
+        self._refs = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Interns a normalize_and_pos_tag result into a new shared block."""
+        text_vocab, pos_vocab = {}, {}
+        text_ids, pos_ids = text_analyzer._intern_tokens(tokens, text_vocab, pos_vocab)
+        # 単語は英数字のみなので改行区切りで安全に連結できる
+        vocab = "\n".join(text_vocab).encode('utf-8')
+
+        n = len(tokens)
+        column_bytes = n * np.dtype(ID_DTYPE).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(2 * column_bytes + len(vocab), 1))
+        columns = np.ndarray((2, n), dtype=ID_DTYPE, buffer=shm.buf)
+        columns[0] = np.frombuffer(text_ids, dtype=ID_DTYPE)
+        columns[1] = np.frombuffer(pos_ids, dtype=ID_DTYPE)
+        shm.buf[2 * column_bytes:2 * column_bytes + len(vocab)] = vocab
+        del columns # shm.buf を参照するビューは close() 前に手放す
+
+        return cls(shm, SharedTokensHandle(shm.name, n, len(vocab), list(pos_vocab)))
+
+    @classmethod
+    def from_text(cls, text):
+        """Tags a text and puts the result straight into a shared block."""
+        return cls.from_tokens(text_analyzer.normalize_and_pos_tag(text))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def acquire(self):
+        """Returns the handle for one job; pair every call with release()."""
+        with self._lock:
+            if self._closed and self._refs == 0:
+                raise ValueError("shared token block has already been released")
+            self._refs += 1
+            return self.handle
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            self._maybe_unlink()
+
+    def close(self):
+        """
+        Gives up the owner's reference. The block is unlinked now, or when the
+        last running job releases it.
+        """
+        with self._lock:
+            self._closed = True
+            self._maybe_unlink()
+
+    def _maybe_unlink(self):
+        if self._closed and self._refs == 0 and self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def _attach_block(name):
+    try:
+        # Python 3.13+: 所有者でないプロセスはリソーストラッカーに登録しない
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # それ以前: プールのワーカーは親と同じリソーストラッカーを共有するので、
+        # 二重登録になるだけで unlink は所有者 (SharedTokenColumns) が行う
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def attach(handle):
+    """
+    Worker side: yields (text_ids, pos_ids, words, tags) where the id columns
+    are read-only NumPy views on the shared block. The views must not be used
+    after the with-block ends.
+    """
+    shm = _attach_block(handle.name)
+    try:
+        n = handle.length
+        columns = np.ndarray((2, n), dtype=ID_DTYPE, buffer=shm.buf)
+        columns.flags.writeable = False
+        column_bytes = n * columns.itemsize
+        vocab = bytes(shm.buf[2 * column_bytes:2 * column_bytes + handle.vocab_bytes]).decode('utf-8')
+        words = vocab.split("\n") if vocab else []
+        yield columns[0], columns[1], words, handle.tags
+        del columns
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # 呼び出し側 (例外のトレースバック等) にビューが残っている。マッピングは GC 時に解放される
+            pass
+
+
+def _merge_vocab(words1, words2):
+    """Returns the combined vocabulary and an id map from vocabulary 2 into it."""
+    index = {w: i for i, w in enumerate(words1)}
+    mapping = np.fromiter((index.setdefault(w, len(index)) for w in words2),
+                          dtype=ID_DTYPE, count=len(words2))
+    return list(index), mapping
+
+
+def find_common_patterns_shared(handle1, handle2, min_length=1, max_length=None, top_k=None):
+    """
+    Worker entry point: find_common_patterns_improved on two shared blocks.
+    Text 1 is mined in place; text 2's ids are remapped into text 1's
+    vocabulary (one int32 copy, still far cheaper than unpickling tokens).
+    """
+    with attach(handle1) as (text_ids1, pos_ids1, words1, tags1), \
+         attach(handle2) as (text_ids2, pos_ids2, words2, tags2):
+        words, word_map = _merge_vocab(words1, words2)
+        tags, tag_map = _merge_vocab(tags1, tags2)
+        patterns = text_analyzer.iter_common_patterns_ids(
+            text_ids1, pos_ids1, word_map[text_ids2], tag_map[pos_ids2], words, tags,
+            min_length=min_length, max_length=max_length)
+        if top_k is not None:
+            patterns = islice(patterns, top_k)
+        results = list(patterns)
+        del text_ids1, pos_ids1, text_ids2, pos_ids2, patterns
+        return results
@@ -0,0 +1,485 @@
+#taggers.py
+"""
+POS tagger backends shared by text_analyzer.py, app.py and app2.py.
+
+Every backend turns text into the token dicts used by the analyzer
+({'text': ..., 'pos': <UPOS tag>}, alphabetic / numeric tokens only) and
+uses the same spaCy English tokenizer, so the token sequences of the
+backends line up one to one.
+
+    spacy       - the en_core_web_sm pipeline (accurate, slow)
+    perceptron  - a pure-Python averaged perceptron (fast). It is trained
+                  from spaCy's own tags:
+                      python taggers.py train corpus.txt ... -o models/perceptron_tagger.json
+                  No weights are shipped: until a model has been trained,
+                  get_tagger() refuses 'perceptron' (the UI disables the
+                  option). A model tags with the casing it was trained on
+                  (lowercased unless trained with --preserve-case).
+    lexicon     - closed-class words plus suffix rules, no model (fastest,
+                  always available). Low accuracy: most lowercased content
+                  words come out as NOUN.
+
+bench_taggers.py reports the speed of the backends and how often they agree with spaCy.
+"""
+import json
+import os
+import sys
+from collections import defaultdict
+
+import spacy
+
+from model_pool import AUTO, ModelNotInstalled, get_model_pool
+
+# 学習済みパーセプトロンの既定の保存先
+DEFAULT_PERCEPTRON_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        'models', 'perceptron_tagger.json')
+
+
+def load_spacy_model(name="en_core_web_sm"):
+    """Loads a spaCy pipeline, raising ModelNotInstalled if it is missing."""
+    try:
+        return spacy.load(name)
+    except OSError as e:
+        raise ModelNotInstalled(name) from e
+
+
+def tokens_from_doc(doc, preserve_case=False):
+    """Converts a tagged spaCy Doc to the analyzer's token dicts."""
+    tokens_with_pos = []
+    for token in doc:
+        # Include only alphabetic or numeric tokens
+        if token.is_alpha or token.is_digit:
+            tokens_with_pos.append({
+                'text': token.lower_ if preserve_case else token.text,
+                'pos': token.pos_ # Part-of-Speech tag
+            })
+    return tokens_with_pos
+
+
+class TaggerBackend:
+    """
+    Interface of a tagger backend.
+    make_doc() only tokenizes; pipe() tags a stream of texts and yields one
+    token list per text. preserve_case=False lowercases the input before
+    tagging, like the original normalize_and_pos_tag.
+    """
+
+    name = None
+
+    def make_doc(self, text):
+        raise NotImplementedError
+
+    def pipe(self, texts, preserve_case=False):
+        raise NotImplementedError
+
+    def tag(self, text, preserve_case=False):
+        return next(iter(self.pipe([text], preserve_case=preserve_case)))
+
+
+class SpacyTagger(TaggerBackend):
+    """
+    The statistical spaCy pipeline, taken from the shared model pool.
+    model=None uses the default model, model='auto' picks a model per text
+    from its detected language (see model_pool.py).
+    """
+
+    name = 'spacy'
+
+    def __init__(self, model=None):
+        self.model = model
+
+    def nlp_for(self, text=None):
+        """
+        The pipeline to use for a text (loaded on first use). Raises
+        ModelNotInstalled instead of exiting, since it runs inside web
+        requests (the CLIs exit in __main__).
+        """
+        return get_model_pool().get(self.model, text)
+
+    @property
+    def nlp(self):
+        return self.nlp_for()
+
+    def make_doc(self, text):
+        return self.nlp_for(text).make_doc(text)
+
+    def pipe(self, texts, preserve_case=False):
+        if self.model == AUTO:
+            # 言語がテキストごとに違うかもしれないので 1 件ずつ処理する
+            for text in texts:
+                nlp = self.nlp_for(text)
+                yield tokens_from_doc(nlp(text if preserve_case else text.lower()), preserve_case)
+            return
+        if not preserve_case:
+            texts = (text.lower() for text in texts) # Process text in lowercase
+        for doc in self.nlp.pipe(texts):
+            yield tokens_from_doc(doc, preserve_case)
+
+
+# --- 平均化パーセプトロン (averaged perceptron) ---
+
+# 未学習時に使う閉じた語類の辞書 (UPOS)
+_FALLBACK_LEXICON = {}
+for _pos, _words in {
+    'DET': "a an the this that these those every each some any no another all both either neither",
+    'PRON': "i you he she it we they me him her us them my your his its our their mine yours "
+            "hers ours theirs myself yourself himself herself itself ourselves themselves "
+            "who whom whose what which someone anyone everyone nobody something anything everything nothing",
+    'ADP': "of in on at by for with about against between into through during before after above below "
+           "to from up down over under again near off onto upon within without across along among around",
+    'CCONJ': "and or but nor yet",
+    'SCONJ': "if because although though while whereas unless since until whether",
+    'AUX': "is am are was were be been being have has had do does did will would shall should "
+           "can could may might must",
+    'PART': "not n't 's",
+    'ADV': "very too also just only quite rather really so then there here now never always often "
+           "sometimes how when where why",
+    'INTJ': "oh yes hello hi wow",
+}.items():
+    for _word in _words.split():
+        _FALLBACK_LEXICON[_word] = _pos
+
+# 未知語の品詞を語尾から推測する規則 (上から順に評価)
+_SUFFIX_RULES = [
+    ('ly', 'ADV'),
+    ('ing', 'VERB'), ('ed', 'VERB'), ('ize', 'VERB'), ('ise', 'VERB'),
+    ('ous', 'ADJ'), ('ful', 'ADJ'), ('able', 'ADJ'), ('ible', 'ADJ'), ('ive', 'ADJ'),
+    ('less', 'ADJ'), ('ic', 'ADJ'), ('al', 'ADJ'),
+]
+
+
+def _normalize_word(word):
+    if word.isdigit():
+        return '!DIGITS'
+    return word.lower()
+
+
+def _word_shape(word):
+    if word.isdigit():
+        return 'd'
+    if word.isupper():
+        return 'XX'
+    if word[:1].isupper():
+        return 'Xx'
+    if word.isalpha():
+        return 'x'
+    return 'p'
+
+
+def lexicon_tag(word):
+    """UPOS tag from the closed-class lexicon and the suffix rules (no model)."""
+    lowered = word.lower()
+    if lowered in _FALLBACK_LEXICON:
+        return _FALLBACK_LEXICON[lowered]
+    if word.isdigit():
+        return 'NUM'
+    if not any(c.isalnum() for c in word):
+        return 'PUNCT'
+    if word[:1].isupper():
+        return 'PROPN'
+    for suffix, tag in _SUFFIX_RULES:
+        if lowered.endswith(suffix) and len(lowered) > len(suffix) + 2:
+            return tag
+    return 'NOUN'
+
+
+class LexiconTagger(TaggerBackend):
+    """
+    Rule-based POS tagger: closed-class words from a lexicon, other words
+    by suffix (and PROPN for capitalised words when the case is kept).
+    Needs no model, so it is always available; expect low accuracy.
+    Uses spaCy's rule-based English tokenizer only.
+    """
+
+    name = 'lexicon'
+
+    def __init__(self):
+        self._tokenizer_nlp = spacy.blank('en')
+
+    def make_doc(self, text):
+        return self._tokenizer_nlp.make_doc(text)
+
+    def _lowercase_input(self, preserve_case):
+        return not preserve_case
+
+    def predict(self, words):
+        """Returns one UPOS tag per word."""
+        return [lexicon_tag(word) for word in words]
+
+    def pipe(self, texts, preserve_case=False):
+        for text in texts:
+            if self._lowercase_input(preserve_case):
+                text = text.lower() # Process text in lowercase
+            doc = self.make_doc(text)
+            words = [token.text for token in doc]
+            tags = self.predict(words)
+            tokens_with_pos = []
+            for token, tag in zip(doc, tags):
+                # Include only alphabetic or numeric tokens
+                if token.is_alpha or token.is_digit:
+                    tokens_with_pos.append({
+                        'text': token.lower_ if preserve_case else token.text,
+                        'pos': tag
+                    })
+            yield tokens_with_pos
+
+
+class PerceptronTagger(LexiconTagger):
+    """
+    Greedy averaged-perceptron POS tagger emitting spaCy's UPOS tags.
+    Uses spaCy's rule-based English tokenizer only (no statistical model).
+    Without a trained model it falls back to the lexicon rules.
+    """
+
+    name = 'perceptron'
+    START = ['-START-', '-START2-']
+    END = ['-END-', '-END2-']
+
+    def __init__(self, model_path=DEFAULT_PERCEPTRON_MODEL):
+        super().__init__()
+        self.model_path = model_path
+        self.weights = {} # {feature: {tag: weight}}
+        self.tagdict = {} # 曖昧さのない頻出語 {word: tag}
+        self.classes = set()
+        self.lowercase = True # 学習時の大文字小文字 (学習と同じ形で予測する)
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+
+    @property
+    def trained(self):
+        return bool(self.weights)
+
+    def _lowercase_input(self, preserve_case):
+        # 学習済みモデルは学習時と同じ大文字小文字で予測する (出力は常に小文字)
+        if self.trained:
+            return self.lowercase
+        return not preserve_case
+
+    def _features(self, i, word, context, prev, prev2):
+        """Features for the word at context[i + 2] (context is padded with START/END)."""
+        features = defaultdict(int)
+
+        def add(name, *args):
+            features[' '.join((name,) + tuple(args))] += 1
+
+        i += len(self.START)
+        add('bias')
+        add('i suffix', word[-3:])
+        add('i pref1', word[:1])
+        add('i shape', _word_shape(word))
+        add('i-1 tag', prev)
+        add('i-2 tag', prev2)
+        add('i tag+i-2 tag', prev, prev2)
+        add('i word', context[i])
+        add('i-1 tag+i word', prev, context[i])
+        add('i-1 word', context[i - 1])
+        add('i-1 suffix', context[i - 1][-3:])
+        add('i-2 word', context[i - 2])
+        add('i+1 word', context[i + 1])
+        add('i+1 suffix', context[i + 1][-3:])
+        add('i+2 word', context[i + 2])
+        return features
+
+    def _score(self, features):
+        scores = defaultdict(float)
+        for feature, value in features.items():
+            weights = self.weights.get(feature)
+            if weights is None:
+                continue
+            for tag, weight in weights.items():
+                scores[tag] += value * weight
+        return scores
+
+    def predict(self, words):
+        """Returns one UPOS tag per word."""
+        context = self.START + [_normalize_word(w) for w in words] + self.END
+        prev, prev2 = self.START
+        tags = []
+        for i, word in enumerate(words):
+            tag = self.tagdict.get(_normalize_word(word))
+            if tag is None:
+                if self.trained:
+                    scores = self._score(self._features(i, word, context, prev, prev2))
+                    tag = max(self.classes, key=lambda c: (scores[c], c))
+                else:
+                    tag = lexicon_tag(word)
+            tags.append(tag)
+            prev2, prev = prev, tag
+        return tags
+
+    def train(self, sentences, n_iter=5, seed=0, lowercase=True):
+        """
+        Trains on a list of (words, tags) pairs, e.g. sentences tagged by
+        SpacyTagger. Weights are averaged over all updates. lowercase says
+        whether the words are lowercased (see spacy_training_sentences);
+        the tagger then lowercases its input the same way.
+        """
+        import random
+
+        self.lowercase = lowercase
+        self._make_tagdict(sentences)
+        self.classes = {tag for _, tags in sentences for tag in tags}
+        self.weights = {}
+        totals = defaultdict(float)   # {(feature, tag): 累積重み}
+        stamps = defaultdict(int)     # {(feature, tag): 最後に更新した時刻}
+        instances = 0
+
+        def update(truth, guess, features):
+            for feature in features:
+                weights = self.weights.setdefault(feature, {})
+                for tag, delta in ((truth, 1.0), (guess, -1.0)):
+                    weight = weights.get(tag, 0.0)
+                    totals[(feature, tag)] += (instances - stamps[(feature, tag)]) * weight
+                    stamps[(feature, tag)] = instances
+                    weights[tag] = weight + delta
+
+        rng = random.Random(seed)
+        sentences = list(sentences)
+        for _ in range(n_iter):
+            for words, tags in sentences:
+                context = self.START + [_normalize_word(w) for w in words] + self.END
+                prev, prev2 = self.START
+                for i, word in enumerate(words):
+                    guess = self.tagdict.get(_normalize_word(word))
+                    if guess is None:
+                        features = self._features(i, word, context, prev, prev2)
+                        scores = self._score(features)
+                        guess = max(self.classes, key=lambda c: (scores[c], c))
+                        if guess != tags[i]:
+                            update(tags[i], guess, features)
+                        instances += 1
+                    prev2, prev = prev, tags[i]
+            rng.shuffle(sentences)
+
+        # 平均化
+        for feature, weights in self.weights.items():
+            averaged = {}
+            for tag, weight in weights.items():
+                total = totals[(feature, tag)] + (instances - stamps[(feature, tag)]) * weight
+                value = round(total / max(instances, 1), 3)
+                if value:
+                    averaged[tag] = value
+            self.weights[feature] = averaged
+
+    def _make_tagdict(self, sentences, freq_threshold=20, ambiguity_threshold=0.97):
+        """Frequent words that almost always get the same tag skip the model."""
+        counts = defaultdict(lambda: defaultdict(int))
+        for words, tags in sentences:
+            for word, tag in zip(words, tags):
+                counts[_normalize_word(word)][tag] += 1
+        self.tagdict = {}
+        for word, tag_freqs in counts.items():
+            tag, mode = max(tag_freqs.items(), key=lambda item: item[1])
+            n = sum(tag_freqs.values())
+            if n >= freq_threshold and mode / n >= ambiguity_threshold:
+                self.tagdict[word] = tag
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'weights': self.weights, 'tagdict': self.tagdict,
+                       'classes': sorted(self.classes), 'lowercase': self.lowercase}, f)
+
+    def load(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.weights = data['weights']
+        self.tagdict = data['tagdict']
+        self.classes = set(data['classes'])
+        # 以前のモデルは元の大文字小文字で学習されている
+        self.lowercase = data.get('lowercase', False)
+
+
+TAGGERS = {
+    'spacy': SpacyTagger,
+    'perceptron': PerceptronTagger,
+    'lexicon': LexiconTagger,
+}
+# 画面などで「精度優先 / 速度優先」として選べる別名
+TAGGER_ALIASES = {
+    'accurate': 'spacy',
+    'fast': 'perceptron',
+}
+
+_instances = {}
+
+
+def perceptron_trained(model_path=DEFAULT_PERCEPTRON_MODEL):
+    """True if a trained perceptron model exists at model_path."""
+    return bool(model_path) and os.path.exists(model_path)
+
+
+def tagger_available(name):
+    """True if name (or an alias) is a tagger that can be selected: untrained backends are not."""
+    name = TAGGER_ALIASES.get(name, name)
+    if name not in TAGGERS:
+        return False
+    return name != 'perceptron' or perceptron_trained()
+
+
+def get_tagger(name='spacy', model=None):
+    """
+    Returns the shared backend instance for a tagger name or alias.
+    model selects the spaCy model (a name, 'auto' or None for the default);
+    the perceptron backend ignores it.
+    """
+    name = TAGGER_ALIASES.get(name, name)
+    if name not in TAGGERS:
+        raise ValueError(f"Unknown tagger '{name}'. Choose from: {', '.join(list(TAGGERS) + list(TAGGER_ALIASES))}")
+    if name == 'perceptron' and not perceptron_trained():
+        raise ValueError(f"The perceptron tagger has no trained model ({DEFAULT_PERCEPTRON_MODEL}). "
+                         "Train one with: python taggers.py train corpus.txt ...")
+    if name == 'spacy':
+        if model is not None and model != AUTO:
+            get_model_pool().resolve(model) # 許可されていないモデル名はここで ValueError
+        key = (name, model)
+    else:
+        key = (name, None)
+    if key not in _instances:
+        _instances[key] = SpacyTagger(model) if name == 'spacy' else TAGGERS[name]()
+    return _instances[key]
+
+
+def spacy_training_sentences(texts, tagger=None, preserve_case=False):
+    """
+    Tags texts with spaCy and returns (words, UPOS tags) per sentence.
+    Like SpacyTagger.pipe, the texts are lowercased first unless
+    preserve_case, so the perceptron learns from the input it will see.
+    """
+    tagger = tagger or get_tagger('spacy')
+    if not preserve_case:
+        texts = [text.lower() for text in texts]
+    sentences = []
+    for doc in tagger.nlp.pipe(texts):
+        for sentence in doc.sents:
+            sentences.append(([t.text for t in sentence], [t.pos_ for t in sentence]))
+    return sentences
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the perceptron tagger from spaCy's tags.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train')
+    train_parser.add_argument('corpus', nargs='+', help="plain-text files to tag with spaCy")
+    train_parser.add_argument('-o', '--output', default=DEFAULT_PERCEPTRON_MODEL)
+    train_parser.add_argument('--iterations', type=int, default=5)
+    train_parser.add_argument('--preserve-case', action='store_true',
+                              help="train on the original casing (default: lowercased, like the analyzer)")
+    args = parser.parse_args()
+
+    texts = []
+    for path in args.corpus:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    print("Tagging the corpus with spaCy...")
+    try:
+        sentences = spacy_training_sentences(texts, preserve_case=args.preserve_case)
+    except ModelNotInstalled as e:
+        sys.exit(str(e))
+    print(f"Training on {len(sentences)} sentences...")
+    perceptron = PerceptronTagger(model_path=None)
+    perceptron.train(sentences, n_iter=args.iterations, lowercase=not args.preserve_case)
+    perceptron.save(args.output)
+    print(f"Saved model to {args.output}")
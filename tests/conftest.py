@@ -0,0 +1,5 @@
+import os
+import sys
+
+# モジュールはリポジトリ直下に置かれているので、テストからそのまま import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
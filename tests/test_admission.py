@@ -0,0 +1,65 @@
+import random
+import tracemalloc
+
+import numpy as np
+
+from admission import CAPPED_TOP_K, estimate_cost, estimate_substring_mb, estimate_window_ids_mb, plan_analysis
+from text_analyzer import _WindowIds, find_common_patterns_improved, find_common_patterns_planned
+
+
+def _text(rng, n, vocab=1000):
+    return [{'text': f"w{rng.randrange(vocab)}", 'pos': f"P{rng.randrange(3)}"} for _ in range(n)]
+
+
+def test_exact_and_disk_plans_give_the_same_patterns(tmp_path):
+    rng = random.Random(0)
+    tokens1, tokens2 = _text(rng, 20000), _text(rng, 20000)
+    exact = plan_analysis(tokens1, tokens2, spill_dir=str(tmp_path))
+    assert exact['strategy'] == 'exact'
+    # 索引 (約 10 MB) は予算に収まらないが、SQLite のページキャッシュなら収まる
+    disk = plan_analysis(tokens1, tokens2, memory_mb=6, spill_dir=str(tmp_path))
+    assert (disk['strategy'], disk['index']) == ('disk', 'sqlite')
+    assert disk['estimated_mb'] <= 6
+    patterns = find_common_patterns_planned(tokens1, tokens2, exact)
+    assert patterns
+    assert find_common_patterns_planned(tokens1, tokens2, disk) == patterns
+    assert list(tmp_path.iterdir()) == [] # ディスク索引は削除される
+
+
+def test_capped_plan_respects_max_length_and_top_k():
+    rng = random.Random(0)
+    shared = _text(rng, 300)
+    tokens1 = _text(rng, 3000) + shared + _text(rng, 3000)
+    tokens2 = _text(rng, 2000) + shared + _text(rng, 2000)
+    assert plan_analysis(tokens1, tokens2)['longest'] == 300
+
+    for top_k, expected_top_k in ((None, CAPPED_TOP_K), (5, 5)):
+        plan = plan_analysis(tokens1, tokens2, top_k=top_k, seconds=1)
+        assert plan['strategy'] == 'capped'
+        assert plan['top_k'] == expected_top_k
+        assert 1 <= plan['max_length'] < 300
+        assert plan['estimated_seconds'] <= 1
+        patterns = find_common_patterns_planned(tokens1, tokens2, plan)
+        assert len(patterns) <= expected_top_k
+        assert max(p['length'] for p in patterns) == plan['max_length']
+        assert patterns == find_common_patterns_improved(tokens1, tokens2, max_length=plan['max_length'],
+                                                         top_k=plan['top_k'])
+
+
+def test_estimate_covers_the_sub_pattern_filter():
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, 5000, 200000)
+    for longest in (1, 8, 64):
+        tracemalloc.start()
+        window_ids = _WindowIds(ids, longest)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del window_ids
+        assert peak / (1024 * 1024) <= estimate_window_ids_mb(len(ids), longest)
+
+    tokens = [{'text': "abcd", 'pos': 'X'}, {'text': "x" * 100, 'pos': 'X'}]
+    substring_mb = estimate_substring_mb(tokens, tokens)
+    assert substring_mb > 0 # 長い単語 (LONG_WORD 超) は数えない
+    assert substring_mb == estimate_substring_mb(tokens[:1], tokens[:1])
+    assert estimate_cost(1000, 1000, 5, substring_mb=substring_mb)[0] == \
+        estimate_cost(1000, 1000, 5)[0] + substring_mb
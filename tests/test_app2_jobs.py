@@ -0,0 +1,88 @@
+import io
+import os
+import re
+import time
+
+import pytest
+
+import app2
+from request_log import read_request_log
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    calls = []
+
+    def tag(text, tagger='spacy', model=None):
+        calls.append(text)
+        return [{'text': w, 'pos': 'X'} for w in text.lower().split()]
+
+    monkeypatch.setattr(app2, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app2, 'normalize_and_pos_tag', tag)
+    monkeypatch.setattr(app2, 'analyze_pattern_phrases', lambda texts, model=None, scope='longest': [])
+    client = app2.app.test_client()
+    client.tagged = calls
+    return client
+
+
+def _upload(client):
+    response = client.post('/', data={'file1': (io.BytesIO(b'the cat sat on the mat'), 'a.txt'),
+                                      'file2': (io.BytesIO(b'a cat sat on a mat'), 'b.txt')},
+                           content_type='multipart/form-data')
+    return re.search(r'/jobs/([0-9a-f]{32})/', response.data.decode()).group(1)
+
+
+def _events(body):
+    return re.findall(r'^event: (\w+)$', body, re.M)
+
+
+def test_second_request_replays_the_finished_report(client):
+    job_id = _upload(client)
+    first = client.get(f'/jobs/{job_id}/events').data.decode()
+    assert _events(first)[-1] == 'done'
+    assert len(client.tagged) == 2
+
+    second = client.get(f'/jobs/{job_id}/events').data.decode()
+    assert len(client.tagged) == 2 # 解析をやり直していない
+    assert _events(second) == ['strategy', 'report', 'done']
+    with open(os.path.join(app2.UPLOAD_FOLDER, job_id, 'out.txt'), encoding='utf-8') as f:
+        report = f.read()
+    assert "cat sat on" in report
+    assert "cat sat on" in second
+
+
+def test_no_empty_report_events(client):
+    job_id = _upload(client)
+    body = client.get(f'/jobs/{job_id}/events').data.decode()
+    assert 'event: report\ndata: ""\n' not in body
+
+
+def test_abandoned_stream_can_be_restarted(client):
+    job_id = _upload(client)
+    events = app2.stream_analysis(os.path.join(app2.UPLOAD_FOLDER, job_id))
+    while 'event: strategy' not in next(events): # タグ付けが終わったところで接続が切れる
+        pass
+    events.close()
+    assert len(client.tagged) == 2
+    body = client.get(f'/jobs/{job_id}/events').data.decode()
+    assert _events(body)[-1] == 'done'
+    assert len(client.tagged) == 4
+
+
+def test_request_log_records_the_arrival_time(client, tmp_path, monkeypatch):
+    log_path = str(tmp_path / 'requests.jsonl')
+    monkeypatch.setenv('REQUEST_LOG', log_path)
+    job_id = _upload(client)
+    tag = app2.normalize_and_pos_tag
+
+    def slow_tag(text, tagger='spacy', model=None):
+        time.sleep(0.3)
+        return tag(text, tagger, model)
+
+    monkeypatch.setattr(app2, 'normalize_and_pos_tag', slow_tag)
+    arrived = time.time()
+    client.get(f'/jobs/{job_id}/events?phrase_scope=all').data # ストリームを最後まで読む
+    [record] = read_request_log(log_path)
+    assert arrived <= record['ts'] < arrived + 0.3 # 終了時刻 (0.6 秒後) ではない
+    assert record['seconds'] >= 0.6
+    assert record['params']['phrase_scope'] == 'all'
@@ -0,0 +1,27 @@
+import os
+import time
+
+import app
+
+
+def _touch(folder, index, age):
+    path = os.path.join(folder, f"{index:032x}.collapsed")
+    with open(path, 'w') as f:
+        f.write("main 1\n")
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_remove_expired_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'PROFILE_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app, 'PROFILE_MAX_FILES', 3)
+    expired = _touch(tmp_path, 0, app.PROFILE_TTL_SECONDS + 60)
+    kept = [_touch(tmp_path, i, 100 - i) for i in range(1, 5)] # 古い順
+    other = tmp_path / 'notes.txt'
+    other.write_text("not a profile")
+
+    app.remove_expired_profiles()
+    # 期限切れは削除し、これから保存する1件分を空けて最大数に収める
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(p) for p in kept[2:]] + ['notes.txt'])
+    assert not os.path.exists(expired)
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from async_analyzer import AsyncTextAnalyzer, WorkerDied
+
+
+# ワーカーで実行するのでモジュールの最上位に置く (pickle できる関数)
+def sleep_and_report(seconds, tag=None):
+    time.sleep(seconds)
+    return os.getpid(), time.time()
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def fail():
+    raise ValueError("boom")
+
+
+def exit_worker():
+    os._exit(1)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # kill 後に回収されていないゾンビが残ることがあるので状態も見る
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split()[2] != 'Z'
+    except OSError:
+        return True
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_identical_calls_share_one_computation():
+    async def main():
+        async with AsyncTextAnalyzer(max_workers=2) as analyzer:
+            first, second = await asyncio.gather(analyzer._submit(sleep_and_report, 0.3),
+                                                 analyzer._submit(sleep_and_report, 0.3))
+            other = await analyzer._submit(sleep_and_report, 0.3, 'other')
+            return first, second, other
+
+    first, second, other = _run(main())
+    assert first == second # 同じプロセス・同じ時刻: 1 回しか実行されていない
+    assert other != first
+
+
+def test_timeout_kills_the_worker_and_a_new_one_is_started():
+    async def main():
+        async with AsyncTextAnalyzer(max_workers=1) as analyzer:
+            pid = await analyzer._submit(worker_pid)
+            with pytest.raises(asyncio.TimeoutError):
+                await analyzer._submit(sleep_and_report, 30, timeout=0.3)
+            await asyncio.sleep(0.2)
+            killed = not _alive(pid)
+            return pid, killed, await analyzer._submit(worker_pid)
+
+    pid, killed, new_pid = _run(main())
+    assert killed
+    assert new_pid != pid
+
+
+def test_cancelling_the_last_waiter_kills_the_worker():
+    async def main():
+        async with AsyncTextAnalyzer(max_workers=1) as analyzer:
+            pid = await analyzer._submit(worker_pid)
+            task = asyncio.ensure_future(analyzer._submit(sleep_and_report, 30))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.2)
+            return pid, not _alive(pid), analyzer._inflight
+
+    pid, killed, inflight = _run(main())
+    assert killed
+    assert inflight == {}
+
+
+def test_cancelling_one_of_two_waiters_keeps_the_job():
+    async def main():
+        async with AsyncTextAnalyzer(max_workers=1) as analyzer:
+            first = asyncio.ensure_future(analyzer._submit(sleep_and_report, 0.5))
+            second = asyncio.ensure_future(analyzer._submit(sleep_and_report, 0.5))
+            await asyncio.sleep(0.2)
+            first.cancel()
+            return await second
+
+    pid, _ = _run(main())
+    assert pid != os.getpid()
+
+
+def test_errors_keep_the_worker_and_a_dead_worker_is_replaced():
+    async def main():
+        async with AsyncTextAnalyzer(max_workers=1) as analyzer:
+            pid = await analyzer._submit(worker_pid)
+            with pytest.raises(ValueError):
+                await analyzer._submit(fail)
+            same_pid = await analyzer._submit(worker_pid)
+            with pytest.raises(WorkerDied):
+                await analyzer._submit(exit_worker)
+            return pid, same_pid, await analyzer._submit(worker_pid)
+
+    pid, same_pid, new_pid = _run(main())
+    assert same_pid == pid
+    assert new_pid != pid
@@ -0,0 +1,66 @@
+import random
+
+from text_analyzer import SqliteNgramIndex, find_common_patterns_improved, iter_common_patterns
+
+# 部分文字列が単語の境界をまたいで一致する語彙 ("he" in "the cat" など)
+VOCABS = [["a", "at", "cat", "t", "ta", "tat", "c", "ca"], ["he", "the", "then", "e", "hen", "n", "en"],
+          ["w1", "w2", "w12", "1", "2", "w"], ["x", "y"], ["ab", "b", "a", "ba", "bab"]]
+
+
+def legacy_common_patterns(tokens1, tokens2, min_length=1, max_length=None, top_k=None):
+    """The original all-substrings implementation, with max_length / top_k applied afterwards."""
+    def collect_patterns(tokens_list):
+        sub_patterns = {}
+        for i in range(len(tokens_list)):
+            for j in range(i + min_length, len(tokens_list) + 1):
+                if max_length is not None and j - i > max_length:
+                    break
+                sub_tokens = tokens_list[i:j]
+                sub_patterns[" ".join(t['text'] for t in sub_tokens)] = "-".join(t['pos'] for t in sub_tokens)
+        return sub_patterns
+
+    sub_patterns1 = collect_patterns(tokens1)
+    sub_patterns2 = collect_patterns(tokens2)
+    common = [{'pattern': text, 'pos_pattern': pos, 'length': len(text.split())}
+              for text, pos in sub_patterns1.items() if sub_patterns2.get(text) == pos]
+    common.sort(key=lambda x: x['length'], reverse=True)
+    results = []
+    for current in common:
+        if not any(current['pattern'] in existing['pattern'] and current['length'] < existing['length']
+                   for existing in results):
+            results.append(current)
+    return results[:top_k]
+
+
+def _random_pair(rng):
+    vocab, tags = rng.choice(VOCABS), rng.choice([1, 1, 2, 3])
+    tokens1 = [{'text': rng.choice(vocab), 'pos': f"P{rng.randrange(tags)}"} for _ in range(rng.randint(0, 40))]
+    tokens2 = [{'text': rng.choice(vocab), 'pos': f"P{rng.randrange(tags)}"} for _ in range(rng.randint(0, 40))]
+    if tokens1 and rng.random() < 0.5:
+        tokens2 = tokens2 + tokens1[rng.randint(0, len(tokens1) - 1):] + tokens2
+    return tokens1, tokens2
+
+
+def test_matches_legacy_on_random_texts():
+    rng = random.Random(0)
+    for _ in range(300):
+        tokens1, tokens2 = _random_pair(rng)
+        min_length = rng.choice([1, 1, 2, 3])
+        for max_length, top_k in ((None, None), (None, 3), (4, None), (2, 2)):
+            assert find_common_patterns_improved(tokens1, tokens2, min_length, max_length, top_k) == \
+                legacy_common_patterns(tokens1, tokens2, min_length, max_length, top_k)
+
+
+def test_sub_string_across_word_edges_is_dropped():
+    tokens1 = [{'text': w, 'pos': 'X'} for w in "the cat sat".split()]
+    tokens2 = [{'text': w, 'pos': 'X'} for w in "he the cat".split()]
+    assert [p['pattern'] for p in find_common_patterns_improved(tokens1, tokens2)] == ["the cat"]
+
+
+def test_sqlite_index_matches_memory_index():
+    rng = random.Random(1)
+    for _ in range(40):
+        tokens1, tokens2 = _random_pair(rng)
+        with SqliteNgramIndex() as index:
+            assert list(iter_common_patterns(tokens1, tokens2, index=index)) == \
+                find_common_patterns_improved(tokens1, tokens2)
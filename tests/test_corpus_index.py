@@ -0,0 +1,97 @@
+import random
+import time
+
+import pytest
+
+import corpus_index
+from corpus_index import CorpusIndex, shard_for
+from text_analyzer import find_common_patterns_improved
+
+N_SHARDS = 3
+TOP_K = 8
+
+
+def _tokens(rng, n):
+    return [{'text': f"w{rng.randrange(60)}", 'pos': f"P{rng.randrange(2)}"} for _ in range(n)]
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    rng = random.Random(0)
+    query = _tokens(rng, 300)
+    docs = []
+    for i in range(24):
+        doc = _tokens(rng, 150)
+        start, length = rng.randrange(280), rng.randint(3, 20)
+        docs.append((f"doc{i}", doc[:75] + query[start:start + length] + doc[75:]))
+    return docs, query
+
+
+def _expected(docs, query, shards=None):
+    """Per-document find_common_patterns_improved, merged longest first."""
+    patterns = []
+    for doc_id, tokens in docs:
+        if shards is None or shard_for(doc_id, N_SHARDS) in shards:
+            patterns.extend(dict(p, doc_id=doc_id) for p in find_common_patterns_improved(
+                tokens, query, min_length=corpus_index.DEFAULT_SEED_LENGTH, top_k=TOP_K))
+    return sorted(patterns, key=lambda p: -p['length'])
+
+
+def _check(result, expected):
+    # 同じ長さのパターンの順序は決めていないので、長さの並びと各パターンの出どころを比べる
+    found = result['patterns']
+    assert [p['length'] for p in found] == [p['length'] for p in expected[:TOP_K]]
+    for pattern in found:
+        assert pattern in expected
+
+
+def test_scatter_gather_matches_per_document_mining(corpus):
+    docs, query = corpus
+    with CorpusIndex(N_SHARDS) as index:
+        index.add_documents(docs)
+        result = index.query(query, top_k=TOP_K)
+    assert not result['partial']
+    assert result['missing_shards'] == []
+    assert sorted(result['shards']) == list(range(N_SHARDS))
+    _check(result, _expected(docs, query))
+
+
+def test_killed_shard_gives_a_partial_result(corpus):
+    docs, query = corpus
+    with CorpusIndex(N_SHARDS) as index:
+        index.add_documents(docs)
+        index.stats() # 文書の追加が終わるのを待つ
+        index._processes[1].kill()
+        index._processes[1].join()
+        result = index.query(query, top_k=TOP_K)
+    assert result['partial']
+    assert result['missing_shards'] == [1]
+    _check(result, _expected(docs, query, shards={0, 2}))
+
+
+def test_late_reply_of_a_timed_out_shard_is_discarded(corpus, monkeypatch):
+    docs, query = corpus
+    query_shard = corpus_index._Shard.query
+
+    def slow_first_query(self, *args):
+        # シャード 0 の最初の問い合わせだけ遅くする (fork したシャードのプロセス内で動く)
+        if self.shard_id == 0 and not getattr(self, 'slowed', False):
+            self.slowed = True
+            time.sleep(1.0)
+        return query_shard(self, *args)
+
+    monkeypatch.setattr(corpus_index._Shard, 'query', slow_first_query)
+    with CorpusIndex(N_SHARDS) as index:
+        index.add_documents(docs)
+        first = index.query(query, top_k=TOP_K, timeout=0.3)
+        assert first['missing_shards'] == [0]
+        _check(first, _expected(docs, query, shards={1, 2}))
+
+        time.sleep(1.0) # 遅れた返事が届く
+        other_query = query[150:]
+        second = index.query(other_query, top_k=TOP_K)
+    # 遅れた返事 (最初の問い合わせの結果) は捨てられ、シャード 0 も今回の問い合わせに答える
+    assert not second['partial']
+    expected = _expected(docs, other_query)
+    assert any(shard_for(p['doc_id'], N_SHARDS) == 0 for p in expected[:TOP_K])
+    _check(second, expected)
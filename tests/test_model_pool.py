@@ -0,0 +1,62 @@
+import pytest
+import spacy
+
+from model_pool import AUTO, ModelNotInstalled, ModelPool
+
+
+GERMAN = "Der Hund und die Katze sind nicht im Haus, das ist auch mit dem Garten so."
+
+
+def make_pool(installed):
+    loads = []
+
+    def loader(name):
+        loads.append(name)
+        if name not in installed:
+            raise OSError(f"[E050] Can't find model '{name}'")
+        return spacy.blank('en')
+
+    pool = ModelPool(ram_budget_mb=100, loader=loader,
+                     model_sizes_mb={name: 10 for name in installed})
+    return pool, loads
+
+
+def test_explicit_missing_model_raises_and_is_not_retried():
+    pool, loads = make_pool({'en_core_web_sm'})
+    for _ in range(3):
+        with pytest.raises(ModelNotInstalled) as info:
+            pool.get('en_core_web_lg')
+        assert info.value.model == 'en_core_web_lg'
+    # 失敗したロードは覚えておき、既定のモデルで代用もしない
+    assert loads == ['en_core_web_lg']
+    stats = pool.stats()
+    assert stats['misses'] == 1
+    assert stats['fallbacks'] == 0
+    assert stats['missing_models'] == ['en_core_web_lg']
+    assert stats['resident_models'] == []
+
+
+def test_auto_falls_back_to_default_once():
+    pool, loads = make_pool({'en_core_web_sm'})
+    for _ in range(3):
+        name, nlp = pool.load(AUTO, GERMAN)
+        assert name == 'en_core_web_sm'
+    assert loads == ['de_core_news_sm', 'en_core_web_sm']
+    stats = pool.stats()
+    assert stats['fallbacks'] == 3
+    assert stats['routed_languages'] == {'de': 3}
+
+
+def test_cache_name_is_the_loaded_model():
+    pool, loads = make_pool({'en_core_web_sm', 'de_core_news_sm'})
+    assert pool.cache_name(AUTO, GERMAN) == 'de_core_news_sm'
+    assert pool.cache_name('en_core_web_lg') == 'en_core_web_lg' # 明示指定はロードせずに名前を返す
+    assert loads == ['de_core_news_sm']
+
+    pool, loads = make_pool({'en_core_web_sm'})
+    assert pool.cache_name(AUTO, GERMAN) == 'en_core_web_sm'
+
+    pool.clear_missing()
+    with pytest.raises(ModelNotInstalled):
+        pool.get('de_core_news_sm')
+    assert loads.count('de_core_news_sm') == 2
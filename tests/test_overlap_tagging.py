@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+spacy = pytest.importorskip('spacy')
+
+import text_analyzer
+from taggers import TaggerBackend, tokens_from_doc
+
+
+class CaseSensitiveTagger(TaggerBackend):
+    """Tags every word on its own; capitalised words get PROPN, so the input casing shows in the tags."""
+
+    name = 'fake'
+
+    def __init__(self):
+        self._nlp = spacy.blank('en')
+        self.tagged_texts = []
+
+    def make_doc(self, text):
+        return self._nlp.make_doc(text)
+
+    def pipe(self, texts, preserve_case=False):
+        for text in texts:
+            self.tagged_texts.append(text)
+            doc = self._nlp.make_doc(text if preserve_case else text.lower())
+            for token in doc:
+                token.pos_ = 'PROPN' if token.text[:1].isupper() else ('NOUN' if len(token.text) % 2 else 'VERB')
+            yield tokens_from_doc(doc, preserve_case)
+
+
+@pytest.fixture
+def tagger(monkeypatch):
+    backend = CaseSensitiveTagger()
+    monkeypatch.setattr(text_analyzer, 'get_tagger', lambda name='spacy', model=None: backend)
+    return backend
+
+
+def _text(rng, sentences):
+    words = ["the", "a", "cat", "dog", "sat", "ran", "on", "mat", "Paris", "in", "of", "big"]
+    return " ".join(" ".join(rng.choice(words) for _ in range(rng.randint(3, 8))).capitalize() + "."
+                    for _ in range(sentences))
+
+
+@pytest.mark.parametrize('preserve_case', [False, True])
+def test_overlap_patterns_match_full_tagging(tagger, preserve_case):
+    rng = random.Random(0)
+    for _ in range(30):
+        text1, text2 = _text(rng, 12), _text(rng, 12)
+        min_length = rng.choice([1, 2, 3])
+        full = text_analyzer.find_common_patterns_improved(
+            text_analyzer.normalize_and_pos_tag(text1, preserve_case=preserve_case),
+            text_analyzer.normalize_and_pos_tag(text2, preserve_case=preserve_case), min_length=min_length)
+        overlap = text_analyzer.find_common_patterns_improved(
+            *text_analyzer.normalize_and_pos_tag_overlapping(text1, text2, min_length=min_length,
+                                                             preserve_case=preserve_case),
+            min_length=min_length)
+        assert overlap == full
+
+
+def test_longer_min_length_tags_fewer_sentences(tagger):
+    text1 = "The cat sat on the mat. A dog ran in the park. It was a big day."
+    text2 = "The cat sat on the mat. The rain fell on the town. It was the end."
+    text_analyzer.normalize_and_pos_tag_overlapping(text1, text2, min_length=1)
+    tagged_n1 = sum(map(len, tagger.tagged_texts))
+    tagger.tagged_texts.clear()
+    text_analyzer.normalize_and_pos_tag_overlapping(text1, text2, min_length=3)
+    tagged_n3 = sum(map(len, tagger.tagged_texts))
+    assert tagged_n3 < tagged_n1
+    assert tagger.tagged_texts == ["The cat sat on the mat.", "The cat sat on the mat."]
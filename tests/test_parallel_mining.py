@@ -0,0 +1,52 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pytest
+
+from parallel_mining import PartitionedNgramIndex, find_common_patterns_parallel
+from text_analyzer import find_common_patterns_improved
+
+
+def _tokens(rng, n, vocab, tags):
+    return [{'text': f"w{rng.randrange(vocab)}", 'pos': f"P{rng.randrange(tags)}"} for _ in range(n)]
+
+
+@pytest.fixture(scope='module')
+def executor():
+    with ProcessPoolExecutor(2) as ex:
+        yield ex
+
+
+def test_parallel_matches_serial_on_random_texts(executor):
+    rng = random.Random(1)
+    for _ in range(150):
+        vocab, tags = rng.choice([2, 3, 5, 20]), rng.choice([1, 2, 3])
+        tokens1 = _tokens(rng, rng.randint(0, 60), vocab, tags)
+        tokens2 = _tokens(rng, rng.randint(0, 60), vocab, tags)
+        if tokens1 and rng.random() < 0.5:
+            tokens2 = tokens2 + tokens1[rng.randint(0, len(tokens1) - 1):] + tokens2
+        options = dict(min_length=rng.choice([1, 1, 2, 3]), max_length=rng.choice([None, None, 4, 10]),
+                       top_k=rng.choice([None, None, 3]))
+        expected = find_common_patterns_improved(tokens1, tokens2, **options)
+        assert find_common_patterns_parallel(tokens1, tokens2, executor=executor,
+                                             workers=rng.choice([1, 2, 3]), **options) == expected
+
+
+def test_parallel_matches_serial_across_level_blocks(executor):
+    rng = random.Random(2)
+    tokens1 = _tokens(rng, 400, 50, 2)
+    tokens2 = _tokens(rng, 100, 50, 2) + tokens1[10:90] + _tokens(rng, 50, 50, 2)
+    expected = find_common_patterns_improved(tokens1, tokens2)
+    assert expected[0]['length'] >= 80
+    assert find_common_patterns_parallel(tokens1, tokens2, executor=executor, workers=2) == expected
+
+
+def test_index_frees_shared_blocks(executor):
+    index = PartitionedNgramIndex(workers=2, executor=executor)
+    list(index([1, 2, 3], [0, 0, 0], [1, 2, 3], [0, 0, 0], 2))
+    names = [index._shm.name, index._anchors_shm.name]
+    index.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
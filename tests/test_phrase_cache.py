@@ -0,0 +1,74 @@
+from phrase_cache import PhraseCache
+
+
+def _analysis(text):
+    return [{'pattern': text, 'type': 'NP'}]
+
+
+class RecordingCompute:
+    """compute_many that records the texts it was asked to analyse."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [_analysis(text) for text in texts]
+
+
+def test_lru_eviction():
+    cache = PhraseCache(max_entries=2)
+    compute = RecordingCompute()
+    for text in ("a", "b", "a", "c"): # "a" を使ったので "b" が最も古い
+        cache.get_or_compute_many([text], 'm', compute)
+    assert cache.stats()['evictions'] == 1
+    cache.get_or_compute_many(["a", "c"], 'm', compute)
+    assert len(compute.calls) == 3
+    cache.get_or_compute_many(["b"], 'm', compute)
+    assert compute.calls[-1] == ["b"]
+    # 結果は呼び出しごとのコピー
+    first = cache.get_or_compute("c", 'm', lambda: _analysis("c"))
+    first[0]['type'] = 'changed'
+    assert cache.get_or_compute("c", 'm', lambda: _analysis("c"))[0]['type'] == 'NP'
+
+
+def test_persistent_tier_is_shared_across_instances(tmp_path):
+    db_path = str(tmp_path / 'phrases.db')
+    compute = RecordingCompute()
+    PhraseCache(max_entries=10, db_path=db_path).get_or_compute_many(["the big cat", "a dog"], 'm', compute)
+
+    cache = PhraseCache(max_entries=10, db_path=db_path)
+    assert cache.get_or_compute_many(["the  big cat", "a dog"], 'm', compute) == \
+        [_analysis("the big cat"), _analysis("a dog")]
+    assert len(compute.calls) == 1
+    # 2回目はメモリの LRU から返る
+    cache.get_or_compute_many(["a dog"], 'm', compute)
+    stats = cache.stats()
+    assert (stats['persistent_hits'], stats['hits'], stats['misses']) == (2, 1, 0)
+    # モデルが違えば別のキー
+    cache.get_or_compute_many(["a dog"], 'other', compute)
+    assert compute.calls[-1] == ["a dog"]
+
+
+def test_get_or_compute_many_deduplicates_and_keeps_order():
+    cache = PhraseCache(max_entries=10)
+    compute = RecordingCompute()
+    cache.get_or_compute_many(["x"], 'm', compute)
+    results = cache.get_or_compute_many(["y", "x", "y", " y ", "z"], 'm', compute)
+    assert results == [_analysis("y"), _analysis("x"), _analysis("y"), _analysis("y"), _analysis("z")]
+    assert compute.calls == [["x"], ["y", "z"]]
+
+
+def test_hit_rate():
+    cache = PhraseCache(max_entries=10)
+    assert cache.stats()['hit_rate'] is None
+    compute = RecordingCompute()
+    cache.get_or_compute_many(["a", "b"], 'm', compute)
+    cache.get_or_compute_many(["a", "b", "c", "a"], 'm', compute)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (3, 3)
+    assert stats['hit_rate'] == 0.5
+
+    disabled = PhraseCache(max_entries=0)
+    disabled.get_or_compute_many(["a", "a"], 'm', compute)
+    assert compute.calls[-1] == ["a", "a"] # キャッシュ無効なら毎回解析する
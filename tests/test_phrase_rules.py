@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+spacy = pytest.importorskip('spacy')
+from spacy.tokens import Doc
+
+from phrase_rules import analyze_doc_phrases
+
+POS_TAGS = ["VERB", "ADJ", "ADV", "NOUN", "DET", "ADP", "PRON"]
+DEP_LABELS = ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt",
+              "amod", "pobj", "nsubj", "det", "compound"]
+
+VP_DEPS = ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp", "advmod", "aux", "prt"]
+ADJP_DEPS = ["advmod", "prep", "amod"]
+ADVP_DEPS = ["advmod", "prep"]
+
+
+def legacy_phrases(doc):
+    """
+    The token-walking analyze_phrase_patterns the rules replaced (web version),
+    with phrase tokens ordered by position instead of by str.find.
+    """
+    phrases_info = []
+    for chunk in doc.noun_chunks:
+        phrases_info.append({
+            'pattern': chunk.text,
+            'type': 'Noun Phrase (NP)',
+            'description': f"A noun phrase headed by '{chunk.root.text}' ('{chunk.root.pos_}') including its modifiers."
+        })
+
+    def phrase(head, deps, expand=()):
+        members = [head]
+        for child in head.children:
+            if child.dep_ in deps:
+                members.append(child)
+                if child.dep_ in expand:
+                    members.extend(child.children)
+        return " ".join(t.text for t in sorted(members, key=lambda t: t.i)) if len(members) > 1 else None
+
+    for token in doc:
+        if token.pos_ == "VERB" and token.dep_ == "ROOT":
+            text = phrase(token, VP_DEPS, expand=["prep"])
+            if text:
+                phrases_info.append({
+                    'pattern': text,
+                    'type': 'Verb Phrase (VP) - inferred',
+                    'description': f"A verb phrase centered around '{token.text}' ('{token.pos_}') possibly including its objects/complements/adjuncts."
+                })
+        if token.pos_ == "ADJ":
+            text = phrase(token, ADJP_DEPS)
+            if text:
+                phrases_info.append({
+                    'pattern': text,
+                    'type': 'Adjective Phrase (ADJP) - inferred',
+                    'description': f"An adjective phrase centered around '{token.text}' ('{token.pos_}')."
+                })
+        if token.pos_ == "ADV":
+            text = phrase(token, ADVP_DEPS)
+            if text:
+                phrases_info.append({
+                    'pattern': text,
+                    'type': 'Adverb Phrase (ADVP) - inferred',
+                    'description': f"An adverb phrase centered around '{token.text}' ('{token.pos_}')."
+                })
+    return phrases_info
+
+
+def _random_doc(rng, vocab):
+    """A parsed Doc with random POS tags, labels and one random tree per sentence."""
+    words, pos, deps, heads = [], [], [], []
+    for _ in range(rng.randint(1, 3)):
+        start, n = len(words), rng.randint(1, 12)
+        order = [start + i for i in range(n)]
+        rng.shuffle(order)
+        sentence_heads = {order[0]: order[0]}
+        for k, i in enumerate(order[1:], 1):
+            sentence_heads[i] = rng.choice(order[:k]) # 既に木に入ったトークンにつなぐ
+        for i in range(start, start + n):
+            words.append(rng.choice(["run", "quick", "very", "dog", "the", "in", "it"]))
+            pos.append(rng.choice(POS_TAGS))
+            deps.append("ROOT" if sentence_heads[i] == i else rng.choice(DEP_LABELS))
+            heads.append(sentence_heads[i])
+    return Doc(vocab, words=words, pos=pos, deps=deps, heads=heads)
+
+
+def test_rules_match_token_walking_on_random_parses():
+    vocab = spacy.blank('en').vocab
+    rng = random.Random(0)
+    for _ in range(300):
+        doc = _random_doc(rng, vocab)
+        assert analyze_doc_phrases(doc) == legacy_phrases(doc)
+
+
+def test_repeated_words_keep_their_position():
+    vocab = spacy.blank('en').vocab
+    doc = Doc(vocab, words=["run", "fast", "run"], pos=["ADV", "VERB", "ADV"],
+              deps=["advmod", "ROOT", "advmod"], heads=[1, 1, 1])
+    verb_phrases = [p['pattern'] for p in analyze_doc_phrases(doc) if p['type'].startswith('Verb')]
+    assert verb_phrases == ["run fast run"]
@@ -0,0 +1,69 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from shared_tokens import SharedTokenColumns, _attach_block, find_common_patterns_shared
+from text_analyzer import find_common_patterns_improved
+
+
+def _tokens(rng, n, vocab, tags):
+    return [{'text': rng.choice(vocab), 'pos': f"P{rng.randrange(tags)}"} for _ in range(n)]
+
+
+def _exists(name):
+    try:
+        block = _attach_block(name)
+    except FileNotFoundError:
+        return False
+    block.close()
+    return True
+
+
+def test_shared_mining_matches_token_lists():
+    rng = random.Random(0)
+    for _ in range(100):
+        # 2 つのテキストで語彙の並びが異なるので、テキスト 2 の id の付け替えも検証される
+        vocab = rng.choice([["a", "at", "cat", "t"], ["he", "the", "then", "e"], ["x", "y", "z"]])
+        tokens1 = _tokens(rng, rng.randint(0, 40), vocab, rng.choice([1, 2]))
+        tokens2 = _tokens(rng, rng.randint(0, 40), vocab[::-1], rng.choice([1, 2]))
+        if tokens1 and rng.random() < 0.5:
+            tokens2 = tokens2 + tokens1[rng.randint(0, len(tokens1) - 1):]
+        options = dict(min_length=rng.choice([1, 2]), max_length=rng.choice([None, 3]),
+                       top_k=rng.choice([None, 2]))
+        with SharedTokenColumns.from_tokens(tokens1) as shared1, SharedTokenColumns.from_tokens(tokens2) as shared2:
+            assert find_common_patterns_shared(shared1.handle, shared2.handle, **options) == \
+                find_common_patterns_improved(tokens1, tokens2, **options)
+
+
+def test_shared_mining_in_a_worker_process():
+    rng = random.Random(1)
+    tokens1 = _tokens(rng, 200, ["a", "b", "c", "d"], 2)
+    tokens2 = _tokens(rng, 50, ["a", "b", "c", "d"], 2) + tokens1[20:80]
+    with SharedTokenColumns.from_tokens(tokens1) as shared1, SharedTokenColumns.from_tokens(tokens2) as shared2, \
+         ProcessPoolExecutor(1) as executor:
+        future = executor.submit(find_common_patterns_shared, shared1.acquire(), shared2.acquire())
+        try:
+            assert future.result() == find_common_patterns_improved(tokens1, tokens2)
+        finally:
+            shared1.release()
+            shared2.release()
+
+
+def test_block_is_unlinked_after_owner_and_last_job():
+    shared = SharedTokenColumns.from_tokens([{'text': 'a', 'pos': 'X'}])
+    name = shared.handle.name
+    shared.acquire()
+    shared.close()
+    assert _exists(name) # ジョブがまだ参照している
+    shared.release()
+    assert not _exists(name)
+    with pytest.raises(ValueError):
+        shared.acquire()
+
+
+def test_block_is_unlinked_on_close_without_jobs():
+    shared = SharedTokenColumns.from_tokens([])
+    name = shared.handle.name
+    shared.close()
+    assert not _exists(name)
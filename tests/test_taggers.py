@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('spacy')
+
+import taggers
+from taggers import LexiconTagger, PerceptronTagger, get_tagger, spacy_training_sentences, tagger_available
+
+
+def test_lexicon_tagger_is_always_available():
+    assert tagger_available('lexicon')
+    tokens = get_tagger('lexicon').tag("The cat walked quickly to the door.")
+    assert [t['text'] for t in tokens] == ["the", "cat", "walked", "quickly", "to", "the", "door"]
+    assert [t['pos'] for t in tokens] == ["DET", "NOUN", "VERB", "ADV", "ADP", "DET", "NOUN"]
+
+
+def test_untrained_perceptron_is_not_offered(monkeypatch):
+    monkeypatch.setattr(taggers, 'perceptron_trained', lambda model_path=None: False)
+    assert not tagger_available('perceptron')
+    assert not tagger_available('fast')
+    with pytest.raises(ValueError):
+        get_tagger('perceptron')
+
+
+class _RecordingNlp:
+    """Stands in for a spaCy pipeline: records the texts and parses them with a blank pipeline."""
+
+    def __init__(self):
+        import spacy
+        self._nlp = spacy.blank('en')
+        self._nlp.add_pipe('sentencizer')
+        self.texts = []
+
+    def pipe(self, texts):
+        for text in texts:
+            self.texts.append(text)
+            doc = self._nlp(text)
+            for token in doc:
+                token.pos_ = 'PROPN' if token.text[:1].isupper() else 'NOUN'
+            yield doc
+
+
+class _FakeSpacy:
+    def __init__(self):
+        self.nlp = _RecordingNlp()
+
+
+def test_training_sentences_use_the_casing_of_the_analyzer():
+    tagger = _FakeSpacy()
+    sentences = spacy_training_sentences(["Paris is big."], tagger=tagger)
+    assert tagger.nlp.texts == ["paris is big."]
+    assert sentences[0][0] == ["paris", "is", "big", "."]
+    spacy_training_sentences(["Paris is big."], tagger=tagger, preserve_case=True)
+    assert tagger.nlp.texts[-1] == "Paris is big."
+
+
+def test_perceptron_predicts_with_its_training_casing(tmp_path):
+    sentences = [(["the", "run", "was", "long"], ["DET", "NOUN", "AUX", "ADJ"]),
+                 (["we", "run", "home"], ["PRON", "VERB", "ADV"])] * 30
+    perceptron = PerceptronTagger(model_path=None)
+    perceptron.train(sentences, n_iter=3)
+    path = tmp_path / 'model.json'
+    perceptron.save(str(path))
+
+    loaded = PerceptronTagger(model_path=str(path))
+    assert loaded.trained and loaded.lowercase
+    lowered = loaded.tag("we run home", preserve_case=False)
+    assert loaded.tag("We Run Home", preserve_case=True) == lowered
+    assert loaded.tag("WE RUN HOME", preserve_case=False) == lowered
+    assert [t['pos'] for t in lowered] == ["PRON", "VERB", "ADV"]
@@ -1,15 +1,23 @@
 #text_analyzer.py
-import spacy
+from spacy.pipeline import Sentencizer
 import os
+import shutil
+import sqlite3
+import tempfile
+from array import array
 from collections import defaultdict
+from itertools import islice
 
-# spaCyモデルのロード (初回のみダウンロードが必要)
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("SpaCy model 'en_core_web_sm' not found. Please run:")
-    print("python -m spacy download en_core_web_sm")
-    exit()
+import numpy as np
+
+from admission import LONG_WORD, describe_plan, plan_analysis, probe_longest_common_length_ids
+from model_pool import get_model_pool
+from phrase_cache import get_phrase_cache
+from phrase_rules import analyze_doc_phrases
+from result_writers import SINKS, format_available, open_sink, stream_results
+from taggers import TAGGER_ALIASES, TAGGERS, ModelNotInstalled, get_tagger, tagger_available
+
+# spaCyモデルは taggers.SpacyTagger が初回使用時にロードする (初回のみダウンロードが必要)
 
 # --- (read_text_file, normalize_and_pos_tag は変更なし) ---
 def read_text_file(filepath):
@@ -24,72 +32,448 @@ def read_text_file(filepath):
         print(f"Error reading file {filepath}: {e}")
         return None
 
-def normalize_and_pos_tag(text):
-    """Normalizes text and returns a list of tokens with POS tags."""
-    doc = nlp(text.lower()) # Process text in lowercase
+def normalize_and_pos_tag(text, preserve_case=False, tagger='spacy', model=None):
+    """
+    Normalizes text and returns a list of tokens with POS tags.
+    With preserve_case=True the tagger sees the original casing (more
+    accurate, no lowercased copy of the input) and each token is lowercased
+    on output instead. tagger selects the backend (see taggers.py):
+    'spacy' / 'accurate' or 'perceptron' / 'fast'. model picks the spaCy
+    model: None for the default, a model name, or 'auto' to route by the
+    detected language of the text (see model_pool.py).
+    """
+    return get_tagger(tagger, model).tag(text, preserve_case=preserve_case)
+
+
+# --- 重なり優先のタグ付け (overlap-first tagging) ---
+_sentencizer = Sentencizer()
+
+
+def _split_sentences(text, backend):
+    """
+    Phase 1 (tokenizer only): returns the lowercased alpha/digit tokens of a
+    text, the sentence index of each token and the sentences' char spans.
+    """
+    doc = _sentencizer(backend.make_doc(text))
+    words, sentence_ids, spans = [], [], []
+    for sentence in doc.sents:
+        for token in sentence:
+            if token.is_alpha or token.is_digit:
+                words.append(token.lower_)
+                sentence_ids.append(len(spans))
+        spans.append((sentence.start_char, sentence.end_char))
+    return words, sentence_ids, spans
+
+
+def _candidate_sentences(words, sentence_ids, shared_grams, n):
+    """Indexes of sentences touched by an occurrence of a shared n-gram."""
+    marked = set()
+    for i in range(len(words) - n + 1):
+        if tuple(words[i:i + n]) in shared_grams:
+            marked.update(sentence_ids[i:i + n])
+    return marked
+
+
+def _tag_regions(text, spans, marked, side, backend, preserve_case=False):
+    """
+    Phase 2: tags runs of adjacent candidate sentences and joins the tokens.
+    A unique placeholder token is put wherever sentences were skipped, so no
+    pattern can be matched across a gap.
+    """
+    regions = []
+    for index in sorted(marked):
+        if regions and regions[-1][1] == index - 1:
+            regions[-1][1] = index
+        else:
+            regions.append([index, index])
+
     tokens_with_pos = []
-    for token in doc:
-        # Include only alphabetic or numeric tokens
-        if token.is_alpha or token.is_digit:
-            tokens_with_pos.append({
-                'text': token.text,
-                'pos': token.pos_ # Part-of-Speech tag
-            })
+    region_texts = (text[spans[first][0]:spans[last][1]] for first, last in regions)
+    for k, region_tokens in enumerate(backend.pipe(region_texts, preserve_case=preserve_case)):
+        if k > 0:
+            tokens_with_pos.append({'text': f"\x00gap{side}-{k}", 'pos': 'X'})
+        tokens_with_pos.extend(region_tokens)
     return tokens_with_pos
 
 
-def find_common_patterns_improved(tokens1, tokens2, min_length=1):
+def normalize_and_pos_tag_overlapping(text1, text2, min_length=1, tagger='spacy', model=None,
+                                      preserve_case=False):
+    """
+    Two-phase alternative to tagging both texts in full:
+      1. tokenize only, and find the sentences that contain an occurrence of
+         a lowercased n-gram (n = min_length) shared by both texts;
+      2. run the tagger on just those sentences, with the same casing as
+         normalize_and_pos_tag(text, preserve_case=preserve_case).
+    Every common pattern of at least min_length tokens lies inside such
+    sentences. The patterns are the same as with full tagging wherever the
+    tagger assigns the same tags to a sentence on its own as in the whole
+    text; the tags can differ near sentence edges, so this is not an exact
+    replacement. Tokens outside the candidate sentences are not returned,
+    so POS discrepancies only cover the overlapping regions.
+    The savings depend on min_length: at 1 or 2 almost every sentence
+    shares a stopword or a common word pair with the other text, so tagging
+    only gets cheaper from min_length 3 up.
+    """
+    backend = get_tagger(tagger, model)
+    n = max(min_length, 1)
+    words1, sentence_ids1, spans1 = _split_sentences(text1, backend)
+    words2, sentence_ids2, spans2 = _split_sentences(text2, backend)
+
+    grams1 = {tuple(words1[i:i + n]) for i in range(len(words1) - n + 1)}
+    shared_grams = {tuple(words2[i:i + n]) for i in range(len(words2) - n + 1)} & grams1
+
+    marked1 = _candidate_sentences(words1, sentence_ids1, shared_grams, n)
+    marked2 = _candidate_sentences(words2, sentence_ids2, shared_grams, n)
+    return (_tag_regions(text1, spans1, marked1, 1, backend, preserve_case),
+            _tag_regions(text2, spans2, marked2, 2, backend, preserve_case))
+
+
+def _intern_tokens(tokens, text_vocab, pos_vocab):
+    """Maps token dicts to parallel int arrays of text / POS ids."""
+    text_ids = array('i', [text_vocab.setdefault(t['text'], len(text_vocab)) for t in tokens])
+    pos_ids = array('i', [pos_vocab.setdefault(t['pos'], len(pos_vocab)) for t in tokens])
+    return text_ids, pos_ids
+
+
+def _gram_keys(ids, length):
+    """
+    Yields (start, key) for every n-gram of an id column. Keys are the raw
+    bytes of the n-gram, so any buffer of ints works (array('i') or an int32
+    NumPy view, e.g. on shared memory) without converting it to a list.
+    """
+    view = memoryview(ids)
+    itemsize = view.itemsize
+    raw = view.cast('B')
+    span = length * itemsize
+    for i in range(len(view) - length + 1):
+        offset = i * itemsize
+        yield i, raw[offset:offset + span].tobytes()
+
+
+def _ngram_pos_table(text_ids, pos_ids, length):
+    """
+    Returns {text n-gram: (POS n-gram, start)} for every n-gram of the given
+    length. Like the original substring dictionary, a repeated n-gram keeps
+    the POS sequence of its last occurrence, while dict order follows first
+    occurrence.
+    """
+    table = {}
+    for (i, gram), (_, pos_gram) in zip(_gram_keys(text_ids, length), _gram_keys(pos_ids, length)):
+        table[gram] = (pos_gram, i)
+    return table
+
+
+def _memory_level_matches(text_ids1, pos_ids1, text_ids2, pos_ids2, length):
+    """
+    Yields the start (in text 1) of every n-gram of the given length whose
+    text and POS sequence both occur in text 2, in first-occurrence order.
+    In-memory index: two dicts of all n-grams of this length.
+    """
+    table2 = _ngram_pos_table(text_ids2, pos_ids2, length)
+    table1 = _ngram_pos_table(text_ids1, pos_ids1, length)
+    for gram, (pos_gram, start) in table1.items():
+        # Only include if both text and POS sequence match
+        match = table2.get(gram)
+        if match is not None and match[0] == pos_gram:
+            yield start
+
+
+class SqliteNgramIndex:
+    """
+    Disk-spilled replacement for _memory_level_matches: the n-grams of each
+    length go into a temporary SQLite database and are matched with a join,
+    so memory stays bounded by SQLite's page cache however long the texts
+    are. Same results and order as the in-memory index. Call close() (or
+    use it as a context manager) to delete the database.
+    """
+
+    BATCH_SIZE = 10000
+
+    def __init__(self, directory=None, cache_mb=64):
+        self._dir = tempfile.mkdtemp(prefix='ngram-index-', dir=directory)
+        self._db = sqlite3.connect(os.path.join(self._dir, 'index.sqlite3'))
+        for pragma in ('journal_mode = OFF', 'synchronous = OFF', 'temp_store = FILE',
+                       f'cache_size = {-cache_mb * 1024}'):
+            self._db.execute(f'PRAGMA {pragma}')
+        # first: 最初の出現位置 (並び順) / start, pos: 最後の出現 (辞書版と同じ)
+        self._db.execute('CREATE TABLE grams1 (gram BLOB PRIMARY KEY, pos BLOB, start INTEGER, first INTEGER)'
+                         ' WITHOUT ROWID')
+        self._db.execute('CREATE TABLE grams2 (gram BLOB PRIMARY KEY, pos BLOB) WITHOUT ROWID')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _insert(self, sql, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.BATCH_SIZE:
+                self._db.executemany(sql, batch)
+                batch = []
+        if batch:
+            self._db.executemany(sql, batch)
+
+    def __call__(self, text_ids1, pos_ids1, text_ids2, pos_ids2, length):
+        db = self._db
+        db.execute('DELETE FROM grams1')
+        db.execute('DELETE FROM grams2')
+        self._insert('INSERT INTO grams1 VALUES (?, ?, ?, ?) '
+                     'ON CONFLICT(gram) DO UPDATE SET pos = excluded.pos, start = excluded.start',
+                     ((gram, pos_gram, i, i) for (i, gram), (_, pos_gram)
+                      in zip(_gram_keys(text_ids1, length), _gram_keys(pos_ids1, length))))
+        self._insert('INSERT INTO grams2 VALUES (?, ?) ON CONFLICT(gram) DO UPDATE SET pos = excluded.pos',
+                     ((gram, pos_gram) for (_, gram), (_, pos_gram)
+                      in zip(_gram_keys(text_ids2, length), _gram_keys(pos_ids2, length))))
+        db.commit()
+        for (start,) in db.execute('SELECT g1.start FROM grams1 g1 JOIN grams2 g2'
+                                   ' ON g2.gram = g1.gram AND g2.pos = g1.pos ORDER BY g1.first'):
+            yield start
+
+
+class _WindowIds:
+    """
+    Exact ids for the windows of an id column: two windows of the same
+    length get the same id exactly when their tokens are equal. Built by
+    prefix doubling: level k ranks the windows of length 2**k, and a window
+    of length m is identified by the ranks of its first and last 2**k tokens
+    (2**k <= m < 2**(k + 1)).
+    """
+
+    def __init__(self, ids, longest):
+        rank = np.unique(np.asarray(ids), return_inverse=True)[1].astype(np.int64).reshape(-1)
+        self._ranks = [rank]
+        self._bases = [int(rank.max()) + 1 if len(rank) else 1]
+        width = 1
+        while width * 2 <= longest:
+            rank, base = self._ranks[-1], self._bases[-1]
+            pairs = rank[:len(rank) - width] * base + rank[width:]
+            rank = np.unique(pairs, return_inverse=True)[1].astype(np.int64).reshape(-1)
+            self._ranks.append(rank)
+            self._bases.append(int(rank.max()) + 1 if len(rank) else 1)
+            width *= 2
+
+    def at(self, starts, length):
+        """Ids of the windows of the given length (>= 1) at starts."""
+        level = length.bit_length() - 1
+        rank = self._ranks[level]
+        return rank[starts] * self._bases[level] + rank[starts + length - (1 << level)]
+
+
+def _span_windows(starts, lengths, length, inner=False):
+    """
+    Starts of all windows of the given length inside the spans
+    (starts, lengths); inner=True keeps one token of the span free on
+    both sides.
+    """
+    first = starts + 1 if inner else starts
+    counts = lengths - length - 1 if inner else lengths - length + 1
+    mask = counts > 0
+    first, counts = first[mask], counts[mask]
+    if not len(counts):
+        return np.empty(0, dtype=np.int64)
+    offsets = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(first, counts) + offsets
+
+
+class _SubPatternFilter:
+    """
+    The sub-pattern rule of the original find_common_patterns_improved: a
+    pattern is dropped when its text is a sub-string of a longer pattern
+    already reported. Decided from positions in text 1 rather than by
+    comparing each pattern text with every reported text:
+
+    * a window inside the span of a reported pattern is a sub-string
+      (exact window ids, checked for all candidates of a length at once);
+    * otherwise its text can only be a sub-string across word edges
+      ("he" in "the cat"): its inner words must then be a window inside a
+      reported span and its end words sub-strings of reported words. Only
+      candidates passing those checks are searched for as text.
+
+    Words containing a space fall back to comparing the texts.
+    """
+
+    LONG_WORD = LONG_WORD # これより長い単語は部分文字列の集合に入れず、直接検索する (admission の見積もりと共通)
+
+    def __init__(self, text_ids, words, longest):
+        self._ids = np.asarray(text_ids)
+        self._words = words
+        self._positional = all(word and ' ' not in word and '\n' not in word for word in words)
+        self._window_ids = _WindowIds(self._ids, longest) if self._positional else None
+        self._starts = np.empty(0, dtype=np.int64) # 報告済みパターンの位置と長さ
+        self._lengths = np.empty(0, dtype=np.int64)
+        self._texts = []
+        self._blob = None
+        self._word_ids = set()
+        self._substrings = set() # 報告済みパターンの単語の部分文字列
+        self._long_words = []
+
+    def _text(self, start, length):
+        return " ".join(self._words[w] for w in self._ids[start:start + length].tolist())
+
+    def keep(self, starts, length):
+        """Boolean mask over candidate starts of one length: True for the patterns to report."""
+        keep = np.ones(len(starts), dtype=bool)
+        if not self._texts or not len(starts):
+            return keep
+        if not self._positional:
+            for i, start in enumerate(starts.tolist()):
+                pattern_text = self._text(start, length)
+                keep[i] = not any(pattern_text in longer for longer in self._texts)
+            return keep
+
+        window_ids = self._window_ids
+        if length >= 2:
+            covered = window_ids.at(_span_windows(self._starts, self._lengths, length), length)
+            keep = ~np.isin(window_ids.at(starts, length), covered)
+        maybe = np.flatnonzero(keep)
+        if length >= 3 and len(maybe):
+            inner = window_ids.at(_span_windows(self._starts, self._lengths, length - 2, inner=True), length - 2)
+            maybe = maybe[np.isin(window_ids.at(starts[maybe] + 1, length - 2), inner)]
+        for i in maybe.tolist():
+            if self._across_word_edges(int(starts[i]), length):
+                keep[i] = False
+        return keep
+
+    def _in_reported_word(self, word):
+        return word in self._substrings or any(word in long_word for long_word in self._long_words)
+
+    def _across_word_edges(self, start, length):
+        words, ids = self._words, self._ids
+        if length == 1:
+            return self._in_reported_word(words[ids[start]])
+        if not (self._in_reported_word(words[ids[start]]) and
+                self._in_reported_word(words[ids[start + length - 1]])):
+            return False
+        if self._blob is None:
+            self._blob = "\n".join(self._texts)
+        return self._text(start, length) in self._blob
+
+    def accept(self, starts, length, texts):
+        """Records the patterns reported for one length."""
+        if not len(starts):
+            return
+        self._starts = np.concatenate([self._starts, starts])
+        self._lengths = np.concatenate([self._lengths, np.full(len(starts), length, dtype=np.int64)])
+        self._texts.extend(texts)
+        self._blob = None
+        if not self._positional:
+            return
+        new_ids = set(np.unique(self._ids[_span_windows(starts, np.full(len(starts), length), 1)]).tolist())
+        for w in new_ids - self._word_ids:
+            word = self._words[w]
+            if len(word) > self.LONG_WORD:
+                self._long_words.append(word)
+                continue
+            for i in range(len(word)):
+                for j in range(i + 1, len(word) + 1):
+                    self._substrings.add(word[i:j])
+        self._word_ids |= new_ids
+
+
+def iter_common_patterns_ids(text_ids1, pos_ids1, text_ids2, pos_ids2, words, tags,
+                             min_length=1, max_length=None, index=None, longest=None):
+    """
+    iter_common_patterns over interned columns. Both texts must use the same
+    vocabularies: words[i] / tags[i] are the strings for text / POS id i.
+    index matches the n-grams of one length (default: in-memory dicts, or a
+    SqliteNgramIndex); longest, if known, is an upper bound on the longest
+    shared n-gram and skips the rolling-hash probe.
+    """
+    if index is None:
+        index = _memory_level_matches
+    min_length = max(min_length, 1)
+    upper = min(len(text_ids1), len(text_ids2))
+    if max_length is not None:
+        upper = min(upper, max_length)
+    if upper < min_length:
+        return
+    if longest is None:
+        longest = probe_longest_common_length_ids(text_ids1, text_ids2, upper)
+    else:
+        longest = min(longest, upper)
+
+    # Skip patterns that are a sub-string of an already reported longer pattern
+    subpatterns = _SubPatternFilter(text_ids1, words, longest)
+    for length in range(longest, min_length - 1, -1):
+        starts = np.fromiter(index(text_ids1, pos_ids1, text_ids2, pos_ids2, length), dtype=np.int64)
+        starts = starts[subpatterns.keep(starts, length)]
+        found = []
+        for start in starts.tolist():
+            pattern_text = " ".join(words[w] for w in text_ids1[start:start + length])
+            found.append(pattern_text)
+            yield {
+                'pattern': pattern_text,
+                'pos_pattern': "-".join(tags[p] for p in pos_ids1[start:start + length]),
+                'length': length,
+            }
+        subpatterns.accept(starts, length, found)
+
+
+def iter_common_patterns(tokens1, tokens2, min_length=1, max_length=None, index=None, longest=None):
+    """
+    Yields common patterns longest first, in the same order and with the same
+    sub-pattern filtering as find_common_patterns_improved.
+
+    Patterns are mined one length at a time, starting at the longest length
+    the two texts can share, so a consumer that stops early never pays for
+    the shorter n-grams.
+    """
+    text_vocab, pos_vocab = {}, {}
+    text_ids1, pos_ids1 = _intern_tokens(tokens1, text_vocab, pos_vocab)
+    text_ids2, pos_ids2 = _intern_tokens(tokens2, text_vocab, pos_vocab)
+    return iter_common_patterns_ids(text_ids1, pos_ids1, text_ids2, pos_ids2,
+                                    list(text_vocab), list(pos_vocab),
+                                    min_length=min_length, max_length=max_length,
+                                    index=index, longest=longest)
+
+
+def iter_common_patterns_planned(tokens1, tokens2, plan):
+    """
+    iter_common_patterns with the limits and index chosen by
+    admission.plan_analysis. The disk index, if any, is deleted when the
+    generator finishes or is closed.
+    """
+    index = None
+    if plan['index'] == 'sqlite':
+        index = SqliteNgramIndex(plan.get('spill_dir'), cache_mb=max(1, int(plan.get('sqlite_cache_mb', 64))))
+    try:
+        patterns = iter_common_patterns(tokens1, tokens2, min_length=plan['min_length'],
+                                        max_length=plan['max_length'], index=index,
+                                        longest=plan['longest'])
+        if plan['top_k'] is not None:
+            patterns = islice(patterns, plan['top_k'])
+        yield from patterns
+    finally:
+        if index is not None:
+            index.close()
+
+
+def find_common_patterns_planned(tokens1, tokens2, plan):
+    """find_common_patterns_improved following an admission plan."""
+    return list(iter_common_patterns_planned(tokens1, tokens2, plan))
+
+
+def find_common_patterns_improved(tokens1, tokens2, min_length=1, max_length=None, top_k=None):
     """
     Finds common patterns (sequences of words with matching POS tags)
     between two token lists.
+    Results are sorted by length (longest first). min_length / max_length
+    bound the pattern length and top_k stops mining once enough patterns
+    have been found.
     """
-    patterns_with_pos = {} # Stores {pattern_text: pos_pattern_string} for each text
-
-    def collect_patterns(tokens_list):
-        sub_patterns = {}
-        for i in range(len(tokens_list)):
-            for j in range(i + min_length, len(tokens_list) + 1):
-                sub_tokens = tokens_list[i:j]
-                pattern_text = " ".join([t['text'] for t in sub_tokens])
-                pos_pattern = "-".join([t['pos'] for t in sub_tokens])
-                sub_patterns[pattern_text] = pos_pattern
-        return sub_patterns
-
-    sub_patterns1 = collect_patterns(tokens1)
-    sub_patterns2 = collect_patterns(tokens2)
-
-    common_patterns_data = {} # {pattern_text: {'pattern': ..., 'pos_pattern': ..., 'length': ...}}
-
-    for pattern_text, pos_pattern1 in sub_patterns1.items():
-        if pattern_text in sub_patterns2:
-            pos_pattern2 = sub_patterns2[pattern_text]
-            # Only include if both text and POS sequence match
-            if pos_pattern1 == pos_pattern2:
-                common_patterns_data[pattern_text] = {
-                    'pattern': pattern_text,
-                    'pos_pattern': pos_pattern1,
-                    'length': len(pattern_text.split()),
-                    # 'count' could be added here if counting occurrences in each text is desired
-                }
-
-    # Sort by length and filter out sub-patterns
-    sorted_unique_patterns = sorted(common_patterns_data.values(), key=lambda x: x['length'], reverse=True)
-    
-    final_results = []
-    for current_pattern_data in sorted_unique_patterns:
-        is_sub_pattern_of_existing = False
-        for existing_pattern_data in final_results:
-            # Check if current pattern is a sub-string of an already added longer pattern
-            if current_pattern_data['pattern'] in existing_pattern_data['pattern'] and \
-               current_pattern_data['length'] < existing_pattern_data['length']:
-                is_sub_pattern_of_existing = True
-                break
-        if not is_sub_pattern_of_existing:
-            final_results.append(current_pattern_data)
-    
-    final_results.sort(key=lambda x: x['length'], reverse=True)
-    
-    return final_results
+    patterns = iter_common_patterns(tokens1, tokens2, min_length=min_length, max_length=max_length)
+    if top_k is not None:
+        patterns = islice(patterns, top_k)
+    return list(patterns)
 
 
 def find_pos_discrepancies_improved(tokens1, tokens2):
@@ -129,138 +513,171 @@ def find_pos_discrepancies_improved(tokens1, tokens2):
     ]
     return formatted_discrepancies
 
-# --- 新規追加または大幅に修正する関数 ---
-def analyze_phrase_patterns(text):
+def analyze_phrase_patterns(text, model=None):
     """
     Given a text, analyze its phrase patterns using spaCy's dependency parser
     and noun chunks.
     Returns a list of identified phrase patterns and their types.
+    The VP/ADJP/ADVP rules are declared in phrase_rules.PHRASE_RULES.
+    Results are cached per pattern, model and rule version (phrase_cache.py),
+    under the model that actually parses the text ('auto' may fall back to
+    the default model).
     """
-    doc = nlp(text) # Use original casing for better phrase recognition if needed, or pass pre-normalized text.
-                    # For this purpose, using the original casing from the 'pattern' field might be better.
-                    # Let's assume 'text' here is a phrase like "the quick brown fox"
-
-    phrases_info = []
-
-    # 1. 名詞句 (Noun Chunks) の抽出
-    # spaCyは自動的に名詞句を識別します。
-    for chunk in doc.noun_chunks:
-        phrases_info.append({
-            'pattern': chunk.text,
-            'type': 'Noun Phrase (NP)',
-            'description': f"A noun phrase headed by '{chunk.root.text}' ('{chunk.root.pos_}') including its modifiers."
-        })
-
-    # 2. その他の句構造の推測（依存関係解析に基づく）
-    # より複雑な句（動詞句、形容詞句、副詞句など）は、依存関係解析の結果から推測できます。
-    # これは網羅的ではありませんが、一般的なパターンを捉えることができます。
-
-    # 動詞句 (Verb Phrase - VP) の簡易的な識別
-    # ルート動詞とその直接の依存関係にある要素を探す
-    for token in doc:
-        if token.pos_ == "VERB" and token.dep_ == "ROOT": # 文の主要動詞
-            # 動詞とその目的語、補語、副詞句などを結合して動詞句とする試み
-            verb_phrase_tokens = [token.text]
-            # 目的語 (dobj), 補語 (acomp, attr), 前置詞句 (prep) などを探す
-            for child in token.children:
-                if child.dep_ in ["dobj", "acomp", "attr", "prep", "advcl", "ccomp", "xcomp"]:
-                    verb_phrase_tokens.append(child.text)
-                    # 前置詞句などはさらにその子要素も含む
-                    if child.dep_ == "prep":
-                        for grand_child in child.children:
-                            verb_phrase_tokens.append(grand_child.text)
-            
-            # ソートして元の順序に近づける (完全な順序保証は難しい)
-            verb_phrase_text = " ".join(sorted(verb_phrase_tokens, key=lambda x: doc.text.find(x)))
-            if verb_phrase_text != token.text: # 動詞単体でなければ
-                phrases_info.append({
-                    'pattern': verb_phrase_text,
-                    'type': 'Verb Phrase (VP) - inferred',
-                    'description': f"A verb phrase centered around '{token.text}' ('{token.pos_}') possibly including its objects/complements/adjuncts."
-                })
-
-        # 形容詞句 (Adjective Phrase - ADJP) の簡易的な識別
-        # 形容詞をヘッドとする句
-        if token.pos_ == "ADJ" and token.head.pos_ != "NOUN": # 名詞を直接修飾しない形容詞
-            adj_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "amod", "prep"]: # 副詞や前置詞句など
-                    adj_phrase_tokens.append(child.text)
-            
-            adj_phrase_text = " ".join(sorted(adj_phrase_tokens, key=lambda x: doc.text.find(x)))
-            if adj_phrase_text != token.text:
-                phrases_info.append({
-                    'pattern': adj_phrase_text,
-                    'type': 'Adjective Phrase (ADJP) - inferred',
-                    'description': f"An adjective phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-
-        # 副詞句 (Adverb Phrase - ADVP) の簡易的な識別
-        # 副詞をヘッドとする句
-        if token.pos_ == "ADV" and token.head.pos_ != "VERB": # 動詞を直接修飾しない副詞
-            adv_phrase_tokens = [token.text]
-            for child in token.children:
-                if child.dep_ in ["advmod", "prep"]: # 副詞や前置詞句など
-                    adv_phrase_tokens.append(child.text)
-            
-            adv_phrase_text = " ".join(sorted(adv_phrase_tokens, key=lambda x: doc.text.find(x)))
-            if adv_phrase_text != token.text:
-                phrases_info.append({
-                    'pattern': adv_phrase_text,
-                    'type': 'Adverb Phrase (ADVP) - inferred',
-                    'description': f"An adverb phrase centered around '{token.text}' ('{token.pos_}')."
-                })
-                
-    return phrases_info
-
-
-def write_results_to_file(filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis):
-    """Writes the analysis results to a file."""
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write("---\n")
-            f.write("## Shared Token Patterns (Text and POS Match)\n")
-            f.write("---\n")
-            if not common_patterns:
-                f.write("No shared token patterns found.\n")
-            else:
-                for i, r in enumerate(common_patterns):
-                    f.write(f"{i + 1}. \"{r['pattern']}\" (Length: {r['length']} tokens, POS: {r['pos_pattern']})\n")
-
-            f.write("\n---\n")
-            f.write("## POS Discrepancies (Same Word, Different POS)\n")
-            f.write("---\n")
-            if not pos_discrepancies:
-                f.write("No POS discrepancies found.\n")
-            else:
-                f.write("Words with POS Discrepancies:\n")
-                for d in pos_discrepancies:
-                    f.write(f"  Word: \"{d['word']}\"\n")
-                    f.write(f"    Text1 POS: {d['pos_text1']}\n")
-                    f.write(f"    Text2 POS: {d['pos_text2']}\n")
-                    f.write("\n")
-            
-            # --- 新しく追加する句形分析のセクション ---
-            f.write("\n---\n")
-            f.write("## Phrase Pattern Analysis of the Longest Common Pattern\n")
-            f.write("---\n")
-            if not phrase_patterns_analysis:
-                f.write("No phrase patterns identified in the longest common pattern.\n")
-            else:
-                for pp in phrase_patterns_analysis:
-                    f.write(f"  Pattern: \"{pp['pattern']}\"\n")
-                    f.write(f"  Type: {pp['type']}\n")
-                    f.write(f"  Description: {pp['description']}\n")
-                    f.write("\n")
+    model_name = get_model_pool().cache_name(model, text)
+    # Use original casing for better phrase recognition
+    return get_phrase_cache().get_or_compute(
+        text, model_name, lambda: analyze_doc_phrases(get_tagger('spacy', model_name).nlp_for(text)(text)))
+
+
+def analyze_phrase_patterns_many(texts, model=None):
+    """
+    analyze_phrase_patterns for many texts: cached analyses are reused and
+    the misses of each model are parsed in one nlp.pipe batch.
+    Returns one list of records per text.
+    """
+    pool = get_model_pool()
+    by_model = defaultdict(list) # model='auto' ではテキストごとにモデルが変わりうる
+    for i, text in enumerate(texts):
+        by_model[pool.cache_name(model, text)].append(i)
+    results = [None] * len(texts)
+    for model_name, indices in by_model.items():
+        def parse(missed, model_name=model_name):
+            nlp = get_tagger('spacy', model_name).nlp_for()
+            return [analyze_doc_phrases(doc) for doc in nlp.pipe(missed)]
+        analyses = get_phrase_cache().get_or_compute_many([texts[i] for i in indices], model_name, parse)
+        for i, analysis in zip(indices, analyses):
+            results[i] = analysis
+    return results
+
 
+# 句形分析の対象: 最長の共通パターンのみ / 報告するすべての共通パターン
+PHRASE_SCOPES = ('longest', 'all')
+DEFAULT_PHRASE_PATTERN_LIMIT = 200
+
+
+def phrase_pattern_limit():
+    """How many patterns phrase_scope='all' analyzes (PHRASE_PATTERN_LIMIT, default 200)."""
+    return int(os.environ.get('PHRASE_PATTERN_LIMIT', DEFAULT_PHRASE_PATTERN_LIMIT))
+
+
+def analyze_pattern_phrases(pattern_texts, model=None, scope='longest', limit=None):
+    """
+    Phrase analysis of the reported common patterns (texts, longest first).
+    scope='longest' analyzes the first pattern only, as before; scope='all'
+    analyzes the first limit patterns (default: phrase_pattern_limit()) and
+    adds 'source_pattern' to each record.
+    """
+    if scope not in PHRASE_SCOPES:
+        raise ValueError(f"Unknown phrase scope '{scope}'. Choose from: {', '.join(PHRASE_SCOPES)}")
+    if not pattern_texts:
+        return []
+    if scope == 'longest':
+        return analyze_phrase_patterns(pattern_texts[0], model=model)
+    if limit is None:
+        limit = phrase_pattern_limit()
+    pattern_texts = list(pattern_texts[:limit])
+    return [dict(record, source_pattern=text)
+            for text, records in zip(pattern_texts, analyze_phrase_patterns_many(pattern_texts, model=model))
+            for record in records]
+
+
+def write_results_to_file(filepath, common_patterns, pos_discrepancies, phrase_patterns_analysis, fmt='text',
+                          phrase_scope='longest'):
+    """
+    Writes the analysis results to a file.
+    fmt selects the output format ('text', 'jsonl', 'msgpack' or 'parquet');
+    the result arguments may be generators and are written as they are consumed.
+    phrase_scope is the scope the phrase analysis was run with.
+    Returns False (after printing the error) if the file could not be written.
+    """
+    try:
+        with open_sink(filepath, fmt, phrase_scope=phrase_scope) as sink:
+            stream_results(sink, common_patterns, pos_discrepancies, phrase_patterns_analysis)
     except Exception as e:
         print(f"Error writing to file {filepath}: {e}")
+        return False
+    return True
+
+
+def analyze_texts(text1, text2, min_length=1, max_length=None, top_k=None, overlap_first=False,
+                  tagger='spacy', model=None, phrase_scope='longest'):
+    """
+    Runs the whole analysis (tagging, common patterns, POS discrepancies and
+    phrase analysis of the longest common pattern, or of all of them with
+    phrase_scope='all') on two texts.
+    overlap_first=True only tags sentences that can contain a common pattern
+    (see normalize_and_pos_tag_overlapping). tagger selects the POS tagger
+    backend and model the spaCy model; phrase analysis always uses the
+    spaCy parser.
+    Common patterns are mined with the strategy chosen by
+    admission.plan_analysis for the memory / time budget; the plan is
+    returned under 'strategy'.
+    Returns a dict so the result can be passed between processes as-is.
+    """
+    if overlap_first:
+        tokens1, tokens2 = normalize_and_pos_tag_overlapping(text1, text2, min_length=min_length,
+                                                             tagger=tagger, model=model)
+    else:
+        tokens1 = normalize_and_pos_tag(text1, tagger=tagger, model=model)
+        tokens2 = normalize_and_pos_tag(text2, tagger=tagger, model=model)
+
+    plan = plan_analysis(tokens1, tokens2, min_length=min_length, max_length=max_length, top_k=top_k)
+    common_patterns = find_common_patterns_planned(tokens1, tokens2, plan)
+    pos_discrepancies = find_pos_discrepancies_improved(tokens1, tokens2)
+
+    phrase_patterns_analysis = analyze_pattern_phrases([p['pattern'] for p in common_patterns],
+                                                       model=model, scope=phrase_scope)
+
+    return {
+        'common_patterns': common_patterns,
+        'pos_discrepancies': pos_discrepancies,
+        'phrase_patterns_analysis': phrase_patterns_analysis,
+        'strategy': plan,
+    }
 
 # メイン処理
 if __name__ == "__main__":
-    text1_path = 'text1.txt'
-    text2_path = 'text2.txt'
-    output_path = 'out.txt'
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Compare two texts by shared token/POS patterns.")
+    parser.add_argument('text1', nargs='?', default='text1.txt')
+    parser.add_argument('text2', nargs='?', default='text2.txt')
+    parser.add_argument('-o', '--output', default='out.txt')
+    parser.add_argument('--format', default='text', choices=list(SINKS),
+                        help="output format (default: text report; parquet requires pyarrow)")
+    parser.add_argument('--min-length', type=int, default=1, metavar='N',
+                        help="shortest common pattern to report (default: 1)")
+    parser.add_argument('--overlap-first', action='store_true',
+                        help="only POS-tag sentences that share an n-gram of --min-length words with the "
+                             "other text; only saves tagging time with --min-length 3 or more")
+    parser.add_argument('--tagger', default='spacy', choices=list(TAGGERS) + list(TAGGER_ALIASES),
+                        help="POS tagger backend: spacy (accurate), perceptron (fast, needs a trained model) "
+                             "or lexicon (fastest, rules only, low accuracy)")
+    parser.add_argument('--model', default=None,
+                        help="spaCy model name, or 'auto' to pick one from the detected language")
+    parser.add_argument('--phrase-scope', default='longest', choices=PHRASE_SCOPES,
+                        help="analyze the phrases of the longest common pattern or of all of them "
+                             "(at most PHRASE_PATTERN_LIMIT, default 200)")
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help="memory budget for pattern mining (default: ANALYSIS_MEMORY_MB or 1024)")
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS',
+                        help="time budget for pattern mining (default: ANALYSIS_TIME_SECONDS or 300)")
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help="sample the analysis and write collapsed stacks (flamegraph/speedscope) to PATH")
+    parser.add_argument('--workers', type=int, default=None, metavar='N',
+                        help="mine common patterns in N processes (in-memory strategy only)")
+    args = parser.parse_args()
+    if not tagger_available(args.tagger):
+        parser.error(f"tagger '{args.tagger}' has no trained model; train one with: python taggers.py train corpus.txt")
+    if args.min_length < 1:
+        parser.error("--min-length must be at least 1")
+    if not format_available(args.format):
+        parser.error(f"--format {args.format} requires pyarrow; install it with: pip install pyarrow")
+
+    text1_path = args.text1
+    text2_path = args.text2
+    output_path = args.output
 
     # --- 以下のテスト用のダミーテキストファイル生成部分はコメントアウトしました ---
     # with open(text1_path, 'w', encoding='utf-8') as f:
@@ -286,28 +703,63 @@ if __name__ == "__main__":
     if text1_content is None or text2_content is None:
         print("Exiting due to file read errors. Please ensure 'text1.txt' and 'text2.txt' exist in the same directory.") # エラーメッセージを追記
     else:
-        print("Normalizing and POS tagging text1...")
-        tokens1 = normalize_and_pos_tag(text1_content)
-        print("Normalizing and POS tagging text2...")
-        tokens2 = normalize_and_pos_tag(text2_content)
-
-        print("Finding common patterns...")
-        common_patterns = find_common_patterns_improved(tokens1, tokens2)
-
-        print("Finding POS discrepancies...")
-        pos_discrepancies = find_pos_discrepancies_improved(tokens1, tokens2)
-
-        # --- 句形分析の追加部分 ---
-        phrase_patterns_analysis_results = []
-        if common_patterns:
-            # 最長の共通パターン（複数ある場合は最初のもの）を分析対象とする
-            longest_common_pattern_text = common_patterns[0]['pattern']
-            print(f"Analyzing phrase patterns for the longest common pattern: '{longest_common_pattern_text}'...")
-            phrase_patterns_analysis_results = analyze_phrase_patterns(longest_common_pattern_text)
-        else:
-            print("No common patterns found to analyze for phrase patterns.")
-        # --- ここまで ---
+        from profiling import RequestProfile
+        profile = RequestProfile(requested=args.profile is not None).start()
+
+        try:
+            if args.overlap_first:
+                print("Finding overlapping sentences and POS tagging them...")
+                tokens1, tokens2 = normalize_and_pos_tag_overlapping(text1_content, text2_content,
+                                                                     min_length=args.min_length,
+                                                                     tagger=args.tagger, model=args.model)
+            else:
+                print("Normalizing and POS tagging text1...")
+                tokens1 = normalize_and_pos_tag(text1_content, tagger=args.tagger, model=args.model)
+                print("Normalizing and POS tagging text2...")
+                tokens2 = normalize_and_pos_tag(text2_content, tagger=args.tagger, model=args.model)
+
+            plan = plan_analysis(tokens1, tokens2, min_length=args.min_length,
+                                 memory_mb=args.memory_budget, seconds=args.time_budget)
+            print(f"Finding common patterns... strategy: {describe_plan(plan)}")
+            if args.workers and args.workers > 1 and plan['index'] == 'memory':
+                from parallel_mining import find_common_patterns_parallel
+                common_patterns = find_common_patterns_parallel(tokens1, tokens2, min_length=plan['min_length'],
+                                                                max_length=plan['max_length'], top_k=plan['top_k'],
+                                                                workers=args.workers, longest=plan['longest'])
+            else:
+                common_patterns = find_common_patterns_planned(tokens1, tokens2, plan)
+
+            print("Finding POS discrepancies...")
+            pos_discrepancies = find_pos_discrepancies_improved(tokens1, tokens2)
+
+            # --- 句形分析の追加部分 ---
+            phrase_patterns_analysis_results = []
+            if common_patterns and args.phrase_scope == 'all':
+                limit = phrase_pattern_limit()
+                if len(common_patterns) > limit:
+                    print(f"Analyzing phrase patterns for the first {limit} of {len(common_patterns)} common patterns...")
+                else:
+                    print(f"Analyzing phrase patterns for all {len(common_patterns)} common patterns...")
+                phrase_patterns_analysis_results = analyze_pattern_phrases([p['pattern'] for p in common_patterns],
+                                                                           model=args.model, scope='all')
+            elif common_patterns:
+                # 最長の共通パターン（複数ある場合は最初のもの）を分析対象とする
+                longest_common_pattern_text = common_patterns[0]['pattern']
+                print(f"Analyzing phrase patterns for the longest common pattern: '{longest_common_pattern_text}'...")
+                phrase_patterns_analysis_results = analyze_phrase_patterns(longest_common_pattern_text, model=args.model)
+            else:
+                print("No common patterns found to analyze for phrase patterns.")
+            # --- ここまで ---
+
+            print(f"Writing results to {output_path}...")
+            if not write_results_to_file(output_path, common_patterns, pos_discrepancies,
+                                         phrase_patterns_analysis_results, fmt=args.format,
+                                         phrase_scope=args.phrase_scope):
+                sys.exit(1)
+
+            if profile.stop().save(args.profile):
+                print(f"Profile ({profile.elapsed:.2f}s) written to {args.profile}")
+        except ModelNotInstalled as e:
+            sys.exit(str(e))
 
-        print(f"Writing results to {output_path}...")
-        write_results_to_file(output_path, common_patterns, pos_discrepancies, phrase_patterns_analysis_results)
         print("Done.")
\ No newline at end of file